@@ -10,9 +10,14 @@ import numpy as np
 import pandas as pd
 import json
 import os
+import sys
 
 PATH = os.path.dirname(os.path.abspath(__file__))
 
+# The shared ising package lives at the top of the repository.
+sys.path.insert(0, os.path.dirname(os.path.dirname(PATH)))
+from ising.melt_data import MeltDataset
+
 proj_name = "AnkT4V"
 
 den_nsig_const_melt = []
@@ -20,6 +25,7 @@ constructs = (
     []
 )  # List of constructs used to build partition functions in next script
 melts = []  # List of melts to be used in fitting script
+melt_array_dict = {}  # Each melt's array, for the combined dataset
 
 csv_input_df = pd.read_csv(
     "T4Vdata_not_normalized.csv",
@@ -49,6 +55,7 @@ for melt in np.arange(num_melts) + 1:
     np.save(
         PATH + construct_melt, temp_nparray
     )  # Writes an npy file to disk for each melt.
+    melt_array_dict[construct_melt] = temp_nparray
 
     # Generate a list of just the constructs.  The loop removes duplicates.
     for melt in melts:
@@ -60,3 +67,8 @@ with open("{0}{1}_constructs.json".format(PATH, proj_name), "w") as r:
 
 with open("{0}{1}_melts.json".format(PATH, proj_name), "w") as s:
     json.dump(melts, s)
+
+# All melts with float denaturant and signal columns, for the fitters.
+MeltDataset.from_melt_arrays(melts, constructs, melt_array_dict).save(
+    "{0}{1}_dataset.npz".format(PATH, proj_name)
+)
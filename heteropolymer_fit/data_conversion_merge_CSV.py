@@ -9,9 +9,13 @@ import numpy as np
 import pandas as pd
 import json
 import os
+import sys
 
 PATH = os.path.dirname(os.path.abspath(__file__))
-# move to package ising.data imports when complete
+
+# The shared ising package lives at the top of the repository.
+sys.path.insert(0, os.path.dirname(PATH))
+from ising.melt_data import MeltDataset
 
 
 proj_name = "T4V_NRC_2mi"
@@ -21,6 +25,7 @@ constructs = (
     []
 )  # List of constructs used to build partition functions in next script
 melts = []  # List of melts to be used in fitting script
+melt_array_dict = {}  # Each melt's array, for the combined dataset
 
 T4V_input_df = pd.read_csv(
     os.path.join(PATH, "T4Vdata_not_normalized.csv"),
@@ -63,6 +68,7 @@ for melt in np.arange(num_melts) + 1:
         os.path.join(PATH, f"{construct_melt}.npy"), temp_nparray
     )  # Writes an npy file to disk for each melt.
     melts.append(construct_melt)
+    melt_array_dict[construct_melt] = temp_nparray
 
 """ 
 This loop puts melts in order of type (NRxC, NRx, RxC) and length.  This is useful for the
@@ -97,3 +103,8 @@ with open(os.path.join(PATH, f"{proj_name}_constructs.json"), "w") as file:
 
 with open(os.path.join(PATH, f"{proj_name}_melts.json"), "w") as file:
     json.dump(melts, file)
+
+# All melts with float denaturant and signal columns, for the fitters.
+MeltDataset.from_melt_arrays(melts, constructs, melt_array_dict).save(
+    os.path.join(PATH, f"{proj_name}_dataset.npz")
+)
@@ -9,174 +9,226 @@ import numpy as np
 import json
 import time
 import os
+import sys
 
 PATH = os.path.dirname(os.path.abspath(__file__))
 
+# The shared ising package lives at the top of the repository.
+sys.path.insert(0, os.path.dirname(PATH))
+from ising.eqn_cache import ExpressionCache, model_variant
+from ising.symbolic import simplify_expressions, print_timings
+from ising.codegen import write_kernel_module
+from ising.model_spec import load_model_spec
+
 proj_name = "T4V_NRC_2mi"
 
-start = time.time()
+# Repeat types, their dG and m-value parameters, and the interface couplings
+# (see ising/model_spec.py).  Add repeat types and couplings here to fit
+# NRXYC-type libraries.
+model_spec = "heteropolymer_model.json"
+
+# Simplified expressions are cached on disk (see ising/eqn_cache.py), so only
+# constructs that have not been generated before go through sp.simplify.
+use_cache = True
 
-print("\nGenerating partition functions and fraction folded expressions...")
+# Constructs are simplified independently, so they can be spread over
+# several processes.  Set to one for single-core processing.
+numCores = 1
 
-# Parameters for partition function calculation.  Note these are sympy symbols.
+# Parameters for partition function calculation.  Note these are sympy
+# symbols.  The dG's and m's named in the model spec are made in the main
+# block below.
 RT = sp.Symbol("RT")
-dGN = sp.Symbol("dGN")
-dGR = sp.Symbol("dGR")
-dGX = sp.Symbol("dGX")
-dGC = sp.Symbol("dGC")
-dGRR = sp.Symbol("dGRR")
-dGXX = sp.Symbol("dGXX")
-dGXR = sp.Symbol("dGXR")
-dGRX = sp.Symbol("dGRX")
-mR = sp.Symbol("mR")
-mX = sp.Symbol("mX")
 denat = sp.Symbol("denat")
-KN = sp.Symbol("KN")
-KR = sp.Symbol("KR")
-KX = sp.Symbol("KX")
-KC = sp.Symbol("KC")
-TRR = sp.Symbol("TRR")
-TXX = sp.Symbol("TXX")
-TXR = sp.Symbol("TXR")
-TRX = sp.Symbol("TRX")
 
 exp = sp.Function("np.exp")
 
-with open(os.path.join(PATH, f"{proj_name}_constructs.json"), "r") as cons:
-    constructs = json.load(cons)
-
-# define weight matricies and end vectors to be used to calculate partition functions
-begin = sp.Matrix([[0, 1]])
-woN = sp.Matrix(
-    [[KN, 1], [KN, 1]]
-)  # Leave off coupling term.  No zeroth repeat
-woR = sp.Matrix(
-    [[KR, 1], [KR, 1]]
-)  # Leave off coupling term.  No zeroth repeat
-woX = sp.Matrix(
-    [[KX, 1], [KX, 1]]
-)  # Leave off coupling term.  No zeroth repeat
-
-wnR = sp.Matrix(
-    [[KR * TRR, 1], [KR, 1]]
-)  # Treat coupling same as an rR interface, as usual
-wrR = sp.Matrix([[KR * TRR, 1], [KR, 1]])  # Same as wnR above
-wxR = sp.Matrix([[KR * TXR, 1], [KR, 1]])
-
-wnX = sp.Matrix([[KX * TRX, 1], [KX, 1]])  # Different coupling than
-wrX = sp.Matrix([[KX * TRX, 1], [KX, 1]])  # Different coupling than wnX above
-wxX = sp.Matrix([[KX * TXX, 1], [KX, 1]])
-
-wrC = sp.Matrix(
-    [[KC * TRR, 1], [KC, 1]]
-)  # Treat copuling same as an rR interface, as usual
-wxC = sp.Matrix([[KC * TXR, 1], [KC, 1]])
-
-end = sp.Matrix([[1], [1]])
-
-# Build a dictionary of these matrices
-w_dict = {
-    "oN": woN,
-    "oR": woR,
-    "oX": woX,
-    "nR": wnR,
-    "rR": wrR,
-    "xR": wxR,
-    "nX": wnX,
-    "rX": wrX,
-    "xX": wxX,
-    "rC": wrC,
-    "xC": wxC,
-}
-
-# Build dictionaries of partition functions, partial derivs with respect
-# to K, and fraction folded.
-
-q_dict = {}
-dqdKN_dict = {}
-dqdKR_dict = {}
-dqdKX_dict = {}
-dqdKC_dict = {}
-frac_folded_dict = {}
-
-# Number of repeats of each type.  Seems like they should be floats, but
-# I get an error in the matrix multiplication (q_dict) if they are declared to be.
-
-
-for construct in constructs:
-
-    # Make partition function dictionary and expressions for fraction folded.
-    # Note, only one pf is generated per construct, even when there are multiple melts.
 
+# Labels of the weight matrices for a construct, in order.  The first repeat
+# has no coupling term (there is no zeroth repeat), so its matrix is labelled
+# by the repeat alone; the rest are labelled by previous and current repeat,
+# as in the couplings of the model spec.
+def matrix_labels(construct):
     repeat_list = construct.split("_")
-    repeat_list.insert(0, "o")
-
-    pairs_list = []
-    i = 1
-    while i < len(repeat_list):
-        pair = (
-            repeat_list[i - 1].lower() + repeat_list[i]
-        )  # Need to convert prev rept to lower case
-        pairs_list.append(pair)
-        i = i + 1
-
-    q_dict[construct + "_q"] = begin
-
-    for pair in pairs_list:
-        q_dict[construct + "_q"] = q_dict[construct + "_q"] * w_dict[pair]
-
-    q_dict[construct + "_q"] = q_dict[construct + "_q"] * end
-
-    # Next two lines convert from sp.Matrix to np.array to something else.
-    # Not sure the logic here, but it works.
-    q_dict[construct + "_q"] = np.array(q_dict[construct + "_q"])
-    q_dict[construct + "_q"] = q_dict[construct + "_q"].item(0)
-
-    # Partial derivs wrt KN dictionary.
-    dqdKN_dict[construct + "_dqdKN"] = sp.diff(q_dict[construct + "_q"], KN)
-
-    # Partial derivs wrt KR dictionary.
-    dqdKR_dict[construct + "_dqdKR"] = sp.diff(q_dict[construct + "_q"], KR)
-
-    # Partial derivs wrt KX dictionary.
-    dqdKX_dict[construct + "_dqdKX"] = sp.diff(q_dict[construct + "_q"], KX)
-
-    # Partial derivs wrt KC dictionary.
-    dqdKC_dict[construct + "_dqdKC"] = sp.diff(q_dict[construct + "_q"], KC)
-
-    # Fraction folded dictionary.
-    frac_folded_dict[construct + "_frac_folded"] = (
-        KN / (q_dict[construct + "_q"]) * dqdKN_dict[construct + "_dqdKN"]
-        + KR / (q_dict[construct + "_q"]) * dqdKR_dict[construct + "_dqdKR"]
-        + KX / (q_dict[construct + "_q"]) * dqdKX_dict[construct + "_dqdKX"]
-        + KC / (q_dict[construct + "_q"]) * dqdKC_dict[construct + "_dqdKC"]
-    ) / (len(pairs_list))
-
-# The loop below replaces K's and W's the fraction folded terms in the
-# dictionary with DGs, ms, and denaturant concentrations.  The simplify line
-# is really important for making compact expressions for fraction folded.
-# This simplification greatly speeds up fitting.  The last line
-# converts from a sympy object to a string, to allow for json dump.
-
-for construct in frac_folded_dict:
-    frac_folded_dict[construct] = frac_folded_dict[construct].subs(
-        {
-            KN: (exp(-((dGN + (mR * denat)) / RT))),
-            KR: (exp(-((dGR + (mR * denat)) / RT))),
-            KX: (exp(-((dGX + (mX * denat)) / RT))),
-            KC: (exp(-((dGC + (mR * denat)) / RT))),
-            TRR: (exp(-dGRR / RT)),
-            TXX: (exp(-dGXX / RT)),
-            TXR: (exp(-dGXR / RT)),
-            TRX: (exp(-dGRX / RT)),
-        }
+    labels = [repeat_list[0]]
+    for i in range(1, len(repeat_list)):
+        labels.append(repeat_list[i - 1] + "_" + repeat_list[i])
+    return labels
+
+
+if __name__ == "__main__":
+    start = time.time()
+
+    print(
+        "\nGenerating partition functions and fraction folded expressions..."
     )
-    frac_folded_dict[construct] = sp.simplify(frac_folded_dict[construct])
-    frac_folded_dict[construct] = str(frac_folded_dict[construct])
 
-with open(os.path.join(PATH, f"{proj_name}_frac_folded_dict.json"), "w") as f:
-    json.dump(frac_folded_dict, f)
+    with open(os.path.join(PATH, f"{proj_name}_constructs.json"), "r") as cons:
+        constructs = json.load(cons)
+
+    spec = load_model_spec(os.path.join(PATH, model_spec))
+    repeats = spec["repeats"]
+    couplings = spec["couplings"]
+
+    # One equilibrium constant symbol per repeat type and one weight symbol
+    # per coupling parameter, with substitutions from these to dG's, m's,
+    # and denaturant concentrations.
+    K_dict = {rpt: sp.Symbol("K" + rpt) for rpt in repeats}
+    T_dict = {name: sp.Symbol("T_" + name) for name in couplings.values()}
+    subs_dict = {}
+    for rpt, (dG, m) in repeats.items():
+        subs_dict[K_dict[rpt]] = exp(
+            -((sp.Symbol(dG) + (sp.Symbol(m) * denat)) / RT)
+        )
+    for name in T_dict:
+        subs_dict[T_dict[name]] = exp(-sp.Symbol(name) / RT)
+
+    # define weight matricies and end vectors to be used to calculate
+    # partition functions.  Only the matrices that the constructs actually
+    # use are built.
+    begin = sp.Matrix([[0, 1]])
+    end = sp.Matrix([[1], [1]])
+    w_dict = {}
+    for construct in constructs:
+        for label in matrix_labels(construct):
+            if label in w_dict:
+                continue
+            prev, _, rpt = label.rpartition("_")
+            if rpt not in repeats:
+                raise ValueError(
+                    f"Repeat type '{rpt}' in construct {construct} is not in "
+                    f"{model_spec}"
+                )
+            K = K_dict[rpt]
+            if not prev:
+                w_dict[label] = sp.Matrix([[K, 1], [K, 1]])
+            elif (prev, rpt) in couplings:
+                T = T_dict[couplings[(prev, rpt)]]
+                w_dict[label] = sp.Matrix([[K * T, 1], [K, 1]])
+            else:
+                raise ValueError(
+                    f"No coupling for the {label} interface in construct "
+                    f"{construct} in {model_spec}"
+                )
+
+    # Each construct's cache entry depends only on the matrices it uses and
+    # the substitutions for their symbols, so unrelated changes to the spec
+    # do not throw away cached expressions.
+    variant_dict = {}
+    for construct in constructs:
+        matrices = {label: w_dict[label] for label in matrix_labels(construct)}
+        symbols = set().union(*[w.free_symbols for w in matrices.values()])
+        variant_dict[construct] = model_variant(
+            "heteropolymer",
+            dict(matrices, begin=begin, end=end),
+            {k: v for k, v in subs_dict.items() if k in symbols},
+        )
+
+    # Look up constructs that have already been generated for this model.
+    cached_dict = {}
+    if use_cache:
+        cache = ExpressionCache()
+        for construct in constructs:
+            cached = cache.get(construct, variant_dict[construct])
+            if cached is not None:
+                cached_dict[construct + "_frac_folded"] = cached
+        print(
+            "Found {} of {} constructs in the cache at {}".format(
+                len(cached_dict), len(constructs), cache.cache_dir
+            )
+        )
+
+    # Build dictionaries of partition functions, partial derivs with respect
+    # to K, and fraction folded.
+
+    q_dict = {}
+    dqdK_dict = {}
+    frac_folded_dict = {}
+
+    for construct in constructs:
+        if construct + "_frac_folded" in cached_dict:
+            continue
+
+        # Make partition function dictionary and expressions for fraction folded.
+        # Note, only one pf is generated per construct, even when there are multiple melts.
+
+        labels = matrix_labels(construct)
+        q_dict[construct + "_q"] = begin
+
+        for label in labels:
+            q_dict[construct + "_q"] = q_dict[construct + "_q"] * w_dict[label]
+
+        q_dict[construct + "_q"] = q_dict[construct + "_q"] * end
+
+        # Next two lines convert from sp.Matrix to np.array to something else.
+        # Not sure the logic here, but it works.
+        q_dict[construct + "_q"] = np.array(q_dict[construct + "_q"])
+        q_dict[construct + "_q"] = q_dict[construct + "_q"].item(0)
+
+        # Partial derivs wrt the K of each repeat type in the construct.
+        # Repeat types that do not appear contribute nothing.
+        q = q_dict[construct + "_q"]
+        frac_folded = 0
+        for rpt in repeats:
+            if rpt not in construct.split("_"):
+                continue
+            dqdK_dict[construct + "_dqdK" + rpt] = sp.diff(q, K_dict[rpt])
+            frac_folded = (
+                frac_folded
+                + K_dict[rpt] / q * dqdK_dict[construct + "_dqdK" + rpt]
+            )
+
+        # Fraction folded dictionary.
+        frac_folded_dict[construct + "_frac_folded"] = frac_folded / (
+            len(labels)
+        )
+
+    # The loop below replaces K's and W's the fraction folded terms in the
+    # dictionary with DGs, ms, and denaturant concentrations.  The simplify
+    # step is really important for making compact expressions for fraction
+    # folded.  This simplification greatly speeds up fitting.  It also
+    # converts from a sympy object to a string, to allow for json dump.
+    # New expressions are then stored in the cache.
+
+    for construct in frac_folded_dict:
+        frac_folded_dict[construct] = frac_folded_dict[construct].subs(
+            subs_dict
+        )
+    frac_folded_dict, simplify_times = simplify_expressions(
+        frac_folded_dict, numCores
+    )
+    print_timings(simplify_times)
+
+    for construct in frac_folded_dict:
+        if use_cache:
+            cache.put(
+                construct[: -len("_frac_folded")],
+                variant_dict[construct[: -len("_frac_folded")]],
+                frac_folded_dict[construct],
+            )
+
+    # Merge with the cached expressions, keeping the order of the constructs.
+    frac_folded_dict.update(cached_dict)
+    frac_folded_dict = {
+        key: frac_folded_dict[key]
+        for key in [construct + "_frac_folded" for construct in constructs]
+    }
+
+    with open(
+        os.path.join(PATH, f"{proj_name}_frac_folded_dict.json"), "w"
+    ) as f:
+        json.dump(frac_folded_dict, f)
+
+    # Write the same expressions as an importable module of vectorized
+    # functions, with common subexpressions (mainly the exponentials)
+    # computed once.  The fitters use this instead of eval'ing the strings.
+    write_kernel_module(
+        os.path.join(PATH, f"{proj_name}_ff_kernels.py"),
+        frac_folded_dict,
+        spec["param_names"],
+        "generate_fitting_eqns_heteropolymer.py",
+    )
 
-stop = time.time()
-runtime = stop - start
-print("\nThe elapsed time was " + str(runtime) + " sec")
+    stop = time.time()
+    runtime = stop - start
+    print("\nThe elapsed time was " + str(runtime) + " sec")
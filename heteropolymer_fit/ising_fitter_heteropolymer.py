@@ -7,19 +7,64 @@ correlations, and plots histograms and parameter correlation plots.
 
 
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
-import lmfit, json
+import json
 import csv
 import time
 import os
+import sys
 
 PATH = os.path.dirname(os.path.abspath(__file__))
 
+# The shared ising package lives at the top of the repository.
+sys.path.insert(0, os.path.dirname(PATH))
+from ising.bootstrap import ReplicateLog, read_replicate_rows, write_rows
+from ising.bootstrap import monte_carlo_errors
+from ising.melt_data import MeltDataset
+from ising.model_spec import load_model_spec, param_kinds, spec_model
+from ising.objective import BootstrapReplicates, MeltObjective
+
 proj_name = "T4V_NRC_2mi"
+numCores = 4  # Cores to use for bootstrapping
+
+# Repeat types and couplings (the same spec file the generator script uses).
+model_spec = "heteropolymer_model.json"
+
+# The options below are described in the README and in ising/objective.py.
+# How fraction folded is calculated: "kernels" (needs the generator script's
+# {proj_name}_ff_kernels.py), "expressions", "transfer_matrix",
+# "log_transfer_matrix", "trie" or "numba".
+ff_engine = "kernels"
+
+# "lmfit" or "least_squares".
+fit_engine = "lmfit"
+
+# Solve for each melt's baselines by linear least squares at every step, so
+# the optimizer only varies the thermodynamic parameters.
+variable_projection = False
+
+# Start each bootstrap fit from the best fit rather than the initial guesses.
+bootstrap_warm_start = True
+
+# Seed for the bootstrap resampling.  None picks a fresh one, which is
+# printed so that the run can be repeated.
+bootstrap_seed = 0
 
-# FITTING THE DATA
-print("\nFitting the data...\n")
+# Keep the replicates in {proj_name}_bootstrap_params.csv from a stopped run
+# with the same bootstrap_seed, and only run the missing iterations.
+bootstrap_resume = False
+
+# Stop once more replicates would change no bootstrap statistic by more than
+# bootstrap_tolerance of its parameter's stdev (0.1, say), checking every
+# bootstrap_batch replicates.  None always runs the number entered.
+bootstrap_tolerance = None
+bootstrap_batch = 100
+
+# How the bootstrap worker processes are started: "fork", "spawn",
+# "forkserver", or None for the platform's default.
+bootstrap_start_method = None
 
 start = time.time()
 
@@ -28,898 +73,795 @@ plt.clf
 
 RT = 0.001987 * 298.15  #  R in kcal/mol/K, T in Kelvin.
 
-#  Dictionary of frac folded eqns from partition function generator script.
-with open(
-    os.path.join(PATH, f"{proj_name}_frac_folded_dict.json"), "r"
-) as file:
-    frac_folded_dict = json.load(file)
+# CREATE INITIAL GUESSES
+# First, thermodynamic parameters.  These are Global, one for each parameter
+# of the model spec, in the spec's order.  Guesses are set by name; a spec
+# parameter that is not listed in thermo_guesses starts from the guess for
+# its kind in kind_guesses.
+thermo_guesses = {
+    "dGN": 5,
+    "dGR": 4,
+    "dGX": 5,
+    "dGC": 6,
+    "dGRR": -11,
+    "dGXX": -10,
+    "dGRX": -10,
+    "dGXR": -10,
+    "mR": 0.8,
+    "mX": 0.8,
+}
+kind_guesses = {"dG": 5, "coupling": -10, "m": 0.8}
+
+# Next, baseline parameters.  These are local, one of each kind per melt.
+baseline_guesses = {"af": 0.02, "bf": 1, "au": 0.0, "bu": 0.0}
+
 
-with open(
-    os.path.join(PATH, f"{proj_name}_constructs.json"), "r"
-) as construct:
-    constructs = json.load(construct)
+if __name__ == "__main__":
+    # Set up here rather than at import, since bootstrap workers started by
+    # spawn or forkserver import this script.  They get the data from shared
+    # memory instead (see ising/objective.py).
+    with open(
+        os.path.join(PATH, f"{proj_name}_constructs.json"), "r"
+    ) as construct:
+        constructs = json.load(construct)
 
-with open(os.path.join(PATH, f"{proj_name}_melts.json"), "r") as m:
-    melts = json.load(m)
+    with open(os.path.join(PATH, f"{proj_name}_melts.json"), "r") as m:
+        melts = json.load(m)
 
-num_melts = len(melts)
-num_constructs = len(constructs)
+    num_melts = len(melts)
+    num_constructs = len(constructs)
 
-melt_data_dict = {}
-for melt in melts:
-    melt_data_dict[melt] = np.load(
-        os.path.join(PATH, f"{melt}.npy"), allow_pickle=True
+    # Denaturant and normalized signal for every melt, as float columns (see
+    # ising/melt_data.py), written by the data conversion script.
+    dataset = MeltDataset.load(
+        os.path.join(PATH, f"{proj_name}_dataset.npz")
     )
 
-# Compile fraction folded expressions.
-comp_frac_folded_dict = {}
-for construct in constructs:
-    frac_folded_string = frac_folded_dict[construct + "_frac_folded"]
-    comp_frac_folded = compile(
-        frac_folded_string, "{}_comp_ff".format(construct), "eval"
+    spec = load_model_spec(os.path.join(PATH, model_spec))
+
+    # Residuals, Jacobian and fits of the model for every melt (see
+    # ising/objective.py).
+    melt_objective = MeltObjective(
+        dataset,
+        spec_model(spec, constructs, RT),
+        os.path.join(PATH, proj_name),
+        ff_engine,
+        fit_engine,
+        variable_projection,
     )
-    comp_frac_folded_dict[construct + "_comp_ff"] = comp_frac_folded
 
-# CREATE INITIAL GUESSES
-# First, thermodynamic parameters.  These are Global.
-init_guesses = lmfit.Parameters()
-init_guesses.add("dGN", value=5)
-init_guesses.add("dGR", value=4)
-init_guesses.add("dGX", value=5)
-init_guesses.add("dGC", value=6)
-init_guesses.add("dGRR", value=-11)
-init_guesses.add("dGXX", value=-10)
-init_guesses.add("dGRX", value=-10)
-init_guesses.add("dGXR", value=-10)
-init_guesses.add("mR", value=0.8)
-init_guesses.add("mX", value=0.8)
-
-# Next, baseline parameters.  These are local.
-for melt in melts:
-    init_guesses.add("af_{}".format(melt), value=0.02)
-    init_guesses.add("bf_{}".format(melt), value=1)
-    init_guesses.add("au_{}".format(melt), value=0.0)
-    init_guesses.add("bu_{}".format(melt), value=0.0)
-
-# Transfers init_guesses to params for fitting, but init_guesses are maintained.
-params = init_guesses
-
-
-def fitting_function(params, denat, frac_folded, melt):
-    af = params["af_{}".format(melt)].value
-    bf = params["bf_{}".format(melt)].value
-    au = params["au_{}".format(melt)].value
-    bu = params["bu_{}".format(melt)].value
-    dGN = params["dGN"].value
-    dGR = params["dGR"].value
-    dGX = params["dGX"].value
-    dGC = params["dGC"].value
-    dGRR = params["dGRR"].value
-    dGXX = params["dGXX"].value
-    dGRX = params["dGRX"].value
-    dGXR = params["dGXR"].value
-    mR = params["mR"].value
-    mX = params["mX"].value
-    return ((af * denat) + bf) * frac_folded + (
-        ((au * denat) + bu) * (1 - frac_folded)
+    init_guesses = melt_objective.make_params(
+        {
+            name: thermo_guesses.get(name, kind_guesses[kind])
+            for name, kind in param_kinds(spec).items()
+        },
+        baseline_guesses,
     )
 
+    # FITTING THE DATA
+    print("\nFitting the data...\n")
 
-# Objective function creates an array of residuals to be used by lmfit minimize.
-def objective(params):
-    resid_dict = {}
-    dGN = params["dGN"].value
-    dGR = params["dGR"].value
-    dGC = params["dGC"].value
-    dGX = params["dGX"].value
-    dGRR = params["dGRR"].value
-    dGXX = params["dGXX"].value
-    dGRX = params["dGRX"].value
-    dGXR = params["dGXR"].value
-    mR = params["mR"].value
-    mX = params["mX"].value
-    for melt in melts:
-        denat = melt_data_dict[melt][:, 0]  # A numpy array of type str
-        norm_sig = melt_data_dict[melt][:, 1]  # A numpy array of type str
-        denat = denat.astype(float)  # A numpy array of type float
-        norm_sig = norm_sig.astype(float)  # A numpy array of type float
-        string_to_eval = comp_frac_folded_dict[melt[:-2] + "_comp_ff"]
-        frac_folded = eval(string_to_eval)
-        af = params["af_{}".format(melt)].value
-        bf = params["bf_{}".format(melt)].value
-        au = params["au_{}".format(melt)].value
-        bu = params["bu_{}".format(melt)].value
-        resid = norm_sig - fitting_function(params, denat, frac_folded, melt)
-        resid_dict[melt + "_resid"] = resid
-    residuals = np.concatenate(list(resid_dict.values()))
-    return residuals
-
-
-# Fit with lmfit
-result = lmfit.minimize(objective, init_guesses)
-fit_resid = result.residual
-
-# Print out features of the data, the fit, and optimized param values
-print(("There are a total of {} data sets.".format(num_melts)))
-print(("There are {} observations.".format(result.ndata)))
-print(("There are {} fitted parameters.".format(result.nvarys)))
-print(("There are {} degrees of freedom. \n".format(result.nfree)))
-print(
-    ("The sum of squared residuals (SSR) is: {0:7.4f}".format(result.chisqr))
-)
-print(("The reduced SSR (SSR/DOF): {0:8.6f} \n".format(result.redchi)))
-
-dGN = result.params["dGN"].value
-dGR = result.params["dGR"].value
-dGX = result.params["dGX"].value
-dGC = result.params["dGC"].value
-dGRR = result.params["dGRR"].value
-dGXX = result.params["dGXX"].value
-dGRX = result.params["dGRX"].value
-dGXR = result.params["dGXR"].value
-mR = result.params["mR"].value
-mX = result.params["mX"].value
-
-print("Optimized parameter values:")
-print("dGN = {0:8.4f}".format(result.params["dGN"].value))
-print("dGR = {0:8.4f}".format(result.params["dGR"].value))
-print("dGX ={0:8.4f}".format(result.params["dGX"].value))
-print("dGC ={0:8.4f}".format(result.params["dGC"].value))
-print("dGRR ={0:8.4f}".format(result.params["dGRR"].value))
-print("dGXX ={0:8.4f}".format(result.params["dGXX"].value))
-print("dGRX ={0:8.4f}".format(result.params["dGRX"].value))
-print("dGXR ={0:8.4f}".format(result.params["dGXR"].value))
-print("mR ={0:8.4f}".format(result.params["mR"].value))
-print("mX ={0:8.4f}".format(result.params["mX"].value))
-
-print("\nWriting best fit parameter and baseline files")
-
-# Compile a list of optimized Ising params and write to file.
-fitted_ising_params = [
-    ["dGN", result.params["dGN"].value],
-    ["dGR", result.params["dGR"].value],
-    ["dGX", result.params["dGX"].value],
-    ["dGC", result.params["dGC"].value],
-    ["dGRR", result.params["dGRR"].value],
-    ["dGXX", result.params["dGXX"].value],
-    ["dGRX", result.params["dGRX"].value],
-    ["dGXR", result.params["dGXR"].value],
-    ["mR", result.params["mR"].value],
-    ["mX", result.params["mX"].value],
-    ["Chi**2", result.chisqr],
-    ["RedChi", result.redchi],
-]
-
-with open(
-    os.path.join(PATH, f"{proj_name}_fitted_Ising_params.csv"), "w"
-) as n:
-    writer = csv.writer(n, delimiter=",")
-    writer.writerows(fitted_ising_params)
-n.close()
-
-# Compile a list of optimized baseline params and write to file.
-fitted_base_params = []
-for melt in melts:
-    af = result.params["af_%s" % (melt)].value
-    bf = result.params["bf_%s" % (melt)].value
-    au = result.params["au_%s" % (melt)].value
-    bu = result.params["bu_%s" % (melt)].value
-    fitted_base_params.append([melt, af, bf, au, bu])
-with open(
-    os.path.join(PATH, f"{proj_name}_fitted_baseline_params.csv"), "w"
-) as m:
-    writer = csv.writer(m, delimiter=",")
-    writer.writerows(fitted_base_params)
-m.close()
-
-stop = time.time()
-runtime = stop - start
-print(("\nThe elapsed time was " + str(runtime) + " sec"))
-
-
-##  MAKE PLOTS OF DATA AND FITS
-
-print("\nPlotting results...\n")
-
-# The function "baseline_adj" gives an adjusted y value based on fitted baseline
-# parameters (fraction folded).
-def baseline_adj(y, x, params, construct):
-    af = result.params["af_{}".format(construct)].value
-    bf = result.params["bf_{}".format(construct)].value
-    au = result.params["au_{}".format(construct)].value
-    bu = result.params["bu_{}".format(construct)].value
-    return (y - (bu + (au * x))) / ((bf + (af * x)) - (bu + (au * x)))
-
-
-# Defining global best-fit parameters
-dGN = result.params["dGN"].value
-dGR = result.params["dGR"].value
-dGX = result.params["dGX"].value
-dGC = result.params["dGC"].value
-dGRR = result.params["dGRR"].value
-dGXX = result.params["dGXX"].value
-dGRX = result.params["dGRX"].value
-dGXR = result.params["dGXR"].value
-mR = result.params["mR"].value
-mX = result.params["mX"].value
-
-# The function fit_model used for plotting best-fit lines and for adding
-# residuals to best-fit lines in bootstrapping.  Normalized, not frac folded.
-def fit_model(params, x, melt):
-    denat = x
-    af = result.params["af_{}".format(melt)].value
-    bf = result.params["bf_{}".format(melt)].value
-    au = result.params["au_{}".format(melt)].value
-    bu = result.params["bu_{}".format(melt)].value
-    frac_folded = eval(comp_frac_folded_dict[melt[:-2] + "_comp_ff"])
-    return ((af * denat) + bf) * frac_folded + (
-        ((au * denat) + bu) * (1 - frac_folded)
+    # Fit with lmfit
+    result, fit_record = melt_objective.fit(init_guesses, "best fit")
+    fit_resid = result.residual
+
+    # Print out features of the data, the fit, and optimized param values
+    print(("There are a total of {} data sets.".format(num_melts)))
+    print(("There are {} observations.".format(result.ndata)))
+    print(("There are {} fitted parameters.".format(result.nvarys)))
+    print(("There are {} degrees of freedom. \n".format(result.nfree)))
+    print(
+        (
+            "The sum of squared residuals (SSR) is: {0:7.4f}".format(
+                result.chisqr
+            )
+        )
     )
+    print(("The reduced SSR (SSR/DOF): {0:8.6f} \n".format(result.redchi)))
 
+    print("Optimized parameter values:")
+    for name in melt_objective.param_names:
+        print("{0} = {1:8.4f}".format(name, result.params[name].value))
 
-# Finding the maximum denaturant value out of all the melts to
-# set x axis bound
-denat_maxer = np.zeros(0)
-for melt in melts:
-    denat_maxer = np.concatenate((denat_maxer, melt_data_dict[melt][:, 0]))
-denat_maxer_list = denat_maxer.tolist()
-denat_max = float(max(denat_maxer_list))
-denat_bound = np.around(denat_max, 1) + 0.2
-
-# Denaturant values to use when evaluating fits.  Determines how smooth the
-# fitted curve will be, based on the third value (300) in the argument below.
-# I might keep using this for fraction_foldeed, but for nomralized baseline
-# use a local set of points for each melt, so as not to extrapolate the
-# bselines too far.
-denat_fit = np.linspace(0, denat_bound, 300)
-
-# defining a dictionary using the first melt of each construct (construct_1)
-# Move this to the plotting part, and why not do this for all constructs?
-construct1_data_dict = {}
-for construct in constructs:
-    construct1_data_dict[construct] = np.load(
-        os.path.join(PATH, f"{construct}_1.npy")
-    )
+    print("\nWriting best fit parameter and baseline files")
 
-# The four dictionaries below define lower and upper denaturant limnits to be
-# used for plotting normalized curves, so crazy-long baseline extrapolations
-# are not shown.  Do both for melts and construct 1.   These are then used
-# to create 300-point synthetic baselines in the fifth and sixth dictionaries.
-melt_lower_denat_dict = {}
-for melt in melts:
-    melt_lower_denat_dict[melt] = (
-        round(float(min(melt_data_dict[melt][:, 0]))) - 0.2
-    )
+    # Compile a list of optimized Ising params and write to file.
+    fitted_ising_params = [
+        [name, result.params[name].value]
+        for name in melt_objective.param_names
+    ] + [["Chi**2", result.chisqr], ["RedChi", result.redchi]]
 
-melt_upper_denat_dict = {}
-for melt in melts:
-    melt_upper_denat_dict[melt] = (
-        round(float(max(melt_data_dict[melt][:, 0]))) + 0.2
-    )
+    with open(
+        os.path.join(PATH, f"{proj_name}_fitted_Ising_params.csv"), "w"
+    ) as n:
+        writer = csv.writer(n, delimiter=",")
+        writer.writerows(fitted_ising_params)
+    n.close()
 
-construct1_lower_denat_dict = {}
-for construct in constructs:
-    construct1_lower_denat_dict[construct] = (
-        round(float(min(construct1_data_dict[construct][:, 0]))) - 0.2
+    # Compile a list of optimized baseline params and write to file.
+    fitted_base_params = []
+    for melt in melts:
+        af = result.params["af_%s" % (melt)].value
+        bf = result.params["bf_%s" % (melt)].value
+        au = result.params["au_%s" % (melt)].value
+        bu = result.params["bu_%s" % (melt)].value
+        fitted_base_params.append([melt, af, bf, au, bu])
+    with open(
+        os.path.join(PATH, f"{proj_name}_fitted_baseline_params.csv"), "w"
+    ) as m:
+        writer = csv.writer(m, delimiter=",")
+        writer.writerows(fitted_base_params)
+    m.close()
+    melt_objective.telemetry.write(
+        os.path.join(PATH, f"{proj_name}_fit_telemetry.json")
     )
 
-construct1_upper_denat_dict = {}
-for construct in constructs:
-    construct1_upper_denat_dict[construct] = (
-        round(float(max(construct1_data_dict[construct][:, 0]))) + 0.2
-    )
+    stop = time.time()
+    runtime = stop - start
+    print(("\nThe elapsed time was " + str(runtime) + " sec"))
+
+    ##  MAKE PLOTS OF DATA AND FITS
+
+    print("\nPlotting results...\n")
+
+    # The function "baseline_adj" gives an adjusted y value based on fitted baseline
+    # parameters (fraction folded).
+    def baseline_adj(y, x, params, construct):
+        af = result.params["af_{}".format(construct)].value
+        bf = result.params["bf_{}".format(construct)].value
+        au = result.params["au_{}".format(construct)].value
+        bu = result.params["bu_{}".format(construct)].value
+        return (y - (bu + (au * x))) / ((bf + (af * x)) - (bu + (au * x)))
+
+    # The function fit_model used for plotting best-fit lines and for adding
+    # residuals to best-fit lines in bootstrapping.  Normalized, not frac folded.
+    def fit_model(params, x, melt):
+        denat = x
+        af = result.params["af_{}".format(melt)].value
+        bf = result.params["bf_{}".format(melt)].value
+        au = result.params["au_{}".format(melt)].value
+        bu = result.params["bu_{}".format(melt)].value
+        frac_folded = melt_objective.frac_folded(params, denat, melt[:-2])
+        return ((af * denat) + bf) * frac_folded + (
+            ((au * denat) + bu) * (1 - frac_folded)
+        )
 
-melt_denat_synthetic_dict = {}
-for melt in melts:
-    melt_denat_synthetic_dict[melt] = np.linspace(
-        melt_lower_denat_dict[melt], melt_upper_denat_dict[melt], 300
-    )
+    # Finding the maximum denaturant value out of all the melts to
+    # set x axis bound
+    denat_maxer = np.zeros(0)
+    for melt in melts:
+        denat_maxer = np.concatenate((denat_maxer, dataset.melt_denat(melt)))
+    denat_maxer_list = denat_maxer.tolist()
+    denat_max = float(max(denat_maxer_list))
+    denat_bound = np.around(denat_max, 1) + 0.2
+
+    # Denaturant values to use when evaluating fits.  Determines how smooth the
+    # fitted curve will be, based on the third value (300) in the argument below.
+    # I might keep using this for fraction_foldeed, but for nomralized baseline
+    # use a local set of points for each melt, so as not to extrapolate the
+    # bselines too far.
+    denat_fit = np.linspace(0, denat_bound, 300)
+
+    # defining a dictionary using the first melt of each construct (construct_1)
+    # Move this to the plotting part, and why not do this for all constructs?
+    construct1_data_dict = {}
+    for construct in constructs:
+        construct1_data_dict[construct] = np.load(
+            os.path.join(PATH, f"{construct}_1.npy")
+        )
 
-construct1_denat_synthetic_dict = {}
-for construct in constructs:
-    construct1_denat_synthetic_dict[construct] = np.linspace(
-        construct1_lower_denat_dict[construct],
-        construct1_upper_denat_dict[construct],
-        300,
-    )
+    # The four dictionaries below define lower and upper denaturant limnits to be
+    # used for plotting normalized curves, so crazy-long baseline extrapolations
+    # are not shown.  Do both for melts and construct 1.   These are then used
+    # to create 300-point synthetic baselines in the fifth and sixth dictionaries.
+    melt_lower_denat_dict = {}
+    for melt in melts:
+        melt_lower_denat_dict[melt] = (
+            round(float(min(dataset.melt_denat(melt)))) - 0.2
+        )
 
-""" Global Plot Aesthetics"""
-# Defining how the plots are colored
-num_melt_colors = num_melts
-num_construct_colors = num_constructs
-coloration = plt.get_cmap("hsv")
+    melt_upper_denat_dict = {}
+    for melt in melts:
+        melt_upper_denat_dict[melt] = (
+            round(float(max(dataset.melt_denat(melt)))) + 0.2
+        )
 
+    construct1_lower_denat_dict = {}
+    for construct in constructs:
+        construct1_lower_denat_dict[construct] = (
+            round(float(min(construct1_data_dict[construct][:, 0]))) - 0.2
+        )
 
-# Dictonary defining title font
-title_font = {
-    "family": "arial",
-    "color": "black",
-    "weight": "normal",
-    "size": 16,
-}
+    construct1_upper_denat_dict = {}
+    for construct in constructs:
+        construct1_upper_denat_dict[construct] = (
+            round(float(max(construct1_data_dict[construct][:, 0]))) + 0.2
+        )
 
-# Dictionary defining label font
-label_font = {
-    "family": "arial",
-    "color": "black",
-    "weight": "normal",
-    "size": 14,
-}
+    melt_denat_synthetic_dict = {}
+    for melt in melts:
+        melt_denat_synthetic_dict[melt] = np.linspace(
+            melt_lower_denat_dict[melt], melt_upper_denat_dict[melt], 300
+        )
 
-"""First Plot: Fraction Folded by Melt"""
-# extracting the melt data and creating plot lines for each melt
-colorset = 0  # counter to control color of curves and points
-for melt in melts:
-    colorset = colorset + 1
-    denat = melt_data_dict[melt][:, 0]  # A numpy array of type str
-    norm_sig = melt_data_dict[melt][:, 1]  # A numpy array of type str
-    denat = denat.astype(float)  # A numpy array of type float
-    norm_sig = norm_sig.astype(float)  # A numpy array of type float
-    y_adj = baseline_adj(norm_sig, denat, result.params, melt)
-    y_fit = fit_model(result.params, denat_fit, melt)
-    y_fit_adj = baseline_adj(y_fit, denat_fit, result.params, melt)
-    plt.plot(
-        denat,
-        y_adj,
-        "o",
-        color=coloration(colorset / num_melt_colors),
-        label=melt[:-2] + " melt " + melt[-1],
-    )
-    plt.plot(
-        denat_fit, y_fit_adj, "-", color=coloration(colorset / num_melt_colors)
-    )
+    construct1_denat_synthetic_dict = {}
+    for construct in constructs:
+        construct1_denat_synthetic_dict[construct] = np.linspace(
+            construct1_lower_denat_dict[construct],
+            construct1_upper_denat_dict[construct],
+            300,
+        )
 
-# set axis limits
-axes = plt.gca()
-axes.set_xlim([-0.1, denat_bound])
-axes.set_ylim([-0.1, 1.1])
-axes.set_aspect(5.5)
-
-# lot aesthetics and labels
-plt.legend(loc="center", bbox_to_anchor=(1.25, 0.5), fontsize=8)
-plt.title("Fraction Folded by Melt", fontdict=title_font)
-plt.xlabel("Denaturant (Molar)", fontdict=label_font)
-plt.ylabel("Fraction Folded", fontdict=label_font)
-
-# saving plot in individual doc
-plt.savefig(
-    os.path.join(PATH, f"{proj_name}_plot_frac_folded_by_melt.png"),
-    dpi=500,
-    bbox_inches="tight",
-)
-
-# show plot in iPython window and then close
-plt.show()
-plt.close()
-plt.clf
+    """ Global Plot Aesthetics"""
+    # Defining how the plots are colored
+    num_melt_colors = num_melts
+    num_construct_colors = num_constructs
+    coloration = plt.get_cmap("hsv")
+
+    # Dictonary defining title font
+    title_font = {
+        "family": "arial",
+        "color": "black",
+        "weight": "normal",
+        "size": 16,
+    }
+
+    # Dictionary defining label font
+    label_font = {
+        "family": "arial",
+        "color": "black",
+        "weight": "normal",
+        "size": 14,
+    }
+
+    """First Plot: Fraction Folded by Melt"""
+    # extracting the melt data and creating plot lines for each melt
+    colorset = 0  # counter to control color of curves and points
+    for melt in melts:
+        colorset = colorset + 1
+        denat = dataset.melt_denat(melt)
+        norm_sig = dataset.melt_signal(melt)
+        y_adj = baseline_adj(norm_sig, denat, result.params, melt)
+        y_fit = fit_model(result.params, denat_fit, melt)
+        y_fit_adj = baseline_adj(y_fit, denat_fit, result.params, melt)
+        plt.plot(
+            denat,
+            y_adj,
+            "o",
+            color=coloration(colorset / num_melt_colors),
+            label=melt[:-2] + " melt " + melt[-1],
+        )
+        plt.plot(
+            denat_fit,
+            y_fit_adj,
+            "-",
+            color=coloration(colorset / num_melt_colors),
+        )
 
-"""Second Plot: Normalized Signal by Melt"""
-colorset = 0
-for melt in melts:
-    colorset = colorset + 1
-    denat = melt_data_dict[melt][:, 0]  # A numpy array of type str
-    norm_sig = melt_data_dict[melt][:, 1]  # A numpy array of type str
-    denat = denat.astype(float)  # A numpy array of type float
-    norm_sig = norm_sig.astype(float)  # A numpy array of type float
-    y_fit = fit_model(result.params, melt_denat_synthetic_dict[melt], melt)
-    plt.plot(
-        denat,
-        norm_sig,
-        "o",
-        color=coloration(colorset / num_melt_colors),
-        label=melt[:-2] + " melt " + melt[-1],
-    )
-    plt.plot(
-        melt_denat_synthetic_dict[melt],
-        y_fit,
-        "-",
-        color=coloration(colorset / num_melt_colors),
+    # set axis limits
+    axes = plt.gca()
+    axes.set_xlim([-0.1, denat_bound])
+    axes.set_ylim([-0.1, 1.1])
+    axes.set_aspect(5.5)
+
+    # lot aesthetics and labels
+    plt.legend(loc="center", bbox_to_anchor=(1.25, 0.5), fontsize=8)
+    plt.title("Fraction Folded by Melt", fontdict=title_font)
+    plt.xlabel("Denaturant (Molar)", fontdict=label_font)
+    plt.ylabel("Fraction Folded", fontdict=label_font)
+
+    # saving plot in individual doc
+    plt.savefig(
+        os.path.join(PATH, f"{proj_name}_plot_frac_folded_by_melt.png"),
+        dpi=500,
+        bbox_inches="tight",
     )
 
-# set axis limits
-axes = plt.gca()
-axes.set_xlim([-0.1, denat_bound])
-axes.set_ylim([-0.1, 1.1])
-axes.set_aspect(5.5)
-
-# plot aesthetics and labels
-plt.legend(loc="center", bbox_to_anchor=(1.25, 0.5), fontsize=8)
-plt.title("Normalized Signal by Melt", fontdict=title_font)
-plt.xlabel("Denaturant (Molar)", fontdict=label_font)
-plt.ylabel("Normalized Signal", fontdict=label_font)
-
-# saving plot in individual doc
-plt.savefig(
-    os.path.join(PATH, f"{proj_name}_plot_normalized_by_melt.png"),
-    dpi=500,
-    bbox_inches="tight",
-)
-
-# show plot in iPython window and then close
-plt.show()
-plt.close()
-plt.clf
+    # show plot in iPython window and then close
+    plt.show()
+    plt.close()
+    plt.clf
 
-"""Third Plot: Fraction Folded by Construct"""
-colorset = 0
-for construct in constructs:
-    colorset = colorset + 1
-    denat = construct1_data_dict[construct][:, 0]  # A numpy array of type str
-    denat_line = construct1_data_dict[construct][
-        :, 0
-    ]  # A numpy array of type str
-    norm_sig = construct1_data_dict[construct][
-        :, 1
-    ]  # A numpy array of type str
-    denat = denat.astype(float)  # A numpy array of type float
-    denat_line = denat_line.astype(float)  # A numpy array of type float
-    norm_sig = norm_sig.astype(float)  # A numpy array of type float
-    string_to_eval = comp_frac_folded_dict[melt[:-2] + "_comp_ff"]
-    frac_folded = eval(string_to_eval)
-    y_adj = baseline_adj(norm_sig, denat_line, result.params, construct + "_1")
-    y_fit = fit_model(result.params, denat_fit, construct + "_1")
-    y_fit_adj = baseline_adj(y_fit, denat_fit, result.params, construct + "_1")
-    plt.plot(
-        denat,
-        y_adj,
-        "o",
-        color=coloration(colorset / num_construct_colors),
-        label=construct,
-    )
-    plt.plot(
-        denat_fit,
-        y_fit_adj,
-        "-",
-        color=coloration(colorset / num_construct_colors),
+    """Second Plot: Normalized Signal by Melt"""
+    colorset = 0
+    for melt in melts:
+        colorset = colorset + 1
+        denat = dataset.melt_denat(melt)
+        norm_sig = dataset.melt_signal(melt)
+        y_fit = fit_model(result.params, melt_denat_synthetic_dict[melt], melt)
+        plt.plot(
+            denat,
+            norm_sig,
+            "o",
+            color=coloration(colorset / num_melt_colors),
+            label=melt[:-2] + " melt " + melt[-1],
+        )
+        plt.plot(
+            melt_denat_synthetic_dict[melt],
+            y_fit,
+            "-",
+            color=coloration(colorset / num_melt_colors),
+        )
+
+    # set axis limits
+    axes = plt.gca()
+    axes.set_xlim([-0.1, denat_bound])
+    axes.set_ylim([-0.1, 1.1])
+    axes.set_aspect(5.5)
+
+    # plot aesthetics and labels
+    plt.legend(loc="center", bbox_to_anchor=(1.25, 0.5), fontsize=8)
+    plt.title("Normalized Signal by Melt", fontdict=title_font)
+    plt.xlabel("Denaturant (Molar)", fontdict=label_font)
+    plt.ylabel("Normalized Signal", fontdict=label_font)
+
+    # saving plot in individual doc
+    plt.savefig(
+        os.path.join(PATH, f"{proj_name}_plot_normalized_by_melt.png"),
+        dpi=500,
+        bbox_inches="tight",
     )
 
-# set axis limits
-axes = plt.gca()
-axes.set_xlim([-0.1, denat_bound])
-axes.set_ylim([-0.1, 1.1])
-axes.set_aspect(5.5)
-
-# plot aesthetics and labels
-plt.legend(loc="center", bbox_to_anchor=(1.15, 0.5), fontsize=8)
-plt.title("Fraction Folded by Construct", fontdict=title_font)
-plt.xlabel("Denaturant (Molar)", fontdict=label_font)
-plt.ylabel("Fraction Folded", fontdict=label_font)
-
-# saving plot in individual doc
-plt.savefig(
-    os.path.join(PATH, f"{proj_name}_plot_frac_folded_by_construct.png"),
-    dpi=500,
-    bbox_inches="tight",
-)
-
-# show plot in iPython window and then close
-plt.show()
-plt.close()
-plt.clf
+    # show plot in iPython window and then close
+    plt.show()
+    plt.close()
+    plt.clf
+
+    """Third Plot: Fraction Folded by Construct"""
+    colorset = 0
+    for construct in constructs:
+        colorset = colorset + 1
+        denat = construct1_data_dict[construct][
+            :, 0
+        ]  # A numpy array of type str
+        denat_line = construct1_data_dict[construct][
+            :, 0
+        ]  # A numpy array of type str
+        norm_sig = construct1_data_dict[construct][
+            :, 1
+        ]  # A numpy array of type str
+        denat = denat.astype(float)  # A numpy array of type float
+        denat_line = denat_line.astype(float)  # A numpy array of type float
+        norm_sig = norm_sig.astype(float)  # A numpy array of type float
+        y_adj = baseline_adj(
+            norm_sig, denat_line, result.params, construct + "_1"
+        )
+        y_fit = fit_model(result.params, denat_fit, construct + "_1")
+        y_fit_adj = baseline_adj(
+            y_fit, denat_fit, result.params, construct + "_1"
+        )
+        plt.plot(
+            denat,
+            y_adj,
+            "o",
+            color=coloration(colorset / num_construct_colors),
+            label=construct,
+        )
+        plt.plot(
+            denat_fit,
+            y_fit_adj,
+            "-",
+            color=coloration(colorset / num_construct_colors),
+        )
 
-"""Fourth Plot: Normalized Signal by Construct"""
-colorset = 0
-for construct in constructs:
-    colorset = colorset + 1
-    denat = construct1_data_dict[construct][:, 0]  # A numpy array of type str
-    norm_sig = construct1_data_dict[construct][
-        :, 1
-    ]  # A numpy array of type str
-    denat = denat.astype(float)  # A numpy array of type float
-    norm_sig = norm_sig.astype(float)  # A numpy array of type float
-    y_fit = fit_model(
-        result.params,
-        construct1_denat_synthetic_dict[construct],
-        construct + "_1",
-    )
-    plt.plot(
-        denat,
-        norm_sig,
-        "o",
-        color=coloration(colorset / num_construct_colors),
-        label=construct,
-    )
-    plt.plot(
-        construct1_denat_synthetic_dict[construct],
-        y_fit,
-        "-",
-        color=coloration(colorset / num_construct_colors),
+    # set axis limits
+    axes = plt.gca()
+    axes.set_xlim([-0.1, denat_bound])
+    axes.set_ylim([-0.1, 1.1])
+    axes.set_aspect(5.5)
+
+    # plot aesthetics and labels
+    plt.legend(loc="center", bbox_to_anchor=(1.15, 0.5), fontsize=8)
+    plt.title("Fraction Folded by Construct", fontdict=title_font)
+    plt.xlabel("Denaturant (Molar)", fontdict=label_font)
+    plt.ylabel("Fraction Folded", fontdict=label_font)
+
+    # saving plot in individual doc
+    plt.savefig(
+        os.path.join(PATH, f"{proj_name}_plot_frac_folded_by_construct.png"),
+        dpi=500,
+        bbox_inches="tight",
     )
 
-# set axis limits
-axes = plt.gca()
-axes.set_xlim([-0.1, denat_bound])
-axes.set_ylim([-0.1, 1.1])
-axes.set_aspect(5.5)
-
-# plot aesthetics and labels
-plt.legend(loc="center", bbox_to_anchor=(1.15, 0.5), fontsize=8)
-plt.title("Normalized Signal by Construct", fontdict=title_font)
-plt.xlabel("Denaturant (Molar)", fontdict=label_font)
-plt.ylabel("Normalized Signal", fontdict=label_font)
-
-# saving plot in individual doc
-plt.savefig(
-    os.path.join(PATH, f"{proj_name}_plot_normalized_by_construct.png"),
-    dpi=500,
-    bbox_inches="tight",
-)
-
-# show plot in iPython window and then close
-plt.show()
-plt.close()
-plt.clf
-
-##  BOOTSTRAP ANALYSIS
-
-# Create list to store bootstrap iterations of values and define column titles
-bs_param_values = []
-bs_param_values.append(
-    [
-        "Bootstrap Iter",
-        "dGN",
-        "dGR",
-        "dGX",
-        "dGC",
-        "dGRR",
-        "dGXX",
-        "dGRX",
-        "dGXR",
-        "mR",
-        "mX",
-        "redchi**2",
-        "bestchi**2",
-    ]
-)
-# total number of bootstrap iterations
-bs_iter_tot = eval(input("How many bootstrap iterations? "))
-
-# bs_iter_tot = 10  # You would use this if you did not want user input from screen
-bs_iter_count = 0  # Iteration counter
-fit_resid_index = len(fit_resid) - 1
-
-y_fitted_dict = {}
-# Dictionary of 'true' normalized y values from fit at each denaturant value.
-for melt in melts:
-    denat = melt_data_dict[melt][:, 0]  # A numpy array of type str
-    denat = denat.astype(float)  # A numpy array of type float
-    y_fitted_dict[melt] = np.array(fit_model(result.params, denat, melt))
-
-# Arrays to store bs fitted param values
-dGN_vals = []
-dGR_vals = []
-dGX_vals = []
-dGC_vals = []
-dGRR_vals = []
-dGXX_vals = []
-dGRX_vals = []
-dGXR_vals = []
-mR_vals = []
-mX_vals = []
-
-# Add residuals chosen at random (with replacement) to expected
-# y values. Note-residuals are combined ACROSS melts.
-for j in range(0, bs_iter_tot):
-    rand_resid_dict = (
-        {}
-    )  # Clears the random data for each bootsterap iteration
-    bs_iter_count = bs_iter_count + 1
-    print(
-        (
-            "Bootstrap iteration {0} out of {1}".format(
-                bs_iter_count, bs_iter_tot
-            )
+    # show plot in iPython window and then close
+    plt.show()
+    plt.close()
+    plt.clf
+
+    """Fourth Plot: Normalized Signal by Construct"""
+    colorset = 0
+    for construct in constructs:
+        colorset = colorset + 1
+        denat = construct1_data_dict[construct][
+            :, 0
+        ]  # A numpy array of type str
+        norm_sig = construct1_data_dict[construct][
+            :, 1
+        ]  # A numpy array of type str
+        denat = denat.astype(float)  # A numpy array of type float
+        norm_sig = norm_sig.astype(float)  # A numpy array of type float
+        y_fit = fit_model(
+            result.params,
+            construct1_denat_synthetic_dict[construct],
+            construct + "_1",
+        )
+        plt.plot(
+            denat,
+            norm_sig,
+            "o",
+            color=coloration(colorset / num_construct_colors),
+            label=construct,
+        )
+        plt.plot(
+            construct1_denat_synthetic_dict[construct],
+            y_fit,
+            "-",
+            color=coloration(colorset / num_construct_colors),
         )
+
+    # set axis limits
+    axes = plt.gca()
+    axes.set_xlim([-0.1, denat_bound])
+    axes.set_ylim([-0.1, 1.1])
+    axes.set_aspect(5.5)
+
+    # plot aesthetics and labels
+    plt.legend(loc="center", bbox_to_anchor=(1.15, 0.5), fontsize=8)
+    plt.title("Normalized Signal by Construct", fontdict=title_font)
+    plt.xlabel("Denaturant (Molar)", fontdict=label_font)
+    plt.ylabel("Normalized Signal", fontdict=label_font)
+
+    # saving plot in individual doc
+    plt.savefig(
+        os.path.join(PATH, f"{proj_name}_plot_normalized_by_construct.png"),
+        dpi=500,
+        bbox_inches="tight",
     )
 
-    for melt in melts:
-        rand_resid = []
-        denat = melt_data_dict[melt][:, 0]  # A numpy array of type str
-        denat = denat.astype(float)  # A numpy array of type float
+    # show plot in iPython window and then close
+    plt.show()
+    plt.close()
+    plt.clf
+
+    ##  BOOTSTRAP ANALYSIS
 
-        for x in range(0, len(denat)):  # Creastes a list of random residuals
-            rand_int = np.random.randint(0, fit_resid_index)
-            rand_resid.append(fit_resid[rand_int])
-
-        rand_resid_dict[melt] = np.array(rand_resid)
-        y_bootstrap = y_fitted_dict[melt] + rand_resid_dict[melt]
-        z_max, z_min = y_bootstrap.max(), y_bootstrap.min()
-        melt_data_dict[melt][:, 1] = (y_bootstrap - z_min) / (z_max - z_min)
-
-    bs_result = lmfit.minimize(objective, init_guesses)
-    bs_chisqr = bs_result.chisqr
-    bs_red_chisqr = bs_result.redchi
-
-    dGN = bs_result.params["dGN"].value
-    dGR = bs_result.params["dGR"].value
-    dGX = bs_result.params["dGX"].value
-    dGC = bs_result.params["dGC"].value
-    dGRR = bs_result.params["dGRR"].value
-    dGXX = bs_result.params["dGXX"].value
-    dGRX = bs_result.params["dGRX"].value
-    dGXR = bs_result.params["dGXR"].value
-    mR = bs_result.params["mR"].value
-    mX = bs_result.params["mX"].value
-
-    # Store each value in a list for plotting and for downstream statistical analysis
-    dGN_vals.append(dGN)
-    dGR_vals.append(dGR)
-    dGX_vals.append(dGX)
-    dGC_vals.append(dGC)
-    dGRR_vals.append(dGRR)
-    dGXX_vals.append(dGXX)
-    dGRX_vals.append(dGRX)
-    dGXR_vals.append(dGXR)
-    mR_vals.append(mR)
-    mX_vals.append(mX)
-
-    # Append bootstrapped global parameter values for ouput to a file
+    # Create list to store bootstrap iterations of values and define column titles
+    bs_param_values = []
     bs_param_values.append(
+        ["Bootstrap Iter"]
+        + list(melt_objective.param_names)
+        + ["redchi**2", "bestchi**2"]
+    )
+    # total number of bootstrap iterations
+    bs_iter_tot = eval(input("How many bootstrap iterations? "))
+
+    # bs_iter_tot = 10  # You would use this if you did not want user input from screen
+    # 'True' normalized y values from the fit at every data point, in the
+    # dataset's order.
+    y_fitted = np.concatenate(
         [
-            bs_iter_count,
-            dGN,
-            dGR,
-            dGX,
-            dGC,
-            dGRR,
-            dGXX,
-            dGRX,
-            dGXR,
-            mR,
-            mX,
-            bs_red_chisqr,
-            bs_chisqr,
+            fit_model(result.params, dataset.melt_denat(melt), melt)
+            for melt in dataset.melts
         ]
     )
+    bs_seed = np.random.SeedSequence(bootstrap_seed).entropy
+    print("Bootstrap seed: {}".format(bs_seed))
+
+    # Lists to store bs fitted param values, by parameter name, and the
+    # column of each parameter in the bootstrap rows.
+    bs_vals_dict = {name: [] for name in melt_objective.param_names}
+    bs_columns = {name: i for i, name in enumerate(bs_param_values[0])}
+
+    # Where each bootstrap fit starts (see bootstrap_warm_start).
+    if bootstrap_warm_start:
+        bs_start_params = result.params
+    else:
+        bs_start_params = init_guesses
+    bs_objective_calls = []
+
+    # Replicates kept from a stopped run (see bootstrap_resume).
+    bs_path = os.path.join(PATH, f"{proj_name}_bootstrap_params.csv")
+    if bootstrap_resume:
+        if bootstrap_seed is None:
+            raise ValueError(
+                "Resuming a bootstrap needs the stopped run's seed"
+            )
+        bs_rows = read_replicate_rows(bs_path, len(bs_param_values[0]))
+        # Only the iterations asked for this time count, so rows from a
+        # longer earlier run are left out of the statistics.  They stay in the
+        # file, after the others, for a later run that asks for more.
+        bs_extra_rows = {
+            i: bs_rows.pop(i)
+            for i in list(bs_rows)
+            if not 1 <= i <= bs_iter_tot
+        }
+        if bs_extra_rows:
+            print(
+                "{0} bootstrap iterations beyond the {1} requested are kept "
+                "in the file but left out of the statistics.".format(
+                    len(bs_extra_rows), bs_iter_tot
+                )
+            )
+    else:
+        bs_rows = {}
+        bs_extra_rows = {}
+    bs_iter_left = bs_iter_tot - len(bs_rows)
+    if bs_rows:
+        print("{} bootstrap iterations already done.".format(len(bs_rows)))
+    # All the iterations are one batch unless bootstrap_tolerance is set.
+    if bootstrap_tolerance is None:
+        bs_batch = max(bs_iter_tot, 1)
+    else:
+        bs_batch = bootstrap_batch
+
+    # The replicates are split between numCores processes (see
+    # ising/objective.py), which share the data that does not change between
+    # replicates.  Each row is written to the bootstrap parameter file as
+    # soon as its replicate is done.
+    bs_replicates = BootstrapReplicates(
+        melt_objective,
+        y_fitted,
+        fit_resid,
+        bs_seed,
+        bs_start_params,
+        bs_iter_tot,
+    )
+    bs_pool = bs_replicates.pool(
+        numCores if bs_iter_left > 1 else 1, bootstrap_start_method
+    )
+    with bs_pool, ReplicateLog(
+        bs_path,
+        bs_param_values[0],
+        [bs_rows[i] for i in sorted(bs_rows)]
+        + [bs_extra_rows[i] for i in sorted(bs_extra_rows)],
+    ) as bs_log:
+        for bs_batch_start in range(1, bs_iter_tot + 1, bs_batch):
+            bs_batch_end = min(bs_batch_start + bs_batch - 1, bs_iter_tot)
+            bs_iter_list = [
+                i
+                for i in range(bs_batch_start, bs_batch_end + 1)
+                if i not in bs_rows
+            ]
+            for bs_row, bs_record in bs_pool.imap(bs_iter_list):
+                bs_log.write(bs_row)
+                bs_rows[bs_row[0]] = bs_row
+                melt_objective.telemetry.fits.append(bs_record)
+                bs_objective_calls.append(bs_record["objective_calls"])
+
+            # Stop if more replicates would hardly change the statistics.
+            if bootstrap_tolerance is None or bs_batch_end == bs_iter_tot:
+                continue
+            bs_errors = monte_carlo_errors(
+                [bs_rows[i][1:-2] for i in range(1, bs_batch_end + 1)]
+            )
+            print(
+                "Monte Carlo error after {0} iterations: {1:.3f} stdev "
+                "({2})".format(
+                    bs_batch_end,
+                    bs_errors.max(),
+                    bs_param_values[0][1 + np.argmax(bs_errors)],
+                )
+            )
+            if bs_errors.max() <= bootstrap_tolerance:
+                break
+
+    for bs_iter in sorted(bs_rows):
+        bs_row = bs_rows[bs_iter]
+
+        # Store each value in a list for plotting and for downstream
+        # statistical analysis
+        for name in bs_vals_dict:
+            bs_vals_dict[name].append(bs_row[bs_columns[name]])
+
+        # Append bootstrapped global parameter values for ouput to a file
+        bs_param_values.append(bs_row)
+
+    # Objective calls per bootstrap fit, finite differences included.  Started
+    # from the best fit (see bootstrap_warm_start), they are shown next to the
+    # best fit's own, from the initial guesses.
+    if bs_objective_calls:
+        bs_calls_mean = np.mean(bs_objective_calls)
+        if bootstrap_warm_start:
+            print(
+                "Bootstrap fits from the best fit took {0:.1f} objective "
+                "calls on average; the best fit from the initial guesses "
+                "took {1}.".format(
+                    bs_calls_mean, fit_record["objective_calls"]
+                )
+            )
+        else:
+            print(
+                "Bootstrap fits took {0:.1f} objective calls on "
+                "average.".format(bs_calls_mean)
+            )
 
+    # Rewritten with the rows in iteration order, and any rows beyond the
+    # iterations entered after them.
+    write_rows(
+        bs_path,
+        bs_param_values + [bs_extra_rows[i] for i in sorted(bs_extra_rows)],
+    )
+    melt_objective.telemetry.write(
+        os.path.join(PATH, f"{proj_name}_fit_telemetry.json")
+    )
 
-with open(os.path.join(PATH, f"{proj_name}_bootstrap_params.csv"), "w") as n:
-    writer = csv.writer(n, delimiter=",")
-    writer.writerows(bs_param_values)
-n.close()
+    # CALCULATE BOOTSTRAP STATISTICS AND PARAMETER CORRELATIONS
 
-# CALCULATE BOOTSTRAP STATISTICS AND PARAMETER CORRELATIONS
+    bs_param_values_fullarray = np.array(bs_param_values)
+    bs_param_values_array = bs_param_values_fullarray[1:, 1:-2].astype(
+        np.float
+    )  # End at -2 since last two columns
+    # are chi square statistics
 
-import pandas as pd
+    bs_param_names = bs_param_values_fullarray[0][1:-2]
 
-bs_param_values_fullarray = np.array(bs_param_values)
-bs_param_values_array = bs_param_values_fullarray[1:, 1:-2].astype(
-    np.float
-)  # End at -2 since last two columns
-# are chi square statistics
-
-bs_param_names = bs_param_values_fullarray[0][1:-2]
-
-statistics = [
-    "mean",
-    "median",
-    "stdev",
-    "2.5% CI",
-    "16.6% CI",
-    "83.7% CI",
-    "97.5% CI",
-]
-
-bs_statistics_df = pd.DataFrame(columns=statistics)
-
-i = 0
-for param in bs_param_names:
-    bs_statistics = []
-    bs_statistics.append(np.mean(bs_param_values_array[:, i]))
-    bs_statistics.append(np.median(bs_param_values_array[:, i]))
-    bs_statistics.append(np.std(bs_param_values_array[:, i]))
-    bs_statistics.append(np.percentile(bs_param_values_array[:, i], 2.5))
-    bs_statistics.append(np.percentile(bs_param_values_array[:, i], 16.7))
-    bs_statistics.append(np.percentile(bs_param_values_array[:, i], 83.3))
-    bs_statistics.append(np.percentile(bs_param_values_array[:, i], 97.5))
-    bs_statistics_df.loc[param] = bs_statistics
-    i = i + 1
-
-bs_statistics_df.to_csv(os.path.join(PATH, f"{proj_name}_bootstrap_stats.csv"))
-
-corr_coef_matrix = np.corrcoef(bs_param_values_array, rowvar=False)
-corr_coef_df = pd.DataFrame(
-    corr_coef_matrix, columns=bs_param_names, index=bs_param_names
-)
-corr_coef_df.to_csv(
-    os.path.join(PATH, f"{proj_name}_bootstrap_corr_coefs.csv")
-)
-
-
-## GENERATE BOOTSTRAP PARAMETER CORRELATION PLOTS AND HISTOGRAMS
-
-# Specify the names of parameters to be compared to see correlation.
-corr_params = [
-    "dGN",
-    "dGR",
-    "dGX",
-    "dGC",
-    "dGRR",
-    "dGXX",
-    "dGRX",
-    "dGXR",
-    "mR",
-    "mX",
-]
-
-# These are a second set of parameter names that follow in the same order
-# as in corr_params.  They are formatted using TeX-style names so that Deltas
-# and subscripts will be plotted.  The would not be good key names for dictionaries
-corr_param_labels = [
-    "$\Delta$G$_N$",
-    "$\Delta$G$_R$",
-    "$\Delta$G$_X$",
-    "$\Delta$G$_C$",
-    "$\Delta$G$_{RR}$",
-    "$\Delta$G$_{XX}$",
-    "$\Delta$G$_{RX}$",
-    "$\Delta$G$_{XR}$",
-    "m$_R$",
-    "m$_X$",
-]
-
-num_corr_params = len(corr_params)
-gridsize = num_corr_params  # Determines the size of the plot grid.
-
-# Dictionary of fitted parameter values.
-corr_params_dict = {
-    "dGN": dGN_vals,
-    "dGR": dGR_vals,
-    "dGX": dGX_vals,
-    "dGC": dGC_vals,
-    "dGRR": dGRR_vals,
-    "dGXX": dGXX_vals,
-    "dGRX": dGRX_vals,
-    "dGXR": dGXR_vals,
-    "mR": mR_vals,
-    "mX": mX_vals,
-}
+    statistics = [
+        "mean",
+        "median",
+        "stdev",
+        "2.5% CI",
+        "16.6% CI",
+        "83.7% CI",
+        "97.5% CI",
+    ]
 
-# PDF that stores a grid of the correlation plots
-with PdfPages(os.path.join(PATH, f"{proj_name}_Corr_Plots.pdf")) as pdf:
-    fig, axs = plt.subplots(ncols=gridsize, nrows=gridsize, figsize=(20, 20))
-
-    # Turns off axes on lower triangle
-    axs[1, 0].axis("off")
-    axs[2, 0].axis("off")
-    axs[2, 1].axis("off")
-    axs[3, 0].axis("off")
-    axs[3, 1].axis("off")
-    axs[3, 2].axis("off")
-    axs[4, 0].axis("off")
-    axs[4, 1].axis("off")
-    axs[4, 2].axis("off")
-    axs[4, 3].axis("off")
-    axs[5, 0].axis("off")
-    axs[5, 1].axis("off")
-    axs[5, 2].axis("off")
-    axs[5, 3].axis("off")
-    axs[5, 4].axis("off")
-    axs[6, 0].axis("off")
-    axs[6, 1].axis("off")
-    axs[6, 2].axis("off")
-    axs[6, 3].axis("off")
-    axs[6, 4].axis("off")
-    axs[6, 5].axis("off")
-    axs[7, 0].axis("off")
-    axs[7, 1].axis("off")
-    axs[7, 2].axis("off")
-    axs[7, 3].axis("off")
-    axs[7, 4].axis("off")
-    axs[7, 5].axis("off")
-    axs[7, 6].axis("off")
-    axs[8, 0].axis("off")
-    axs[8, 1].axis("off")
-    axs[8, 2].axis("off")
-    axs[8, 3].axis("off")
-    axs[8, 4].axis("off")
-    axs[8, 5].axis("off")
-    axs[8, 6].axis("off")
-    axs[8, 7].axis("off")
-    axs[9, 0].axis("off")
-    axs[9, 1].axis("off")
-    axs[9, 2].axis("off")
-    axs[9, 3].axis("off")
-    axs[9, 4].axis("off")
-    axs[9, 5].axis("off")
-    axs[9, 6].axis("off")
-    axs[9, 7].axis("off")
-    axs[9, 8].axis("off")
-
-    # Defines the position of the y paramater from the array of params
-    hist_param_counter = 0
-    while hist_param_counter < num_corr_params:
-        hist_param_label = corr_param_labels[hist_param_counter]
-        hist_param = corr_params[hist_param_counter]
-        # Start fixing labels here
-        # plt.xticks(fontsize=8)
-        # axs[hist_param_counter, hist_param_counter].tick_params(fontsize=8)
-        # axs[hist_param_counter, hist_param_counter].yticks(fontsize=8)
-        axs[hist_param_counter, hist_param_counter].hist(
-            corr_params_dict[hist_param]
-        )
-        axs[hist_param_counter, hist_param_counter].set_xlabel(
-            hist_param_label, fontsize=14, labelpad=5
-        )
-        hist_param_counter = hist_param_counter + 1
+    bs_statistics_df = pd.DataFrame(columns=statistics)
+
+    i = 0
+    for param in bs_param_names:
+        bs_statistics = []
+        bs_statistics.append(np.mean(bs_param_values_array[:, i]))
+        bs_statistics.append(np.median(bs_param_values_array[:, i]))
+        bs_statistics.append(np.std(bs_param_values_array[:, i]))
+        bs_statistics.append(np.percentile(bs_param_values_array[:, i], 2.5))
+        bs_statistics.append(np.percentile(bs_param_values_array[:, i], 16.7))
+        bs_statistics.append(np.percentile(bs_param_values_array[:, i], 83.3))
+        bs_statistics.append(np.percentile(bs_param_values_array[:, i], 97.5))
+        bs_statistics_df.loc[param] = bs_statistics
+        i = i + 1
+
+    bs_statistics_df.to_csv(
+        os.path.join(PATH, f"{proj_name}_bootstrap_stats.csv")
+    )
 
-    # This part generates the correlation plots
-    y_param_counter = 0
-    while y_param_counter < num_corr_params - 1:
-        # Pulls the parameter name for the y-axis label (with TeX formatting)
-        yparam_label = corr_param_labels[y_param_counter]
-        # Pulls the parameter name to be plotted on the y-axis
-        yparam = corr_params[y_param_counter]
+    corr_coef_matrix = np.corrcoef(bs_param_values_array, rowvar=False)
+    corr_coef_df = pd.DataFrame(
+        corr_coef_matrix, columns=bs_param_names, index=bs_param_names
+    )
+    corr_coef_df.to_csv(
+        os.path.join(PATH, f"{proj_name}_bootstrap_corr_coefs.csv")
+    )
 
-        # Defines the position of the x paramater from the array of params.
-        # The + 1 offest avoids correlating a parameter with itself.
-        x_param_counter = y_param_counter + 1
+    ## GENERATE BOOTSTRAP PARAMETER CORRELATION PLOTS AND HISTOGRAMS
 
-        while x_param_counter < num_corr_params:
-            # pulls the parameter name for the x-axis label (with TeX formatting)
-            xparam_label = corr_param_labels[x_param_counter]
-            # Pulls the parameter name to be plotted on the x-axis
-            xparam = corr_params[x_param_counter]
+    # The parameters to be compared to see correlation: all of the model
+    # spec's, in its order.
+    corr_params = list(melt_objective.param_names)
 
-            x_vals = corr_params_dict[xparam]
-            y_vals = corr_params_dict[yparam]
+    # TeX-style labels for the parameters, in the same order, so that Deltas
+    # and subscripts will be plotted: dGRR becomes Delta G with subscript RR,
+    # and mR m with subscript R.  Other names are used as they are.
+    def tex_label(name):
+        if name.startswith("dG") and len(name) > 2:
+            return "$\\Delta$G$_{" + name[2:] + "}$"
+        if name.startswith("m") and len(name) > 1:
+            return "m$_{" + name[1:] + "}$"
+        return name
 
-            # plt.xticks(fontsize=8)
-            # plt.yticks(fontsize=8)
-            # plotting scatters with axes.  +1 shifts a plot to the right from main diagonal
-            axs[y_param_counter, x_param_counter].plot(x_vals, y_vals, ".")
-
-            # The if statement below turns off numbers on axes if not the right column and
-            # not the main diagonal.
-            if x_param_counter < num_corr_params - 1:
-                axs[y_param_counter, x_param_counter].set_xticklabels([])
-                axs[y_param_counter, x_param_counter].set_yticklabels([])
-
-            if y_param_counter == 0:  # Puts labels above axes on top row
-                axs[y_param_counter, x_param_counter].xaxis.set_label_position(
-                    "top"
-                )
-                axs[y_param_counter, x_param_counter].set_xlabel(
-                    xparam_label, labelpad=10, fontsize=14
-                )
-                axs[y_param_counter, x_param_counter].xaxis.tick_top()
-                if (
-                    x_param_counter < num_corr_params - 1
-                ):  # Avoids eliminating y-scale from upper right corner
-                    axs[y_param_counter, x_param_counter].set_yticklabels([])
+    corr_param_labels = [tex_label(name) for name in corr_params]
 
-            if (
-                x_param_counter == num_corr_params - 1
-            ):  #  Puts labels right of right column
-                axs[y_param_counter, x_param_counter].yaxis.set_label_position(
-                    "right"
-                )
-                axs[y_param_counter, x_param_counter].set_ylabel(
-                    yparam_label, rotation=0, labelpad=30, fontsize=14
-                )
-                axs[y_param_counter, x_param_counter].set_xticklabels([])
-                axs[y_param_counter, x_param_counter].yaxis.tick_right()
+    num_corr_params = len(corr_params)
+    gridsize = num_corr_params  # Determines the size of the plot grid.
 
-            # Determin correlation coefficient and display under subplot title
-            # Note, there is no code that displays this value at the moment.
-            # corr_coef = np.around(np.corrcoef(x_vals, y_vals), 3)
+    # PDF that stores a grid of the correlation plots
+    with PdfPages(os.path.join(PATH, f"{proj_name}_Corr_Plots.pdf")) as pdf:
+        fig, axs = plt.subplots(
+            ncols=gridsize, nrows=gridsize, figsize=(20, 20), squeeze=False
+        )
 
-            # min and max values of the x param
-            x_min = min(x_vals)
-            x_max = max(x_vals)
+        # Turns off axes on lower triangle
+        for y_param_counter in range(gridsize):
+            for x_param_counter in range(y_param_counter):
+                axs[y_param_counter, x_param_counter].axis("off")
+
+        # Defines the position of the y paramater from the array of params
+        hist_param_counter = 0
+        while hist_param_counter < num_corr_params:
+            hist_param_label = corr_param_labels[hist_param_counter]
+            hist_param = corr_params[hist_param_counter]
+            # Start fixing labels here
+            # plt.xticks(fontsize=8)
+            # axs[hist_param_counter, hist_param_counter].tick_params(fontsize=8)
+            # axs[hist_param_counter, hist_param_counter].yticks(fontsize=8)
+            axs[hist_param_counter, hist_param_counter].hist(
+                bs_vals_dict[hist_param]
+            )
+            axs[hist_param_counter, hist_param_counter].set_xlabel(
+                hist_param_label, fontsize=14, labelpad=5
+            )
+            hist_param_counter = hist_param_counter + 1
+
+        # This part generates the correlation plots
+        y_param_counter = 0
+        while y_param_counter < num_corr_params - 1:
+            # Pulls the parameter name for the y-axis label (with TeX formatting)
+            yparam_label = corr_param_labels[y_param_counter]
+            # Pulls the parameter name to be plotted on the y-axis
+            yparam = corr_params[y_param_counter]
+
+            # Defines the position of the x paramater from the array of params.
+            # The + 1 offest avoids correlating a parameter with itself.
+            x_param_counter = y_param_counter + 1
+
+            while x_param_counter < num_corr_params:
+                # pulls the parameter name for the x-axis label (with TeX formatting)
+                xparam_label = corr_param_labels[x_param_counter]
+                # Pulls the parameter name to be plotted on the x-axis
+                xparam = corr_params[x_param_counter]
+
+                x_vals = bs_vals_dict[xparam]
+                y_vals = bs_vals_dict[yparam]
+
+                # plt.xticks(fontsize=8)
+                # plt.yticks(fontsize=8)
+                # plotting scatters with axes.  +1 shifts a plot to the right from main diagonal
+                axs[y_param_counter, x_param_counter].plot(x_vals, y_vals, ".")
+
+                # The if statement below turns off numbers on axes if not the right column and
+                # not the main diagonal.
+                if x_param_counter < num_corr_params - 1:
+                    axs[y_param_counter, x_param_counter].set_xticklabels([])
+                    axs[y_param_counter, x_param_counter].set_yticklabels([])
 
-            # fitting a straight line to the correlation scatterplot
-            fit_array = np.polyfit(x_vals, y_vals, 1)
-            fit_deg1_coef = fit_array[0]
-            fit_deg0_coef = fit_array[1]
-            fit_x_vals = np.linspace(x_min, x_max, 10)
-            fit_y_vals = fit_deg1_coef * fit_x_vals + fit_deg0_coef
+                if y_param_counter == 0:  # Puts labels above axes on top row
+                    axs[
+                        y_param_counter, x_param_counter
+                    ].xaxis.set_label_position("top")
+                    axs[y_param_counter, x_param_counter].set_xlabel(
+                        xparam_label, labelpad=10, fontsize=14
+                    )
+                    axs[y_param_counter, x_param_counter].xaxis.tick_top()
+                    if (
+                        x_param_counter < num_corr_params - 1
+                    ):  # Avoids eliminating y-scale from upper right corner
+                        axs[y_param_counter, x_param_counter].set_yticklabels(
+                            []
+                        )
 
-            # plotting correlation line fits
-            axs[y_param_counter, x_param_counter].plot(fit_x_vals, fit_y_vals)
-            plt.subplots_adjust(wspace=0, hspace=0)
+                if (
+                    x_param_counter == num_corr_params - 1
+                ):  #  Puts labels right of right column
+                    axs[
+                        y_param_counter, x_param_counter
+                    ].yaxis.set_label_position("right")
+                    axs[y_param_counter, x_param_counter].set_ylabel(
+                        yparam_label, rotation=0, labelpad=30, fontsize=14
+                    )
+                    axs[y_param_counter, x_param_counter].set_xticklabels([])
+                    axs[y_param_counter, x_param_counter].yaxis.tick_right()
+
+                # Determin correlation coefficient and display under subplot title
+                # Note, there is no code that displays this value at the moment.
+                # corr_coef = np.around(np.corrcoef(x_vals, y_vals), 3)
+
+                # min and max values of the x param
+                x_min = min(x_vals)
+                x_max = max(x_vals)
+
+                # fitting a straight line to the correlation scatterplot
+                fit_array = np.polyfit(x_vals, y_vals, 1)
+                fit_deg1_coef = fit_array[0]
+                fit_deg0_coef = fit_array[1]
+                fit_x_vals = np.linspace(x_min, x_max, 10)
+                fit_y_vals = fit_deg1_coef * fit_x_vals + fit_deg0_coef
+
+                # plotting correlation line fits
+                axs[y_param_counter, x_param_counter].plot(
+                    fit_x_vals, fit_y_vals
+                )
+                plt.subplots_adjust(wspace=0, hspace=0)
 
-            x_param_counter = x_param_counter + 1
-        y_param_counter = y_param_counter + 1
+                x_param_counter = x_param_counter + 1
+            y_param_counter = y_param_counter + 1
 
-    pdf.savefig(bbox_inches="tight")
+        pdf.savefig(bbox_inches="tight")
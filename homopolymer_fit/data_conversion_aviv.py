@@ -7,12 +7,18 @@ import pandas as pd
 import ntpath  # Good for path manipulations on a PC?
 import glob  # Allows for unix-like specifications paths, using *, ?, etc.
 import os
+import sys
 import json
 import time
 
 start = time.time()
 
 PATH = os.path.dirname(os.path.abspath(__file__))
+
+# The shared ising package lives at the top of the repository.
+sys.path.insert(0, os.path.dirname(PATH))
+from ising.melt_data import MeltDataset
+
 NRC_DATA_PATH = os.path.join(PATH, "NRC_data")
 proj_name = "cANK"
 
@@ -23,6 +29,8 @@ constructs = []  # List of constructs used to build partition functions and
 
 melts = []  # List of melts to be used in fitting.
 
+melt_array_dict = {}  # Each melt's array, for the combined dataset.
+
 # Create an empty pandas dataframe to output a csv file from.
 den_nsig_const_melt_df = pd.DataFrame(
     columns=["denat", "signal", "construct_melt", "dataset"]
@@ -86,6 +94,7 @@ for filename in glob.glob(os.path.join(NRC_DATA_PATH, "*.dat")):
         if construct not in constructs:
             constructs.append(construct)
         melts.append(melt)
+        melt_array_dict[melt] = melt_array
 
 den_nsig_const_melt_df.to_csv(
     os.path.join(PATH, f"{proj_name}_combined_data.csv"),
@@ -122,6 +131,11 @@ with open(os.path.join(PATH, f"{proj_name}_constructs.json"), "w") as r:
 with open(os.path.join(PATH, f"{proj_name}_melts.json"), "w") as s:
     json.dump(melts, s)
 
+# All melts with float denaturant and signal columns, for the fitters.
+MeltDataset.from_melt_arrays(melts, constructs, melt_array_dict).save(
+    os.path.join(PATH, f"{proj_name}_dataset.npz")
+)
+
 stop = time.time()
 runtime = stop - start
 print("\nThe elapsed time was " + str(runtime) + " sec")
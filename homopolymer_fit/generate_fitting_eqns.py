@@ -8,15 +8,49 @@ import sympy as sp
 import numpy as np
 import json
 import os
+import sys
 import time
 
-start = time.time()
+PATH = os.path.dirname(os.path.abspath(__file__))
 
-print("\nGenerating partition functions and fraction folded expressions...")
+# The shared ising package lives at the top of the repository.
+sys.path.insert(0, os.path.dirname(PATH))
+from ising.eqn_cache import ExpressionCache, model_variant
+from ising.symbolic import simplify_expressions, print_timings
+from ising.symbolic import closed_form_log_q, to_numpy_functions
+from ising.symbolic import check_expressions, check_kernels
+from ising.codegen import load_kernel_module, write_kernel_module
+from ising.transfer_matrix import HOMOPOLYMER_PARAMS, homopolymer_model
 
-PATH = os.path.dirname(os.path.abspath(__file__))
 proj_name = "cANK"
 
+# Simplified expressions are cached on disk (see ising/eqn_cache.py), so only
+# constructs that have not been generated before go through sp.simplify.
+use_cache = True
+
+# Constructs are simplified independently, so they can be spread over
+# several processes.  Set to one for single-core processing.
+numCores = 1
+
+# NR...RC constructs with at least this many R repeats get R**n in closed
+# form from the eigenvalues of R (see ising/symbolic.py), so the size of
+# their expressions, and the time to build them, does not grow with the
+# number of repeats.  These skip sp.simplify; shorter constructs come out
+# more compact the usual way.  Set to None to multiply out every construct.
+closed_form_min_repeats = 6
+
+# Parameters (dGN, dGR, dGC, dGinter, mi) like the ones the fits explore.
+# The expressions, and the derivatives in the kernel module, are checked
+# against the transfer matrix at each of them for denaturant from 0 to 10 M
+# before they are written.  The second eigenvalue of R is 0 at dGinter = 0.
+check_thetas = [
+    (6.0, 5.0, 6.0, -12.0, -1.0),
+    (4.0, 3.0, 4.0, -10.0, -1.5),
+    (2.0, 1.5, 2.5, 0.0, 1.0),
+    (2.0, 1.5, 2.5, -3.0, 1.0),
+]
+check_denat = np.linspace(0, 10, 41)
+
 # Parameters for partition function calculation.  Note these are sympy symbols.
 RT = sp.Symbol("RT")
 dGN = sp.Symbol("dGN")
@@ -29,103 +63,243 @@ Kr = sp.Symbol("Kr")
 Kc = sp.Symbol("Kc")
 dGinter = sp.Symbol("dGinter")
 W = sp.Symbol("W")
+n = sp.Symbol("n")  # Number of R repeats in closed-form expressions
+
+exp = sp.Function("np.exp")
+
+if __name__ == "__main__":
+    start = time.time()
+
+    print(
+        "\nGenerating partition functions and fraction folded expressions..."
+    )
+
+    with open(os.path.join(PATH, f"{proj_name}_constructs.json"), "r") as cons:
+        constructs = json.load(cons)
+
+    # define matricies  and end vectors to be used to calculate partition functions
+    begin = sp.Matrix([[0, 1]])
+    N = sp.Matrix([[(Kn * W), 1], [Kn, 1]])
+    R = sp.Matrix([[(Kr * W), 1], [Kr, 1]])
+    C = sp.Matrix([[(Kc * W), 1], [Kc, 1]])
+    end = sp.Matrix([[1], [1]])
+
+    # Substitutions from K's and W's to DGs, ms, and denaturant concentrations.
+    subs_dict = {
+        Kn: (exp(-((dGN - (mi * denat)) / RT))),
+        Kr: (exp(-((dGR - (mi * denat)) / RT))),
+        Kc: (exp(-((dGC - (mi * denat)) / RT))),
+        W: (exp(-dGinter / RT)),
+    }
+
+    # Closed-form expressions, built once for each family (with and without
+    # N and C caps) with n symbolic, then evaluated at each construct's n.
+    # K*dq/dK is K*dlog(q)/dK*q, so fraction folded comes straight from the
+    # derivatives of log(q).
+    family_dict = {}
+    closed_form_dict = {}
+    for construct in constructs:
+        matrixlist = construct.split("_")
+        has_N = matrixlist[0] == "N"
+        has_C = matrixlist[-1] == "C"
+        num_R = len(matrixlist) - has_N - has_C
+        if (
+            closed_form_min_repeats is None
+            or num_R < closed_form_min_repeats
+            or matrixlist.count("R") != num_R
+        ):
+            continue
+        if (has_N, has_C) not in family_dict:
+            left = begin * N if has_N else begin
+            right = C * end if has_C else end
+            log_q = closed_form_log_q(left, R, right, n)
+            frac_folded = (
+                Kn * sp.diff(log_q, Kn)
+                + Kr * sp.diff(log_q, Kr)
+                + Kc * sp.diff(log_q, Kc)
+            ) / (n + int(has_N) + int(has_C))
+            family_dict[(has_N, has_C)] = to_numpy_functions(
+                frac_folded.subs(subs_dict), n
+            )
+        closed_form_dict[construct + "_frac_folded"] = str(
+            family_dict[(has_N, has_C)].subs(n, num_R)
+        )
+    if closed_form_dict:
+        print(
+            "Using closed-form expressions for {} constructs".format(
+                len(closed_form_dict)
+            )
+        )
+        # Check them against the transfer matrix (see check_thetas).
+        check_expressions(
+            closed_form_dict,
+            homopolymer_model(
+                [key[: -len("_frac_folded")] for key in closed_form_dict]
+            ),
+            check_thetas,
+            check_denat,
+        )
 
-np.exp = sp.Function("np.exp")
-
-with open(os.path.join(PATH, f"{proj_name}_constructs.json"), "r") as cons:
-    constructs = json.load(cons)
-
-# define matricies  and end vectors to be used to calculate partition functions
-begin = sp.Matrix([[0, 1]])
-N = sp.Matrix([[(Kn * W), 1], [Kn, 1]])
-R = sp.Matrix([[(Kr * W), 1], [Kr, 1]])
-C = sp.Matrix([[(Kc * W), 1], [Kc, 1]])
-end = sp.Matrix([[1], [1]])
-
-# Build dictionaries of partition functions, partial derivs with respect
-# to K, and fraction folded.
-
-q_dict = {}
-dqdKn_dict = {}
-dqdKr_dict = {}
-dqdKc_dict = {}
-frac_folded_dict = {}
-
-# Number of repeats of each type.  Seems like they should be floats, but
-# I get an error in the matrix multiplication (q_dict) if they are declared to be.
-
-for construct in constructs:
-
-    # Make partition function dictionary and expressions for fraction folded.
-    # Note, only one pf is generated per construct, even when there are multiple melts.
-
-    matrixlist = construct.split("_")
-    q_dict[construct + "_q"] = begin
-
-    for i in range(0, len(matrixlist)):
-        num_Ni = 0
-        num_Ri = 0
-        num_Ci = 0
-        if matrixlist[i] == "N":
-            num_Ni = 1
-        if matrixlist[i] == "R":
-            num_Ri = 1
-        if matrixlist[i] == "C":
-            num_Ci = 1
-
-        q_dict[construct + "_q"] = (
-            q_dict[construct + "_q"]
-            * np.linalg.matrix_power(N, num_Ni)
-            * np.linalg.matrix_power(R, num_Ri)
-            * np.linalg.matrix_power(C, num_Ci)
+    # Look up constructs that have already been generated for this model.
+    variant = model_variant(
+        "homopolymer_NRC",
+        {"begin": begin, "N": N, "R": R, "C": C, "end": end},
+        subs_dict,
+    )
+    cached_dict = {}
+    if use_cache:
+        cache = ExpressionCache()
+        for construct in constructs:
+            if construct + "_frac_folded" in closed_form_dict:
+                continue
+            cached = cache.get(construct, variant)
+            if cached is not None:
+                cached_dict[construct + "_frac_folded"] = cached
+        print(
+            "Found {} of {} constructs in the cache at {}".format(
+                len(cached_dict),
+                len(constructs) - len(closed_form_dict),
+                cache.cache_dir,
+            )
         )
 
-    q_dict[construct + "_q"] = q_dict[construct + "_q"] * end
+    # Build dictionaries of partition functions, partial derivs with respect
+    # to K, and fraction folded.
+
+    q_dict = {}
+    dqdKn_dict = {}
+    dqdKr_dict = {}
+    dqdKc_dict = {}
+    frac_folded_dict = {}
+
+    # Number of repeats of each type.  Seems like they should be floats, but
+    # I get an error in the matrix multiplication (q_dict) if they are declared to be.
 
-    # Next two lines convert from sp.Matrix to np.array to something else.
-    # Not sure the logic here, but it works.
+    for construct in constructs:
+        if construct + "_frac_folded" in cached_dict:
+            continue
+        if construct + "_frac_folded" in closed_form_dict:
+            continue
 
-    q_dict[construct + "_q"] = np.array(q_dict[construct + "_q"])
-    q_dict[construct + "_q"] = q_dict[construct + "_q"].item(0)
+        # Make partition function dictionary and expressions for fraction folded.
+        # Note, only one pf is generated per construct, even when there are multiple melts.
 
-    # Partial derivs wrt Kn dictionary.
-    dqdKn_dict[construct + "_dqdKn"] = sp.diff(q_dict[construct + "_q"], Kn)
+        matrixlist = construct.split("_")
+        q_dict[construct + "_q"] = begin
 
-    # Partial derivs wrt Kr dictionary.
-    dqdKr_dict[construct + "_dqdKr"] = sp.diff(q_dict[construct + "_q"], Kr)
+        for i in range(0, len(matrixlist)):
+            num_Ni = 0
+            num_Ri = 0
+            num_Ci = 0
+            if matrixlist[i] == "N":
+                num_Ni = 1
+            if matrixlist[i] == "R":
+                num_Ri = 1
+            if matrixlist[i] == "C":
+                num_Ci = 1
 
-    # Partial derivs wrt Kc dictionary.
-    dqdKc_dict[construct + "_dqdKc"] = sp.diff(q_dict[construct + "_q"], Kc)
+            q_dict[construct + "_q"] = (
+                q_dict[construct + "_q"]
+                * np.linalg.matrix_power(N, num_Ni)
+                * np.linalg.matrix_power(R, num_Ri)
+                * np.linalg.matrix_power(C, num_Ci)
+            )
 
-    # Fraction folded dictionary.
-    frac_folded_dict[construct + "_frac_folded"] = (
-        Kn / (q_dict[construct + "_q"]) * dqdKn_dict[construct + "_dqdKn"]
-        + Kr / (q_dict[construct + "_q"]) * dqdKr_dict[construct + "_dqdKr"]
-        + Kc / (q_dict[construct + "_q"]) * dqdKc_dict[construct + "_dqdKc"]
-    ) / (len(matrixlist))
+        q_dict[construct + "_q"] = q_dict[construct + "_q"] * end
 
-# The loop below replaces K's and W's the fraction folded terms in the
-# dictionary with DGs, ms, and denaturant concentrations.  The simplify line
-# is really important for making compact expressions for fraction folded.
-# This simplification greatly speeds up fitting.  The last line
-# converts from a sympy object to a string, to allow for json dump.
+        # Next two lines convert from sp.Matrix to np.array to something else.
+        # Not sure the logic here, but it works.
 
-for construct in frac_folded_dict:
-    frac_folded_dict[construct] = frac_folded_dict[construct].subs(
-        {
-            Kn: (np.exp(-((dGN - (mi * denat)) / RT))),
-            Kr: (np.exp(-((dGR - (mi * denat)) / RT))),
-            Kc: (np.exp(-((dGC - (mi * denat)) / RT))),
-            W: (np.exp(-dGinter / RT)),
-        }
+        q_dict[construct + "_q"] = np.array(q_dict[construct + "_q"])
+        q_dict[construct + "_q"] = q_dict[construct + "_q"].item(0)
+
+        # Partial derivs wrt Kn dictionary.
+        dqdKn_dict[construct + "_dqdKn"] = sp.diff(
+            q_dict[construct + "_q"], Kn
+        )
+
+        # Partial derivs wrt Kr dictionary.
+        dqdKr_dict[construct + "_dqdKr"] = sp.diff(
+            q_dict[construct + "_q"], Kr
+        )
+
+        # Partial derivs wrt Kc dictionary.
+        dqdKc_dict[construct + "_dqdKc"] = sp.diff(
+            q_dict[construct + "_q"], Kc
+        )
+
+        # Fraction folded dictionary.
+        q = q_dict[construct + "_q"]
+        frac_folded_dict[construct + "_frac_folded"] = (
+            Kn / q * dqdKn_dict[construct + "_dqdKn"]
+            + Kr / q * dqdKr_dict[construct + "_dqdKr"]
+            + Kc / q * dqdKc_dict[construct + "_dqdKc"]
+        ) / (len(matrixlist))
+
+    # The loop below replaces K's and W's the fraction folded terms in the
+    # dictionary with DGs, ms, and denaturant concentrations.  The simplify
+    # step is really important for making compact expressions for fraction
+    # folded.  This simplification greatly speeds up fitting.  It also
+    # converts from a sympy object to a string, to allow for json dump.
+    # New expressions are then stored in the cache.
+
+    for construct in frac_folded_dict:
+        frac_folded_dict[construct] = frac_folded_dict[construct].subs(
+            subs_dict
+        )
+    frac_folded_dict, simplify_times = simplify_expressions(
+        frac_folded_dict, numCores
     )
-    frac_folded_dict[construct] = sp.simplify(frac_folded_dict[construct])
-    frac_folded_dict[construct] = str(frac_folded_dict[construct])
+    print_timings(simplify_times)
 
-with open(os.path.join(PATH, f"{proj_name}_frac_folded_dict.json"), "w") as f:
-    json.dump(frac_folded_dict, f)
+    for construct in frac_folded_dict:
+        if use_cache:
+            cache.put(
+                construct[: -len("_frac_folded")],
+                variant,
+                frac_folded_dict[construct],
+            )
 
+    # Merge with the cached and closed-form expressions, keeping the order of
+    # the constructs.
+    frac_folded_dict.update(cached_dict)
+    frac_folded_dict.update(closed_form_dict)
+    frac_folded_dict = {
+        key: frac_folded_dict[key]
+        for key in [construct + "_frac_folded" for construct in constructs]
+    }
+
+    with open(
+        os.path.join(PATH, f"{proj_name}_frac_folded_dict.json"), "w"
+    ) as f:
+        json.dump(frac_folded_dict, f)
+
+    # Write the same expressions as an importable module of vectorized
+    # functions, with common subexpressions (mainly the exponentials)
+    # computed once.  The fitters use this instead of eval'ing the strings.
+    # It is written under another name, and only replaces the old module
+    # once its functions and their derivatives match the transfer matrix
+    # (see check_thetas).
+    kernel_path = os.path.join(PATH, f"{proj_name}_ff_kernels.py")
+    unchecked_path = os.path.join(PATH, f"{proj_name}_ff_kernels_unchecked.py")
+    write_kernel_module(
+        unchecked_path,
+        frac_folded_dict,
+        HOMOPOLYMER_PARAMS,
+        "generate_fitting_eqns.py",
+    )
+    try:
+        check_kernels(
+            load_kernel_module(unchecked_path),
+            homopolymer_model(constructs),
+            check_thetas,
+            check_denat,
+        )
+    except ValueError:
+        os.remove(unchecked_path)
+        raise
+    os.replace(unchecked_path, kernel_path)
 
-stop = time.time()
-runtime = stop - start
-print("\nThe elapsed time was " + str(runtime) + " sec")
+    stop = time.time()
+    runtime = stop - start
+    print("\nThe elapsed time was " + str(runtime) + " sec")
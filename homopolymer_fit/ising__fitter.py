@@ -9,7 +9,7 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
-import lmfit, json
+import json
 import csv
 import time
 import os
@@ -19,19 +19,51 @@ start = time.time()
 
 PATH = os.path.dirname(os.path.abspath(__file__))
 
+# The shared ising package lives at the top of the repository.
+sys.path.insert(0, os.path.dirname(PATH))
+from ising.bootstrap import ReplicateLog, read_replicate_rows, write_rows
+from ising.bootstrap import monte_carlo_errors
+from ising.melt_data import MeltDataset
+from ising.objective import BootstrapReplicates, MeltObjective
+from ising.transfer_matrix import homopolymer_model
+
 proj_name = "cANK"
 
+# The options below are described in the README and in ising/objective.py.
+# How fraction folded is calculated: "kernels" (needs the generator script's
+# {proj_name}_ff_kernels.py), "expressions", "transfer_matrix",
+# "log_transfer_matrix", "trie" or "numba".
+ff_engine = "kernels"
+
+# "lmfit" or "least_squares".
+fit_engine = "lmfit"
+
+# Solve for each melt's baselines by linear least squares at every step, so
+# the optimizer only varies the thermodynamic parameters.
+variable_projection = False
+
+# Start each bootstrap fit from the best fit rather than the initial guesses.
+bootstrap_warm_start = True
+
+# Seed for the bootstrap resampling.  None picks a fresh one, which is
+# printed so that the run can be repeated.
+bootstrap_seed = 0
+
+# Keep the replicates in {proj_name}_bootstrap_params.csv from a stopped run
+# with the same bootstrap_seed, and only run the missing iterations.
+bootstrap_resume = False
+
+# Stop once more replicates would change no bootstrap statistic by more than
+# bootstrap_tolerance of its parameter's stdev (0.1, say), checking every
+# bootstrap_batch replicates.  None always runs the number entered.
+bootstrap_tolerance = None
+bootstrap_batch = 100
+
 plt.close()
 plt.clf
 
 RT = 0.001987 * 298.15  #  R in kcal/mol/K, T in Kelvin.
 
-#  Dictionary of frac folded eqns from partition function generator script.
-with open(
-    os.path.join(PATH, f"{proj_name}_frac_folded_dict.json"), "r"
-) as ffd:
-    frac_folded_dict = json.load(ffd)
-
 with open(
     os.path.join(PATH, f"{proj_name}_constructs.json"), "r"
 ) as construct:
@@ -43,81 +75,33 @@ with open(os.path.join(PATH, f"{proj_name}_melts.json"), "r") as m:
 num_melts = len(melts)
 num_constructs = len(constructs)
 
-melt_data_dict = {}
-for melt in melts:
-    melt_data_dict[melt] = np.load(os.path.join(PATH, f"{melt}.npy"))
-
-# Compile fraction folded expressions.
-comp_frac_folded_dict = {}
-for construct in constructs:
-    frac_folded_string = frac_folded_dict[construct + "_frac_folded"]
-    comp_frac_folded = compile(
-        frac_folded_string, "{}_comp_ff".format(construct), "eval"
-    )
-    comp_frac_folded_dict[construct + "_comp_ff"] = comp_frac_folded
+# Denaturant and normalized signal for every melt, as float columns (see
+# ising/melt_data.py), written by the data conversion script.
+dataset = MeltDataset.load(os.path.join(PATH, f"{proj_name}_dataset.npz"))
+
+# Residuals, Jacobian and fits of the model for every melt (see
+# ising/objective.py).
+melt_objective = MeltObjective(
+    dataset,
+    homopolymer_model(constructs, RT),
+    os.path.join(PATH, proj_name),
+    ff_engine,
+    fit_engine,
+    variable_projection,
+)
 
 # CREATE INITIAL GUESSES
 # First, thermodynamic parameters.  These are Global.
-init_guesses = lmfit.Parameters()
-init_guesses.add("dGN", value=6)
-init_guesses.add("dGR", value=5)
-init_guesses.add("dGC", value=6)
-init_guesses.add("dGinter", value=-12)
-init_guesses.add("mi", value=-1.0)
-
-# Next, baseline parameters.  These are local.
-for melt in melts:
-    init_guesses.add("af_{}".format(melt), value=0.02)
-    init_guesses.add("bf_{}".format(melt), value=1)
-    init_guesses.add("au_{}".format(melt), value=0.0)
-    init_guesses.add("bu_{}".format(melt), value=0.0)
-
-# Transfers init_guesses to params for fitting, but init_guesses are maintained.
-params = init_guesses
-
-
-def fitting_function(params, denat, frac_folded, melt):
-    af = params["af_{}".format(melt)].value
-    bf = params["bf_{}".format(melt)].value
-    au = params["au_{}".format(melt)].value
-    bu = params["bu_{}".format(melt)].value
-    dGN = params["dGN"].value
-    dGR = params["dGR"].value
-    dGC = params["dGC"].value
-    dGinter = params["dGinter"].value
-    mi = params["mi"].value
-    return ((af * denat) + bf) * frac_folded + (
-        ((au * denat) + bu) * (1 - frac_folded)
-    )
+thermo_guesses = {"dGN": 6, "dGR": 5, "dGC": 6, "dGinter": -12, "mi": -1.0}
 
+# Next, baseline parameters.  These are local, one of each kind per melt.
+baseline_guesses = {"af": 0.02, "bf": 1, "au": 0.0, "bu": 0.0}
 
-# Objective function creates an array of residuals to be used by lmfit minimize.
-def objective(params):
-    resid_dict = {}
-    dGN = params["dGN"].value
-    dGR = params["dGR"].value
-    dGC = params["dGC"].value
-    dGinter = params["dGinter"].value
-    mi = params["mi"].value
-    for melt in melts:
-        denat = melt_data_dict[melt][:, 0]  # A numpy array of type str
-        norm_sig = melt_data_dict[melt][:, 1]  # A numpy array of type str
-        denat = denat.astype(float)  # A numpy array of type float
-        norm_sig = norm_sig.astype(float)  # A numpy array of type float
-        string_to_eval = comp_frac_folded_dict[melt[:-2] + "_comp_ff"]
-        frac_folded = eval(string_to_eval)
-        af = params["af_{}".format(melt)].value
-        bf = params["bf_{}".format(melt)].value
-        au = params["au_{}".format(melt)].value
-        bu = params["bu_{}".format(melt)].value
-        resid = norm_sig - fitting_function(params, denat, frac_folded, melt)
-        resid_dict[melt + "_resid"] = resid
-    residuals = np.concatenate(list(resid_dict.values()))
-    return residuals
+init_guesses = melt_objective.make_params(thermo_guesses, baseline_guesses)
 
 
 # Fit with lmfit
-result = lmfit.minimize(objective, init_guesses)
+result, fit_record = melt_objective.fit(init_guesses, "best fit")
 fit_resid = result.residual
 
 # Print out features of the data, the fit, and optimized param values
@@ -130,12 +114,6 @@ print(
 )
 print(("The reduced SSR (SSR/DOF): {0:8.6f} \n".format(result.redchi)))
 
-dGN = result.params["dGN"].value
-dGR = result.params["dGR"].value
-dGC = result.params["dGC"].value
-dGinter = result.params["dGinter"].value
-mi = result.params["mi"].value
-
 print("Optimized parameter values:")
 print(("dGN = {0:8.4f}".format(result.params["dGN"].value)))
 print(("dGR = {0:8.4f}".format(result.params["dGR"].value)))
@@ -177,6 +155,9 @@ with open(
     writer = csv.writer(m, delimiter=",")
     writer.writerows(fitted_base_params)
 m.close()
+melt_objective.telemetry.write(
+    os.path.join(PATH, f"{proj_name}_fit_telemetry.json")
+)
 
 stop = time.time()
 runtime = stop - start
@@ -194,13 +175,6 @@ def baseline_adj(y, x, params, construct):
     return (y - (bu + (au * x))) / ((bf + (af * x)) - (bu + (au * x)))
 
 
-# Defining global best-fit parameters
-dGN = result.params["dGN"].value
-dGR = result.params["dGR"].value
-dGC = result.params["dGC"].value
-dGinter = result.params["dGinter"].value
-mi = result.params["mi"].value
-
 # The function fit_model used for plotting best-fit lines and for adding
 # residuals to best-fit lines in bootstrapping.  Normalized, not frac folded.
 def fit_model(params, x, melt):
@@ -209,12 +183,7 @@ def fit_model(params, x, melt):
     bf = result.params["bf_{}".format(melt)].value
     au = result.params["au_{}".format(melt)].value
     bu = result.params["bu_{}".format(melt)].value
-    dGN = params["dGN"].value
-    dGR = params["dGR"].value
-    dGC = params["dGC"].value
-    dGinter = params["dGinter"].value
-    mi = params["mi"].value
-    frac_folded = eval(comp_frac_folded_dict[melt[:-2] + "_comp_ff"])
+    frac_folded = melt_objective.frac_folded(params, denat, melt[:-2])
     return ((af * denat) + bf) * frac_folded + (
         ((au * denat) + bu) * (1 - frac_folded)
     )
@@ -224,7 +193,7 @@ def fit_model(params, x, melt):
 # set x axis bound
 denat_maxer = np.zeros(0)
 for melt in melts:
-    denat_maxer = np.concatenate((denat_maxer, melt_data_dict[melt][:, 0]))
+    denat_maxer = np.concatenate((denat_maxer, dataset.melt_denat(melt)))
 denat_maxer_list = denat_maxer.tolist()
 denat_max = float(max(denat_maxer_list))
 denat_bound = np.around(denat_max, 1) + 0.2
@@ -251,13 +220,13 @@ for construct in constructs:
 melt_lower_denat_dict = {}
 for melt in melts:
     melt_lower_denat_dict[melt] = (
-        round(float(min(melt_data_dict[melt][:, 0]))) - 0.2
+        round(float(min(dataset.melt_denat(melt)))) - 0.2
     )
 
 melt_upper_denat_dict = {}
 for melt in melts:
     melt_upper_denat_dict[melt] = (
-        round(float(max(melt_data_dict[melt][:, 0]))) + 0.2
+        round(float(max(dataset.melt_denat(melt)))) + 0.2
     )
 
 construct1_lower_denat_dict = {}
@@ -314,10 +283,8 @@ label_font = {
 colorset = 0  # counter to control color of curves and points
 for melt in melts:
     colorset = colorset + 1
-    denat = melt_data_dict[melt][:, 0]  # A numpy array of type str
-    norm_sig = melt_data_dict[melt][:, 1]  # A numpy array of type str
-    denat = denat.astype(float)  # A numpy array of type float
-    norm_sig = norm_sig.astype(float)  # A numpy array of type float
+    denat = dataset.melt_denat(melt)
+    norm_sig = dataset.melt_signal(melt)
     y_adj = baseline_adj(norm_sig, denat, result.params, melt)
     y_fit = fit_model(result.params, denat_fit, melt)
     y_fit_adj = baseline_adj(y_fit, denat_fit, result.params, melt)
@@ -360,10 +327,8 @@ plt.clf
 colorset = 0
 for melt in melts:
     colorset = colorset + 1
-    denat = melt_data_dict[melt][:, 0]  # A numpy array of type str
-    norm_sig = melt_data_dict[melt][:, 1]  # A numpy array of type str
-    denat = denat.astype(float)  # A numpy array of type float
-    norm_sig = norm_sig.astype(float)  # A numpy array of type float
+    denat = dataset.melt_denat(melt)
+    norm_sig = dataset.melt_signal(melt)
     y_fit = fit_model(result.params, melt_denat_synthetic_dict[melt], melt)
     plt.plot(
         denat,
@@ -516,16 +481,9 @@ plt.clf
 # Create list to store bootstrap iterations of values and define column titles
 bs_param_values = []
 bs_param_values.append(
-    [
-        "Bootstrap Iter",
-        "dGN",
-        "dGR",
-        "dGC",
-        "dGinter",
-        "mi",
-        "redchi**2",
-        "bestchi**2",
-    ]
+    ["Bootstrap Iter"]
+    + list(melt_objective.param_names)
+    + ["redchi**2", "bestchi**2"]
 )
 # total number of bootstrap iterations
 bs_iter_tot = eval(input("How many bootstrap iterations? "))
@@ -534,15 +492,16 @@ if bs_iter_tot == 0:
     sys.exit()
 
 # bs_iter_tot = 10
-bs_iter_count = 0  # Iteration counter
-fit_resid_index = len(fit_resid) - 1
-
-y_fitted_dict = {}
-# Dictionary of 'true' normalized y values from fit at each denaturant value.
-for melt in melts:
-    denat = melt_data_dict[melt][:, 0]  # A numpy array of type str
-    denat = denat.astype(float)  # A numpy array of type float
-    y_fitted_dict[melt] = np.array(fit_model(result.params, denat, melt))
+# 'True' normalized y values from the fit at every data point, in the
+# dataset's order.
+y_fitted = np.concatenate(
+    [
+        fit_model(result.params, dataset.melt_denat(melt), melt)
+        for melt in dataset.melts
+    ]
+)
+bs_seed = np.random.SeedSequence(bootstrap_seed).entropy
+print("Bootstrap seed: {}".format(bs_seed))
 
 # Arrays to store bs fitted param values
 dGN_vals = []
@@ -551,57 +510,118 @@ dGC_vals = []
 dGinter_vals = []
 mi_vals = []
 
-# Add residuals chosen at random (with replacement) to expected
-# y values. Note-residuals are combined ACROSS melts.
-for j in range(0, bs_iter_tot):
-    rand_resid_dict = (
-        {}
-    )  # Clears the random data for each bootsterap iteration
-    bs_iter_count = bs_iter_count + 1
-    print(
-        "Bootstrap iteration {0} out of {1}".format(bs_iter_count, bs_iter_tot)
-    )
+# Where each bootstrap fit starts (see bootstrap_warm_start).
+if bootstrap_warm_start:
+    bs_start_params = result.params
+else:
+    bs_start_params = init_guesses
+bs_objective_calls = []
 
-    for melt in melts:
-        rand_resid = []
-        denat = melt_data_dict[melt][:, 0]  # A numpy array of type str
-        denat = denat.astype(float)  # A numpy array of type float
+# Fits one replicate at a time in this process (see ising/objective.py).
+bs_replicates = BootstrapReplicates(
+    melt_objective, y_fitted, fit_resid, bs_seed, bs_start_params, bs_iter_tot
+)
 
-        for x in range(0, len(denat)):  # Creastes a list of random residuals
-            rand_int = np.random.randint(0, fit_resid_index)
-            rand_resid.append(fit_resid[rand_int])
+# Replicates kept from a stopped run (see bootstrap_resume).
+bs_path = os.path.join(PATH, f"{proj_name}_bootstrap_params.csv")
+if bootstrap_resume:
+    if bootstrap_seed is None:
+        raise ValueError("Resuming a bootstrap needs the stopped run's seed")
+    bs_rows = read_replicate_rows(bs_path, len(bs_param_values[0]))
+    # Only the iterations asked for this time count, so rows from a
+    # longer earlier run are left out of the statistics.  They stay in the
+    # file, after the others, for a later run that asks for more.
+    bs_extra_rows = {
+        i: bs_rows.pop(i) for i in list(bs_rows) if not 1 <= i <= bs_iter_tot
+    }
+    if bs_extra_rows:
+        print(
+            "{0} bootstrap iterations beyond the {1} requested are kept "
+            "in the file but left out of the statistics.".format(
+                len(bs_extra_rows), bs_iter_tot
+            )
+        )
+else:
+    bs_rows = {}
+    bs_extra_rows = {}
+if bs_rows:
+    print("{} bootstrap iterations already done.".format(len(bs_rows)))
 
-        rand_resid_dict[melt] = np.array(rand_resid)
-        y_bootstrap = y_fitted_dict[melt] + rand_resid_dict[melt]
-        z_max, z_min = y_bootstrap.max(), y_bootstrap.min()
-        melt_data_dict[melt][:, 1] = (y_bootstrap - z_min) / (z_max - z_min)
+# Add residuals chosen at random (with replacement) to expected
+# y values. Note-residuals are combined ACROSS melts.  Each row is written to
+# the bootstrap parameter file as soon as its replicate is done.
+with ReplicateLog(
+    bs_path,
+    bs_param_values[0],
+    [bs_rows[i] for i in sorted(bs_rows)]
+    + [bs_extra_rows[i] for i in sorted(bs_extra_rows)],
+) as bs_log:
+    for bs_iter_count in range(1, bs_iter_tot + 1):
+        # With bootstrap_tolerance set, stop after each bootstrap_batch
+        # iterations if more replicates would hardly change the statistics.
+        if bootstrap_tolerance is not None and bs_iter_count > 1:
+            if (bs_iter_count - 1) % bootstrap_batch == 0:
+                bs_errors = monte_carlo_errors(
+                    [bs_rows[i][1:-2] for i in range(1, bs_iter_count)]
+                )
+                print(
+                    "Monte Carlo error after {0} iterations: {1:.3f} stdev "
+                    "({2})".format(
+                        bs_iter_count - 1,
+                        bs_errors.max(),
+                        bs_param_values[0][1 + np.argmax(bs_errors)],
+                    )
+                )
+                if bs_errors.max() <= bootstrap_tolerance:
+                    break
 
-    bs_result = lmfit.minimize(objective, init_guesses)
-    bs_chisqr = bs_result.chisqr
-    bs_red_chisqr = bs_result.redchi
+        if bs_iter_count in bs_rows:
+            continue
+        bs_row, bs_record = bs_replicates(bs_iter_count)
+        melt_objective.telemetry.fits.append(bs_record)
+        bs_objective_calls.append(bs_record["objective_calls"])
+        bs_rows[bs_iter_count] = bs_row
+        bs_log.write(bs_row)
 
-    dGN = bs_result.params["dGN"].value
-    dGR = bs_result.params["dGR"].value
-    dGC = bs_result.params["dGC"].value
-    dGinter = bs_result.params["dGinter"].value
-    mi = bs_result.params["mi"].value
+for bs_iter_count in sorted(bs_rows):
+    bs_row = bs_rows[bs_iter_count]
 
     # Store each value in a list for plotting
-    dGN_vals.append(dGN)
-    dGR_vals.append(dGR)
-    dGC_vals.append(dGC)
-    dGinter_vals.append(dGinter)
-    mi_vals.append(mi)
+    dGN_vals.append(bs_row[1])
+    dGR_vals.append(bs_row[2])
+    dGC_vals.append(bs_row[3])
+    dGinter_vals.append(bs_row[4])
+    mi_vals.append(bs_row[5])
 
     # Append bootstrapped global parameter values for ouput to a file
-    bs_param_values.append(
-        [bs_iter_count, dGN, dGR, dGC, dGinter, mi, bs_red_chisqr, bs_chisqr]
-    )
+    bs_param_values.append(bs_row)
+
+# Objective calls per bootstrap fit, finite differences included.  Started
+# from the best fit (see bootstrap_warm_start), they are shown next to the
+# best fit's own, from the initial guesses.
+if bs_objective_calls:
+    bs_calls_mean = np.mean(bs_objective_calls)
+    if bootstrap_warm_start:
+        print(
+            "Bootstrap fits from the best fit took {0:.1f} objective "
+            "calls on average; the best fit from the initial guesses "
+            "took {1}.".format(bs_calls_mean, fit_record["objective_calls"])
+        )
+    else:
+        print(
+            "Bootstrap fits took {0:.1f} objective calls on "
+            "average.".format(bs_calls_mean)
+        )
 
-with open(os.path.join(PATH, f"{proj_name}_bootstrap_params.csv"), "w") as n:
-    writer = csv.writer(n, delimiter=",")
-    writer.writerows(bs_param_values)
-n.close()
+# Rewritten with the rows in iteration order, and any rows beyond the
+# iterations entered after them.
+write_rows(
+    bs_path,
+    bs_param_values + [bs_extra_rows[i] for i in sorted(bs_extra_rows)],
+)
+melt_objective.telemetry.write(
+    os.path.join(PATH, f"{proj_name}_fit_telemetry.json")
+)
 
 ## BOOTSTRAP STATISTICS
 bs_param_values_fullarray = np.array(bs_param_values)
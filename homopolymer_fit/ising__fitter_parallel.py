@@ -17,11 +17,10 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
-import lmfit, json
+import json
 import csv
 import time
 import sys
-import multiprocessing as mp
 from multiprocessing import freeze_support
 import os
 
@@ -29,148 +28,101 @@ freeze_support()
 start = time.time()
 
 PATH = os.path.dirname(os.path.abspath(__file__))
+
+# The shared ising package lives at the top of the repository.
+sys.path.insert(0, os.path.dirname(PATH))
+from ising.bootstrap import ReplicateLog, read_replicate_rows, write_rows
+from ising.bootstrap import monte_carlo_errors
+from ising.melt_data import MeltDataset
+from ising.objective import BootstrapReplicates, MeltObjective
+from ising.transfer_matrix import homopolymer_model
+
 proj_name = "cANK"
 numCores = 4  # Cores to use for bootstrapping
 
+# The options below are described in the README and in ising/objective.py.
+# How fraction folded is calculated: "kernels" (needs the generator script's
+# {proj_name}_ff_kernels.py), "expressions", "transfer_matrix",
+# "log_transfer_matrix", "trie" or "numba".
+ff_engine = "kernels"
+
+# "lmfit" or "least_squares".
+fit_engine = "lmfit"
+
+# Solve for each melt's baselines by linear least squares at every step, so
+# the optimizer only varies the thermodynamic parameters.
+variable_projection = False
+
+# Start each bootstrap fit from the best fit rather than the initial guesses.
+bootstrap_warm_start = True
+
+# Seed for the bootstrap resampling.  None picks a fresh one, which is
+# printed so that the run can be repeated.
+bootstrap_seed = 0
+
+# Keep the replicates in {proj_name}_bootstrap_params.csv from a stopped run
+# with the same bootstrap_seed, and only run the missing iterations.
+bootstrap_resume = False
+
+# Stop once more replicates would change no bootstrap statistic by more than
+# bootstrap_tolerance of its parameter's stdev (0.1, say), checking every
+# bootstrap_batch replicates.  None always runs the number entered.
+bootstrap_tolerance = None
+bootstrap_batch = 100
+
+# How the bootstrap worker processes are started: "fork", "spawn",
+# "forkserver", or None for the platform's default.
+bootstrap_start_method = None
+
 plt.close()
 plt.clf
 RT = 0.001987 * 298.15  #  R in kcal/mol/K, T in Kelvin.
-#  Dictionary of frac folded eqns from partition function generator script.
-
-with open(
-    os.path.join(PATH, f"{proj_name}_frac_folded_dict.json"), "r"
-) as ffd:
-    frac_folded_dict = json.load(ffd)
-
-with open(
-    os.path.join(PATH, f"{proj_name}_constructs.json"), "r"
-) as construct:
-    constructs = json.load(construct)
-
-with open(os.path.join(PATH, f"{proj_name}_melts.json"), "r") as m:
-    melts = json.load(m)
-
-num_melts = len(melts)
-num_constructs = len(constructs)
-melt_data_dict = {}
-
-for melt in melts:
-    melt_data_dict[melt] = np.load(os.path.join(PATH, f"{melt}.npy"))
-
-# Compile fraction folded expressions.
-comp_frac_folded_dict = {}
-for construct in constructs:
-    frac_folded_string = frac_folded_dict[construct + "_frac_folded"]
-    comp_frac_folded = compile(
-        frac_folded_string, "{}_comp_ff".format(construct), "eval"
-    )
-    comp_frac_folded_dict[construct + "_comp_ff"] = comp_frac_folded
 
 # CREATE INITIAL GUESSES
 # First, thermodynamic parameters.  These are Global.
-init_guesses = lmfit.Parameters()
-init_guesses.add("dGN", value=6)
-init_guesses.add("dGR", value=5)
-init_guesses.add("dGC", value=6)
-init_guesses.add("dGinter", value=-12)
-init_guesses.add("mi", value=-1.0)
-
-# Next, baseline parameters.  These are local.
-for melt in melts:
-    init_guesses.add("af_{}".format(melt), value=0.02)
-    init_guesses.add("bf_{}".format(melt), value=1)
-    init_guesses.add("au_{}".format(melt), value=0.0)
-    init_guesses.add("bu_{}".format(melt), value=0.0)
-
-# Transfers init_guesses to params for fitting, but init_guesses are maintained.
-params = init_guesses
-
-
-def fitting_function(params, denat, frac_folded, melt):
-    af = params["af_{}".format(melt)].value
-    bf = params["bf_{}".format(melt)].value
-    au = params["au_{}".format(melt)].value
-    bu = params["bu_{}".format(melt)].value
-    dGN = params["dGN"].value
-    dGR = params["dGR"].value
-    dGC = params["dGC"].value
-    dGinter = params["dGinter"].value
-    mi = params["mi"].value
-    return ((af * denat) + bf) * frac_folded + (
-        ((au * denat) + bu) * (1 - frac_folded)
-    )
+thermo_guesses = {"dGN": 6, "dGR": 5, "dGC": 6, "dGinter": -12, "mi": -1.0}
 
-
-# Objective function creates an array of residuals to be used by lmfit minimize.
-def objective(params):
-    resid_dict = {}
-    dGN = params["dGN"].value
-    dGR = params["dGR"].value
-    dGC = params["dGC"].value
-    dGinter = params["dGinter"].value
-    mi = params["mi"].value
-    for melt in melts:
-        denat = melt_data_dict[melt][:, 0]  # A numpy array of type str
-        norm_sig = melt_data_dict[melt][:, 1]  # A numpy array of type str
-        denat = denat.astype(float)  # A numpy array of type float
-        norm_sig = norm_sig.astype(float)  # A numpy array of type float
-        string_to_eval = comp_frac_folded_dict[melt[:-2] + "_comp_ff"]
-        frac_folded = eval(string_to_eval)
-        af = params["af_{}".format(melt)].value
-        bf = params["bf_{}".format(melt)].value
-        au = params["au_{}".format(melt)].value
-        bu = params["bu_{}".format(melt)].value
-        resid = norm_sig - fitting_function(params, denat, frac_folded, melt)
-        resid_dict[melt + "_resid"] = resid
-    residuals = np.concatenate(list(resid_dict.values()))
-    return residuals
-
-
-def bootstrap(bootstrapiteration):
-    rand_resid_dict = {}
-    np.random.seed(bootstrapiteration)
-    sys.stdout.flush()
-    for melt in melts:
-        rand_resid = []
-        denat = melt_data_dict[melt][:, 0]  # A numpy array of type str
-        denat = denat.astype(float)  # A numpy array of type float
-        for x in range(0, len(denat)):  # Creastes a list of random residuals
-            rand_int = np.random.randint(0, fit_resid_index)
-            rand_resid.append(fit_resid[rand_int])
-        rand_resid_dict[melt] = np.array(rand_resid)
-        y_bootstrap = y_fitted_dict[melt] + rand_resid_dict[melt]
-        z_max, z_min = y_bootstrap.max(), y_bootstrap.min()
-        melt_data_dict[melt][:, 1] = (y_bootstrap - z_min) / (z_max - z_min)
-
-    bs_result = lmfit.minimize(objective, init_guesses)
-    bs_chisqr = bs_result.chisqr
-    bs_red_chisqr = bs_result.redchi
-    dGN = bs_result.params["dGN"].value
-    dGR = bs_result.params["dGR"].value
-    dGC = bs_result.params["dGC"].value
-    dGinter = bs_result.params["dGinter"].value
-    mi = bs_result.params["mi"].value
-    BLparamslist = []
-    bsresidual = bs_result.residual
-    bsbest_chi = bs_result.chisqr
-    bsred_chi = bs_result.redchi
-    result = [
-        bootstrapiteration,
-        dGN,
-        dGR,
-        dGC,
-        dGinter,
-        mi,
-        bs_red_chisqr,
-        bs_chisqr,
-    ]
-    sys.stdout.flush()
-    return result
+# Next, baseline parameters.  These are local, one of each kind per melt.
+baseline_guesses = {"af": 0.02, "bf": 1, "au": 0.0, "bu": 0.0}
 
 
 if __name__ == "__main__":
+    # Set up here rather than at import, since bootstrap workers started by
+    # spawn or forkserver import this script.  They get the data from shared
+    # memory instead (see ising/objective.py).
+    with open(
+        os.path.join(PATH, f"{proj_name}_constructs.json"), "r"
+    ) as construct:
+        constructs = json.load(construct)
+
+    with open(os.path.join(PATH, f"{proj_name}_melts.json"), "r") as m:
+        melts = json.load(m)
+
+    num_melts = len(melts)
+    num_constructs = len(constructs)
+    # Denaturant and normalized signal for every melt, as float columns (see
+    # ising/melt_data.py), written by the data conversion script.
+    dataset = MeltDataset.load(
+        os.path.join(PATH, f"{proj_name}_dataset.npz")
+    )
+
+    # Residuals, Jacobian and fits of the model for every melt (see
+    # ising/objective.py).
+    melt_objective = MeltObjective(
+        dataset,
+        homopolymer_model(constructs, RT),
+        os.path.join(PATH, proj_name),
+        ff_engine,
+        fit_engine,
+        variable_projection,
+    )
+
+    init_guesses = melt_objective.make_params(
+        thermo_guesses, baseline_guesses
+    )
+
     # Fit with lmfit
-    result = lmfit.minimize(objective, init_guesses)
+    result, fit_record = melt_objective.fit(init_guesses, "best fit")
     fit_resid = result.residual
 
     # Print out features of the data, the fit, and optimized param values
@@ -183,12 +135,6 @@ if __name__ == "__main__":
     )
     print("The reduced SSR (SSR/DOF): {0:8.6f} \n".format(result.redchi))
 
-    dGN = result.params["dGN"].value
-    dGR = result.params["dGR"].value
-    dGC = result.params["dGC"].value
-    dGinter = result.params["dGinter"].value
-    mi = result.params["mi"].value
-
     print("Optimized parameter values:")
     print("dGN = {0:8.4f}".format(result.params["dGN"].value))
     print("dGR = {0:8.4f}".format(result.params["dGR"].value))
@@ -229,6 +175,9 @@ if __name__ == "__main__":
         writer = csv.writer(m, delimiter=",")
         writer.writerows(fitted_base_params)
     m.close()
+    melt_objective.telemetry.write(
+        os.path.join(PATH, f"{proj_name}_fit_telemetry.json")
+    )
     stop = time.time()
     runtime = stop - start
     print(("\nThe elapsed time was " + str(runtime) + " sec"))
@@ -245,13 +194,6 @@ if __name__ == "__main__":
         bu = result.params["bu_{}".format(construct)].value
         return (y - (bu + (au * x))) / ((bf + (af * x)) - (bu + (au * x)))
 
-    # Defining global best-fit parameters
-    dGN = result.params["dGN"].value
-    dGR = result.params["dGR"].value
-    dGC = result.params["dGC"].value
-    dGinter = result.params["dGinter"].value
-    mi = result.params["mi"].value
-
     # The function fit_model used for plotting best-fit lines and for adding
     # residuals to best-fit lines in bootstrapping.  Normalized, not frac folded.
     def fit_model(params, x, melt):
@@ -261,7 +203,7 @@ if __name__ == "__main__":
         au = result.params["au_{}".format(melt)].value
         bu = result.params["bu_{}".format(melt)].value
 
-        frac_folded = eval(comp_frac_folded_dict[melt[:-2] + "_comp_ff"])
+        frac_folded = melt_objective.frac_folded(params, denat, melt[:-2])
 
         return ((af * denat) + bf) * frac_folded + (
             ((au * denat) + bu) * (1 - frac_folded)
@@ -271,7 +213,7 @@ if __name__ == "__main__":
     # set x axis bound
     denat_maxer = np.zeros(0)
     for melt in melts:
-        denat_maxer = np.concatenate((denat_maxer, melt_data_dict[melt][:, 0]))
+        denat_maxer = np.concatenate((denat_maxer, dataset.melt_denat(melt)))
     denat_maxer_list = denat_maxer.tolist()
     denat_max = float(max(denat_maxer_list))
     denat_bound = np.around(denat_max, 1) + 0.2
@@ -298,12 +240,12 @@ if __name__ == "__main__":
     melt_lower_denat_dict = {}
     for melt in melts:
         melt_lower_denat_dict[melt] = (
-            round(float(min(melt_data_dict[melt][:, 0]))) - 0.2
+            round(float(min(dataset.melt_denat(melt)))) - 0.2
         )
     melt_upper_denat_dict = {}
     for melt in melts:
         melt_upper_denat_dict[melt] = (
-            round(float(max(melt_data_dict[melt][:, 0]))) + 0.2
+            round(float(max(dataset.melt_denat(melt)))) + 0.2
         )
 
     construct1_lower_denat_dict = {}
@@ -359,10 +301,8 @@ if __name__ == "__main__":
     colorset = 0  # counter to control color of curves and points
     for melt in melts:
         colorset = colorset + 1
-        denat = melt_data_dict[melt][:, 0]  # A numpy array of type str
-        norm_sig = melt_data_dict[melt][:, 1]  # A numpy array of type str
-        denat = denat.astype(float)  # A numpy array of type float
-        norm_sig = norm_sig.astype(float)  # A numpy array of type float
+        denat = dataset.melt_denat(melt)
+        norm_sig = dataset.melt_signal(melt)
         y_adj = baseline_adj(norm_sig, denat, result.params, melt)
         y_fit = fit_model(result.params, denat_fit, melt)
         y_fit_adj = baseline_adj(y_fit, denat_fit, result.params, melt)
@@ -408,10 +348,8 @@ if __name__ == "__main__":
     colorset = 0
     for melt in melts:
         colorset = colorset + 1
-        denat = melt_data_dict[melt][:, 0]  # A numpy array of type str
-        norm_sig = melt_data_dict[melt][:, 1]  # A numpy array of type str
-        denat = denat.astype(float)  # A numpy array of type float
-        norm_sig = norm_sig.astype(float)  # A numpy array of type float
+        denat = dataset.melt_denat(melt)
+        norm_sig = dataset.melt_signal(melt)
         y_fit = fit_model(result.params, melt_denat_synthetic_dict[melt], melt)
         plt.plot(
             denat,
@@ -576,14 +514,16 @@ if __name__ == "__main__":
         sys.exit()
 
     # bs_iter_tot = 10
-    bs_iter_count = 0  # Iteration counter
-    fit_resid_index = len(fit_resid) - 1
-    y_fitted_dict = {}
-    # Dictionary of 'true' normalized y values from fit at each denaturant value.
-    for melt in melts:
-        denat = melt_data_dict[melt][:, 0]  # A numpy array of type str
-        denat = denat.astype(float)  # A numpy array of type float
-        y_fitted_dict[melt] = np.array(fit_model(result.params, denat, melt))
+    # 'True' normalized y values from the fit at every data point, in the
+    # dataset's order.
+    y_fitted = np.concatenate(
+        [
+            fit_model(result.params, dataset.melt_denat(melt), melt)
+            for melt in dataset.melts
+        ]
+    )
+    bs_seed = np.random.SeedSequence(bootstrap_seed).entropy
+    print("Bootstrap seed: {}".format(bs_seed))
 
     # Arrays to store bs fitted param values
     dGN_vals = []
@@ -591,32 +531,111 @@ if __name__ == "__main__":
     dGC_vals = []
     dGinter_vals = []
     mi_vals = []
-    bootstrapList = [i + 1 for i in range(bs_iter_tot + 1)]
-    print(f"Performing {bs_iter_tot} bootstrap iterations...")
-    pool = mp.Pool(processes=numCores)  # Sets up a pool of processors
-    BSParamValues = pool.map(
-        bootstrap, bootstrapList
-    )  # This is where the parallel bootstrapping occurs.  Function bootstrap() gets called the length
-    # of bootstrapList times, with the values of bootstrapList as the argument in each call. The
-    # tasks of calling bootstrap() that many times is split between the processors in the pool
-    pool.close()
-    pool.join()
-
+    # Where each bootstrap fit starts (see bootstrap_warm_start).
+    if bootstrap_warm_start:
+        bs_start_params = result.params
+    else:
+        bs_start_params = init_guesses
     # Create list to store bootstrap iterations of values and define column titles
     bs_param_values = []
     bs_param_values.append(
-        [
-            "Bootstrap Iter",
-            "dGN",
-            "dGR",
-            "dGC",
-            "dGinter",
-            "mi",
-            "redchi**2",
-            "bestchi**2",
-        ]
+        ["Bootstrap Iter"]
+        + list(melt_objective.param_names)
+        + ["redchi**2", "bestchi**2"]
+    )
+
+    # Replicates kept from a stopped run (see bootstrap_resume).
+    bs_path = os.path.join(PATH, f"{proj_name}_bootstrap_params.csv")
+    if bootstrap_resume:
+        if bootstrap_seed is None:
+            raise ValueError(
+                "Resuming a bootstrap needs the stopped run's seed"
+            )
+        bs_rows = read_replicate_rows(bs_path, len(bs_param_values[0]))
+        # Only the iterations asked for this time count, so rows from a
+        # longer earlier run are left out of the statistics.  They stay in the
+        # file, after the others, for a later run that asks for more.
+        bs_extra_rows = {
+            i: bs_rows.pop(i)
+            for i in list(bs_rows)
+            if not 1 <= i <= bs_iter_tot
+        }
+        if bs_extra_rows:
+            print(
+                "{0} bootstrap iterations beyond the {1} requested are kept "
+                "in the file but left out of the statistics.".format(
+                    len(bs_extra_rows), bs_iter_tot
+                )
+            )
+    else:
+        bs_rows = {}
+        bs_extra_rows = {}
+    bs_iter_left = bs_iter_tot - len(bs_rows)
+    if bs_rows:
+        print("{} bootstrap iterations already done.".format(len(bs_rows)))
+    # All the iterations are one batch unless bootstrap_tolerance is set.
+    if bootstrap_tolerance is None:
+        print(f"Performing {bs_iter_left} bootstrap iterations...")
+        bs_batch = max(bs_iter_tot, 1)
+    else:
+        print(f"Performing up to {bs_iter_left} bootstrap iterations...")
+        bs_batch = bootstrap_batch
+    # This is where the parallel bootstrapping occurs.  The replicates are
+    # split between numCores processes (see ising/objective.py), which share
+    # the data that does not change between replicates.  Each row is written
+    # to the bootstrap parameter file as soon as its replicate is done.
+    bs_objective_calls = []
+    bs_replicates = BootstrapReplicates(
+        melt_objective,
+        y_fitted,
+        fit_resid,
+        bs_seed,
+        bs_start_params,
+        bs_iter_tot,
     )
-    for i in BSParamValues:
+    bs_pool = bs_replicates.pool(
+        numCores if bs_iter_left > 1 else 1, bootstrap_start_method
+    )
+    with bs_pool, ReplicateLog(
+        bs_path,
+        bs_param_values[0],
+        [bs_rows[i] for i in sorted(bs_rows)]
+        + [bs_extra_rows[i] for i in sorted(bs_extra_rows)],
+    ) as bs_log:
+        for bs_batch_start in range(1, bs_iter_tot + 1, bs_batch):
+            bs_batch_end = min(bs_batch_start + bs_batch - 1, bs_iter_tot)
+            bootstrapList = [
+                i
+                for i in range(bs_batch_start, bs_batch_end + 1)
+                if i not in bs_rows
+            ]
+            for bs_row, bs_record in bs_pool.imap(bootstrapList):
+                bs_log.write(bs_row)
+                bs_rows[bs_row[0]] = bs_row
+                # Each replicate's telemetry record comes back with its
+                # parameters.
+                melt_objective.telemetry.fits.append(bs_record)
+                bs_objective_calls.append(bs_record["objective_calls"])
+
+            # Stop if more replicates would hardly change the statistics.
+            if bootstrap_tolerance is None or bs_batch_end == bs_iter_tot:
+                continue
+            bs_errors = monte_carlo_errors(
+                [bs_rows[i][1:-2] for i in range(1, bs_batch_end + 1)]
+            )
+            print(
+                "Monte Carlo error after {0} iterations: {1:.3f} stdev "
+                "({2})".format(
+                    bs_batch_end,
+                    bs_errors.max(),
+                    bs_param_values[0][1 + np.argmax(bs_errors)],
+                )
+            )
+            if bs_errors.max() <= bootstrap_tolerance:
+                break
+
+    for bootstrapiteration in sorted(bs_rows):
+        i = bs_rows[bootstrapiteration]
         bs_param_values.append(i)
         dGN_vals.append(i[1])
         dGR_vals.append(i[2])
@@ -624,12 +643,34 @@ if __name__ == "__main__":
         dGinter_vals.append(i[4])
         mi_vals.append(i[5])
 
-    with open(
-        os.path.join(PATH, f"{proj_name}_bootstrap_params.csv"), "w"
-    ) as n:
-        writer = csv.writer(n, delimiter=",")
-        writer.writerows(bs_param_values)
-    n.close()
+    # Objective calls per bootstrap fit, finite differences included.  Started
+    # from the best fit (see bootstrap_warm_start), they are shown next to the
+    # best fit's own, from the initial guesses.
+    if bs_objective_calls:
+        bs_calls_mean = np.mean(bs_objective_calls)
+        if bootstrap_warm_start:
+            print(
+                "Bootstrap fits from the best fit took {0:.1f} objective "
+                "calls on average; the best fit from the initial guesses "
+                "took {1}.".format(
+                    bs_calls_mean, fit_record["objective_calls"]
+                )
+            )
+        else:
+            print(
+                "Bootstrap fits took {0:.1f} objective calls on "
+                "average.".format(bs_calls_mean)
+            )
+
+    # Rewritten with the rows in iteration order, and any rows beyond the
+    # iterations entered after them.
+    write_rows(
+        bs_path,
+        bs_param_values + [bs_extra_rows[i] for i in sorted(bs_extra_rows)],
+    )
+    melt_objective.telemetry.write(
+        os.path.join(PATH, f"{proj_name}_fit_telemetry.json")
+    )
     ## BOOTSTRAP STATISTICS
     bs_param_values_fullarray = np.array(bs_param_values)
     bs_param_values_array = bs_param_values_fullarray[1:, 1:-2].astype(
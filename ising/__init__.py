@@ -0,0 +1,7 @@
+"""
+Shared numerical code for the homopolymer and heteropolymer Ising scripts.
+
+The scripts in homopolymer_fit/ and heteropolymer_fit/ add the top of the
+repository to sys.path and import from here, so each script can still be
+run from the directory it resides in.
+"""
@@ -0,0 +1,289 @@
+"""
+Bootstrap helpers shared by the fitters: residual resampling with one random
+stream per replicate, a pool of worker processes that run replicates with
+the unchanging arrays in shared memory, the bootstrap parameter file written
+row by row so a stopped run can be resumed, and the Monte Carlo error of the
+bootstrap statistics.
+"""
+
+import csv
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def replicate_rng(seed, replicate):
+    """
+    Random generator for one bootstrap replicate: the same stream as
+    np.random.SeedSequence(seed).spawn(n)[replicate], for any n.
+    """
+    return np.random.default_rng(
+        np.random.SeedSequence(seed, spawn_key=(replicate,))
+    )
+
+
+def resample_signal(dataset, y_fitted, residuals, rng):
+    """
+    Normalized signal for one bootstrap replicate of dataset (a
+    MeltDataset).  y_fitted is the fitted signal at every data point, in the
+    dataset's order, and residuals are drawn from with rng.
+    """
+    y_bootstrap = (
+        y_fitted + residuals[rng.integers(len(residuals), size=len(y_fitted))]
+    )
+    starts = [dataset.slices[melt].start for melt in dataset.melts]
+    z_max = np.maximum.reduceat(y_bootstrap, starts)[dataset.melt_id]
+    z_min = np.minimum.reduceat(y_bootstrap, starts)[dataset.melt_id]
+    return (y_bootstrap - z_min) / (z_max - z_min)
+
+
+class SharedArrays:
+    """
+    Copies of numpy arrays in multiprocessing.shared_memory blocks, from
+    {name: array}.  spec is a small picklable description of the blocks,
+    which attach_shared turns back into arrays in another process.  Use as a
+    context manager, or call close, to free the blocks.
+    """
+
+    def __init__(self, arrays):
+        self.spec = {}
+        self._blocks = []
+        try:
+            for name, array in arrays.items():
+                array = np.ascontiguousarray(array)
+                block = shared_memory.SharedMemory(
+                    create=True, size=max(array.nbytes, 1)
+                )
+                self._blocks.append(block)
+                copy = np.ndarray(array.shape, array.dtype, buffer=block.buf)
+                copy[...] = array
+                self.spec[name] = (block.name, array.shape, array.dtype.str)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def attach_shared(spec):
+    """
+    Read-only arrays {name: array} for the spec of a SharedArrays, and the
+    list of shared memory blocks behind them, which must be kept open for
+    as long as the arrays are used.
+    """
+    arrays = {}
+    blocks = []
+    for name, (block_name, shape, dtype) in spec.items():
+        try:
+            # The creating process frees the block, not the ones attaching.
+            block = shared_memory.SharedMemory(name=block_name, track=False)
+        except TypeError:
+            # Before Python 3.13 attaching registers the block again, which
+            # is harmless in the workers, since they share the resource
+            # tracker of the process that made it.
+            block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        array = np.ndarray(shape, dtype, buffer=block.buf)
+        array.flags.writeable = False
+        arrays[name] = array
+    return arrays, blocks
+
+
+# Shared memory blocks that a worker process has attached to.
+_worker_blocks = []
+
+
+def _start_worker(spec, setup, setup_args):
+    arrays, blocks = attach_shared(spec)
+    _worker_blocks.extend(blocks)
+    if setup is not None:
+        setup(arrays, *setup_args)
+
+
+class ReplicatePool:
+    """
+    Runs replicate(i) for batches of replicate numbers i, in num_cores
+    worker processes when num_cores is above one.  The workers and the
+    shared memory are set up once and used for every batch, until close (or
+    the end of the with block).
+
+    The arrays in shared ({name: array}) are put in shared memory for the
+    workers, and each worker calls setup(arrays, *setup_args) as it starts,
+    with arrays read-only views of the same names, to put them where
+    replicate expects them.  replicate and setup are found by name in the
+    workers, and setup_args are pickled; start_method is passed on to
+    multiprocessing.get_context (None is the platform's default).  With one
+    core everything runs in this process, and setup is not called.
+    """
+
+    def __init__(
+        self,
+        replicate,
+        num_cores=1,
+        shared=None,
+        setup=None,
+        setup_args=(),
+        start_method=None,
+    ):
+        self.replicate = replicate
+        self._shared = None
+        self._pool = None
+        if num_cores <= 1:
+            return
+        context = multiprocessing.get_context(start_method)
+        self._shared = SharedArrays(shared or {})
+        try:
+            self._pool = context.Pool(
+                processes=num_cores,
+                initializer=_start_worker,
+                initargs=(self._shared.spec, setup, setup_args),
+            )
+        except BaseException:
+            self._shared.close()
+            raise
+
+    def imap(self, replicates):
+        """
+        Yields replicate(i) for every i in replicates.  Results from workers
+        come in the order they finish, so each should say which replicate it
+        is.
+        """
+        if self._pool is None:
+            return map(self.replicate, replicates)
+        return self._pool.imap_unordered(self.replicate, replicates)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        if self._shared is not None:
+            self._shared.close()
+            self._shared = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_replicate_rows(path, num_columns):
+    """
+    Rows already in the bootstrap parameter file at path, as {iteration:
+    row}, with the iteration an int and the other num_columns - 1 columns
+    floats.  The header, rows that do not parse, and a last line without
+    its newline (from a run stopped while writing it) are left out.
+    Returns an empty dict if there is no file.
+    """
+    rows = {}
+    if not os.path.exists(path):
+        return rows
+    with open(path, newline="") as f:
+        lines = f.readlines()
+    if lines and not lines[-1].endswith("\n"):
+        lines.pop()
+    for row in csv.reader(lines):
+        if len(row) != num_columns:
+            continue
+        try:
+            iteration = int(row[0])
+            values = [float(value) for value in row[1:]]
+        except ValueError:
+            continue
+        rows[iteration] = [iteration] + values
+    return rows
+
+
+def write_rows(path, rows):
+    """
+    Writes rows to the CSV file at path through a temporary file in the same
+    directory, so that path always holds either its old rows or all the new
+    ones, even if the run is stopped part way.
+    """
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", newline="") as f:
+        csv.writer(f, delimiter=",").writerows(rows)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+class ReplicateLog:
+    """
+    Writes a bootstrap parameter file row by row: the header and any rows
+    kept from an earlier run first (replacing the file in one step, see
+    write_rows), then each new row as soon as it is written, flushed to
+    disk.  Use as a context manager.
+    """
+
+    def __init__(self, path, header, rows=()):
+        write_rows(path, [header] + list(rows))
+        self._file = open(path, "a", newline="")
+        self._writer = csv.writer(self._file, delimiter=",")
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def write(self, row):
+        self._writer.writerow(row)
+        self._sync()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _statistics(values):
+    """
+    Mean, stdev, median and the 2.5, 16.7, 83.3 and 97.5 percentiles (the
+    statistics in the bootstrap stats file) of each parameter in values,
+    over the replicates along axis -2.  Stacked along a new first axis.
+    """
+    return np.stack(
+        (
+            np.mean(values, axis=-2),
+            np.std(values, axis=-2),
+            *np.percentile(values, (50, 2.5, 16.7, 83.3, 97.5), axis=-2),
+        )
+    )
+
+
+def monte_carlo_errors(values, num_resamples=200, seed=0):
+    """
+    Monte Carlo error of the bootstrap statistics of each parameter, from
+    values (one row per replicate, one column per parameter): the largest
+    standard error of its mean, stdev, median or reported percentiles,
+    relative to its stdev.  The standard errors are estimated from
+    num_resamples resamples of the rows, drawn with a generator seeded with
+    seed, so the same values always give the same errors.  A parameter with
+    no spread at all gets 0.
+    """
+    values = np.asarray(values, dtype=float)
+    rng = np.random.default_rng(seed)
+    resamples = values[
+        rng.integers(len(values), size=(num_resamples, len(values)))
+    ]
+    errors = np.std(_statistics(resamples), axis=1)
+    stdev = np.std(values, axis=0)
+    relative = np.zeros_like(stdev)
+    np.divide(errors.max(axis=0), stdev, out=relative, where=stdev > 0)
+    return relative
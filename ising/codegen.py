@@ -0,0 +1,296 @@
+"""
+Writes the fraction folded expressions out as an importable Python module,
+and compiles the expression strings for the fitters' "expressions" engine.
+
+Each construct gets a vectorized function of explicit arguments, and a jac_
+function with the same arguments that returns the derivatives of fraction
+folded with respect to each thermodynamic parameter:
+
+    def ff_N_R_C(denat, dGN, dGR, dGC, dGinter, mi, RT):
+        x0 = np.exp(-dGinter/RT)
+        ...
+
+The module also has PARAM_NAMES (the order of the thermodynamic arguments),
+EXPRESSIONS_HASH (the content hash of the expressions it was written from)
+and the dicts FRAC_FOLDED and JACOBIAN, from construct to function.
+"""
+
+import hashlib
+import importlib.util
+import json
+import marshal
+import os
+
+import sympy as sp
+from sympy.printing.pycode import PythonCodePrinter
+
+
+# np.exp is kept as an unevaluated function while the expressions are
+# manipulated, so sympy does not fold exp(a)**2 into exp(2*a) and lose the
+# sharing between an exponential and its powers.  It still needs to know its
+# own derivative for the Jacobian.
+class npexp(sp.Function):
+    def fdiff(self, argindex=1):
+        return self
+
+
+# np.sqrt, np.arcsinh and np.power show up in closed-form expressions for
+# long arrays (see closed_form_log_q in ising/symbolic.py).  The exponent of
+# np.power is always a number.
+class npsqrt(sp.Function):
+    def fdiff(self, argindex=1):
+        return 1 / (2 * self)
+
+
+class nparcsinh(sp.Function):
+    def fdiff(self, argindex=1):
+        return 1 / npsqrt(self.args[0] ** 2 + 1)
+
+
+class nppower(sp.Function):
+    def fdiff(self, argindex=1):
+        if argindex == 1:
+            base, exponent = self.args
+            return exponent * nppower(base, exponent - 1)
+        return super().fdiff(argindex)
+
+
+NUMPY_FUNCTIONS = {
+    "np.exp": npexp,
+    "np.sqrt": npsqrt,
+    "np.arcsinh": nparcsinh,
+    "np.power": nppower,
+}
+
+
+def parse_expression(expression_string):
+    """Parses a generator expression string (which uses np.exp etc.)."""
+    local_dict = {}
+    for numpy_name, function in NUMPY_FUNCTIONS.items():
+        expression_string = expression_string.replace(
+            numpy_name + "(", function.__name__ + "("
+        )
+        local_dict[function.__name__] = function
+    return sp.parse_expr(expression_string, local_dict=local_dict)
+
+
+def kernel_name(construct):
+    return "ff_" + construct
+
+
+def jacobian_name(construct):
+    return "jac_" + construct
+
+
+def _cse(expression):
+    replacements, (reduced,) = sp.cse(
+        [expression], symbols=sp.numbered_symbols("x"), optimizations="basic"
+    )
+    return replacements, reduced
+
+
+def _derivative(expression, param, derivative_symbols):
+    """d(expression)/d(param), through intermediates with known derivatives."""
+    total = sp.diff(expression, param)
+    for symbol in expression.free_symbols & set(derivative_symbols):
+        total = (
+            total + sp.diff(expression, symbol) * derivative_symbols[symbol]
+        )
+    return total
+
+
+def _forward_derivatives(replacements, reduced, param_names):
+    """
+    Differentiates CSE'd code line by line (forward mode): each intermediate
+    x gets a dx_<param> line for every parameter it depends on.  This is much
+    faster than differentiating the whole expression and running cse on the
+    result, and the derivatives reuse the exponentials already computed.
+    Returns the extended list of (symbol, expression) lines and one
+    derivative expression per parameter.
+    """
+    lines = list(replacements)
+    derivatives = []
+    for name in param_names:
+        param = sp.Symbol(name)
+        derivative_symbols = {}
+        for symbol, subexpression in replacements:
+            derivative = _derivative(subexpression, param, derivative_symbols)
+            # d(exp(u)) = exp(u)*du, and exp(u) is already computed.
+            derivative = derivative.xreplace({subexpression: symbol})
+            if derivative != 0:
+                derivative_symbol = sp.Symbol("d{}_{}".format(symbol, name))
+                lines.append((derivative_symbol, derivative))
+                derivative_symbols[symbol] = derivative_symbol
+        derivatives.append(_derivative(reduced, param, derivative_symbols))
+    return lines, derivatives
+
+
+def _function_source(name, arg_names, lines, returns):
+    """
+    Source for a function that computes the (symbol, expression) lines and
+    returns returns[0], or a list if there is more than one.
+    """
+    printer = PythonCodePrinter({"allow_unknown_functions": True})
+    source_lines = ["def {}({}):".format(name, ", ".join(arg_names))]
+    for symbol, expression in lines:
+        source_lines.append(
+            "    {} = {}".format(symbol, printer.doprint(expression))
+        )
+    if len(returns) == 1:
+        source_lines.append(
+            "    return {}".format(printer.doprint(returns[0]))
+        )
+    else:
+        source_lines.append("    return [")
+        for expression in returns:
+            source_lines.append(
+                "        {},".format(printer.doprint(expression))
+            )
+        source_lines.append("    ]")
+    source = "\n".join(source_lines)
+    for numpy_name, function in NUMPY_FUNCTIONS.items():
+        source = source.replace(function.__name__ + "(", numpy_name + "(")
+    return source
+
+
+def expressions_hash(frac_folded_dict):
+    """A content hash of the expression strings, in construct order."""
+    digest = hashlib.sha256()
+    for key, expression_string in frac_folded_dict.items():
+        digest.update(key.encode("utf-8") + b"\0")
+        digest.update(expression_string.encode("utf-8") + b"\0")
+    return digest.hexdigest()
+
+
+def write_kernel_module(path, frac_folded_dict, param_names, source_script):
+    """
+    Writes an ff_ and a jac_ function per construct to path.  frac_folded_dict
+    is the {construct + "_frac_folded": expression string} dict written to
+    JSON by the generator scripts, param_names are the thermodynamic
+    parameters in the order the functions take them (and the order of the
+    derivatives returned by the jac_ functions).
+    """
+    arg_names = ["denat"] + list(param_names) + ["RT"]
+    constructs = [key[: -len("_frac_folded")] for key in frac_folded_dict]
+
+    header = "\n".join(
+        [
+            '"""',
+            "Fraction folded kernels generated by {}.".format(source_script),
+            "Do not edit; re-run the generator instead.",
+            '"""',
+            "",
+            "import numpy as np",
+            "",
+            'EXPRESSIONS_HASH = "{}"'.format(
+                expressions_hash(frac_folded_dict)
+            ),
+            "PARAM_NAMES = ({})".format(
+                ", ".join('"{}"'.format(name) for name in param_names)
+            ),
+        ]
+    )
+    blocks = [header]
+    for construct in constructs:
+        expression = parse_expression(
+            frac_folded_dict[construct + "_frac_folded"]
+        )
+        replacements, reduced = _cse(expression)
+        blocks.append(
+            _function_source(
+                kernel_name(construct), arg_names, replacements, [reduced]
+            )
+        )
+        lines, derivatives = _forward_derivatives(
+            replacements, reduced, param_names
+        )
+        blocks.append(
+            _function_source(
+                jacobian_name(construct), arg_names, lines, derivatives
+            )
+        )
+    for dict_name, function_name in [
+        ("FRAC_FOLDED", kernel_name),
+        ("JACOBIAN", jacobian_name),
+    ]:
+        blocks.append(
+            dict_name
+            + " = {\n"
+            + "".join(
+                '    "{}": {},\n'.format(construct, function_name(construct))
+                for construct in constructs
+            )
+            + "}"
+        )
+
+    with open(path, "w") as f:
+        f.write("\n\n\n".join(blocks) + "\n")
+
+
+def load_kernel_module(path, json_path=None):
+    """
+    Imports a module written by write_kernel_module from its path.  With
+    json_path, the generator's JSON file it was written from, raises a
+    ValueError if the expressions there have changed since (the module's
+    EXPRESSIONS_HASH no longer matches them).
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    if json_path is not None:
+        with open(json_path, "r") as f:
+            frac_folded_dict = json.load(f)
+        if module.EXPRESSIONS_HASH != expressions_hash(frac_folded_dict):
+            raise ValueError(
+                f"{path} was not written from the expressions in "
+                f"{json_path}; re-run the equation generator"
+            )
+    return module
+
+
+def load_compiled_expressions(json_path, constructs):
+    """
+    Returns {construct + "_comp_ff": code object} for the expressions in the
+    generator's JSON file at json_path, ready to eval.  The code objects are
+    cached in a .marshal file next to it, keyed on the content hash of the
+    expressions and on the Python version (marshalled code does not carry
+    across versions).  Anything else in the cache is ignored and recompiled.
+    """
+    with open(json_path, "r") as f:
+        frac_folded_dict = json.load(f)
+    names = [construct + "_frac_folded" for construct in constructs]
+    frac_folded_dict = {name: frac_folded_dict[name] for name in names}
+    key = (
+        importlib.util.MAGIC_NUMBER,
+        expressions_hash(frac_folded_dict),
+    )
+    cache_path = os.path.splitext(json_path)[0] + ".marshal"
+
+    try:
+        with open(cache_path, "rb") as f:
+            cached_key, comp_frac_folded_dict = marshal.load(f)
+        if cached_key == key:
+            return comp_frac_folded_dict
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    comp_frac_folded_dict = {}
+    for construct in constructs:
+        comp_frac_folded_dict[construct + "_comp_ff"] = compile(
+            frac_folded_dict[construct + "_frac_folded"],
+            "{}_comp_ff".format(construct),
+            "eval",
+        )
+
+    # Written under a temporary name and moved into place, so parallel
+    # workers never read a half-written cache.  Failing to write it (a
+    # read-only directory, say) only costs the compile next time.
+    tmp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+    try:
+        with open(tmp_path, "wb") as f:
+            marshal.dump((key, comp_frac_folded_dict), f)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+    return comp_frac_folded_dict
@@ -0,0 +1,180 @@
+"""
+On-disk cache of simplified fraction folded expressions.
+
+sp.simplify dominates the run time of the equation generator scripts, but
+its result for a construct only depends on the construct string, the model
+(weight matrices and substitution map) and the generator code itself.  Each
+expression is stored in its own small JSON file named by a hash of those
+three things, so different projects that share constructs share entries.
+The cache directory is kept under a size limit by deleting the least
+recently used entries.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+# Bump this whenever the generator scripts change the form of the
+# expressions they write, so stale entries are never reused.
+GENERATOR_VERSION = 1
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "ising_programs", "frac_folded"
+)
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024  # 100 MB
+
+# Temporary files older than this are from writers that were stopped before
+# moving them into place, and are removed by ExpressionCache.evict.
+STALE_TMP_SECONDS = 60 * 60
+
+
+def model_variant(name, matrices, substitutions):
+    """
+    A string that identifies a model for cache keys.  matrices is a dict of
+    the sympy weight matrices (and begin/end vectors), substitutions is the
+    dict passed to .subs() to go from K's and W's to dG's and m's.
+    """
+    matrix_part = ";".join(
+        "{}={}".format(label, matrices[label]) for label in sorted(matrices)
+    )
+    subs_part = ";".join(
+        sorted("{}->{}".format(k, v) for k, v in substitutions.items())
+    )
+    return "|".join([name, matrix_part, subs_part])
+
+
+class ExpressionCache:
+    """
+    Simplified expressions keyed by construct, model variant and generator
+    version.  The location defaults to ~/.cache/ising_programs/frac_folded,
+    and can be set with the ISING_CACHE_DIR environment variable or the
+    cache_dir argument.  Set max_bytes to bound the size of the directory.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        if cache_dir is None:
+            cache_dir = os.environ.get("ISING_CACHE_DIR", DEFAULT_CACHE_DIR)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # Total size of the entries, as of the last listing of the
+        # directory plus what put has written since; None until listed.
+        self._size = None
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, construct, variant):
+        text = "\n".join([str(GENERATOR_VERSION), variant, construct])
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _path(self, construct, variant):
+        return os.path.join(
+            self.cache_dir, self.key(construct, variant) + ".json"
+        )
+
+    def get(self, construct, variant):
+        """Returns the cached expression string, or None on a miss."""
+        path = self._path(construct, variant)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self.misses = self.misses + 1
+            return None
+
+        # Guard against hash collisions and hand-edited files.
+        if (
+            entry.get("construct") != construct
+            or entry.get("variant") != variant
+            or entry.get("version") != GENERATOR_VERSION
+        ):
+            self.misses = self.misses + 1
+            return None
+
+        # Touch the file so eviction sees it as recently used.
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.hits = self.hits + 1
+        return entry["expression"]
+
+    def put(self, construct, variant, expression):
+        entry = {
+            "construct": construct,
+            "variant": variant,
+            "version": GENERATOR_VERSION,
+            "expression": expression,
+        }
+        path = self._path(construct, variant)
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+        # Write to a temporary file first so that other processes sharing
+        # the cache directory never see a partial entry.
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(entry, f)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        # The directory is only listed again when the entries written since
+        # the last listing may have taken it over max_bytes.  Entries that
+        # other processes write in the meantime are counted then.
+        if self.max_bytes is None:
+            return
+        if self._size is not None:
+            self._size = self._size + size - old_size
+        if self._size is None or self._size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Deletes least recently used entries until they take up no more than
+        nine tenths of max_bytes, so that the next few puts fit without
+        listing the directory again, and temporary files left behind by
+        writers that were stopped.
+        """
+        entries = []
+        total = 0
+        now = time.time()
+        for filename in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, filename)
+            if filename.endswith(".tmp"):
+                try:
+                    if now - os.stat(path).st_mtime > STALE_TMP_SECONDS:
+                        os.remove(path)
+                except OSError:
+                    pass  # Moved into place or removed by another process
+                continue
+            if not filename.endswith(".json"):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # Removed by another process
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total = total + stat.st_size
+        if self.max_bytes is None or total <= self.max_bytes:
+            self._size = total
+            return
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= 0.9 * self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total = total - size
+        self._size = total
@@ -0,0 +1,152 @@
+"""
+Optional Numba backend that computes the whole residual vector, fraction
+folded and baseline mixing, in one compiled function.  HAVE_NUMBA is False
+when numba is not installed.
+"""
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+HAVE_NUMBA = numba is not None
+
+
+def _residuals(
+    theta,
+    af,
+    bf,
+    au,
+    bu,
+    m_sign,
+    RT,
+    dG_index,
+    m_index,
+    types,
+    couplings,
+    num_repeats,
+    pair_row,
+    pair_denat,
+    point_pair,
+    point_melt,
+    denat,
+    signal,
+    frac_folded,
+    out,
+):
+    # Interface weights, for every parameter (only couplings are used).
+    T = np.empty(len(theta))
+    for j in range(len(theta)):
+        T[j] = np.exp(-theta[j] / RT)
+
+    # Fraction folded once per distinct construct and denaturant pair.
+    K = np.empty(len(dG_index))
+    for p in range(len(pair_row)):
+        x = pair_denat[p]
+        for t in range(len(dG_index)):
+            K[t] = np.exp(
+                -(theta[dG_index[t]] + m_sign * theta[m_index[t]] * x) / RT
+            )
+        row = pair_row[p]
+        v0 = 0.0
+        v1 = 1.0
+        dv0 = 0.0
+        dv1 = 0.0
+        for i in range(types.shape[1]):
+            t = types[row, i]
+            if t < 0:
+                continue  # Padding in front of shorter constructs.
+            k = K[t]
+            kt = k
+            if couplings[row, i] >= 0:
+                kt = k * T[couplings[row, i]]
+            new0 = v0 * kt + v1 * k
+            new_d0 = (dv0 + v0) * kt + (dv1 + v1) * k
+            new1 = v0 + v1
+            new_d1 = dv0 + dv1
+            scale = new0 + new1
+            v0 = new0 / scale
+            v1 = new1 / scale
+            dv0 = new_d0 / scale
+            dv1 = new_d1 / scale
+        frac_folded[p] = (dv0 + dv1) / (v0 + v1) / num_repeats[row]
+
+    # Baseline mixing for every data point.
+    for i in range(len(denat)):
+        f = frac_folded[point_pair[i]]
+        m = point_melt[i]
+        x = denat[i]
+        out[i] = signal[i] - (
+            (af[m] * x + bf[m]) * f + (au[m] * x + bu[m]) * (1 - f)
+        )
+
+
+if HAVE_NUMBA:
+    _residuals = numba.njit(cache=True)(_residuals)
+
+
+class FusedResiduals:
+    """
+    Residuals (signal minus fitted signal) for every point of a MeltDataset,
+    with fraction folded from a TransferMatrixModel that covers all of the
+    dataset's constructs.
+
+    Call with theta (in model.param_names order) and the af, bf, au and bu
+    baseline parameters as arrays in the dataset's melt order.  Every call
+    fills and returns the same array, out.
+    """
+
+    def __init__(self, model, dataset):
+        if not HAVE_NUMBA:
+            raise ImportError("FusedResiduals needs numba")
+        self.model = model
+        self.dataset = dataset
+
+        # Distinct (construct, denaturant) pairs, and the pair of each point.
+        pair_row_list = []
+        pair_denat_list = []
+        self.point_pair = np.zeros(len(dataset), dtype=np.int64)
+        num_pairs = 0
+        construct_points = dataset.construct_points()
+        for construct, (rows, denat, inverse) in construct_points.items():
+            pair_row_list.append(np.full(len(denat), model._row[construct]))
+            pair_denat_list.append(denat)
+            self.point_pair[rows] = num_pairs + inverse
+            num_pairs += len(denat)
+        self.pair_row = np.concatenate(pair_row_list).astype(np.int64)
+        self.pair_denat = np.concatenate(pair_denat_list)
+        self.frac_folded = np.zeros(num_pairs)
+        self.out = np.zeros(len(dataset))
+
+        self.types = model._types.astype(np.int64)
+        self.couplings = model._couplings.astype(np.int64)
+        self.dG_index = model._dG_index.astype(np.int64)
+        self.m_index = model._m_index.astype(np.int64)
+        self.num_repeats = model.num_repeats.astype(np.float64)
+
+    def __call__(self, theta, af, bf, au, bu):
+        _residuals(
+            np.asarray(theta, dtype=np.float64),
+            np.asarray(af, dtype=np.float64),
+            np.asarray(bf, dtype=np.float64),
+            np.asarray(au, dtype=np.float64),
+            np.asarray(bu, dtype=np.float64),
+            float(self.model.m_sign),
+            float(self.model.RT),
+            self.dG_index,
+            self.m_index,
+            self.types,
+            self.couplings,
+            self.num_repeats,
+            self.pair_row,
+            self.pair_denat,
+            self.point_pair,
+            self.dataset.melt_id,
+            self.dataset.denat,
+            self.dataset.signal,
+            self.frac_folded,
+            self.out,
+        )
+        return self.out
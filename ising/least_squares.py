@@ -0,0 +1,163 @@
+"""
+Fits with scipy.optimize.least_squares directly, as a drop-in for
+lmfit.minimize in the fitting scripts.  Parameters with expressions (expr)
+are not supported.
+"""
+
+import numpy as np
+from scipy.optimize import least_squares
+from scipy.sparse import coo_matrix
+
+
+class _Value:
+    """Stand-in for one lmfit Parameter, a view of a ParameterVector."""
+
+    __slots__ = ("_values", "_index", "vary")
+
+    def __init__(self, values, index, vary):
+        self._values = values
+        self._index = index
+        self.vary = vary
+
+    @property
+    def value(self):
+        return self._values[self._index]
+
+
+class ParameterVector:
+    """
+    Stand-in for lmfit Parameters during a fit: values holds the value of
+    every parameter, in the order of names, as one float array, and
+    set_varied writes the optimizer's vector into the varied ones in place.
+    params[name].value, params[name].vary and valuesdict() work as for
+    Parameters, for objectives that look parameters up by name.
+    """
+
+    def __init__(self, params):
+        self.names = list(params)
+        self.values = np.array(
+            [params[name].value for name in self.names], dtype=float
+        )
+        vary = [params[name].vary for name in self.names]
+        self.var_index = np.flatnonzero(vary)
+        self._params = {
+            name: _Value(self.values, i, vary[i])
+            for i, name in enumerate(self.names)
+        }
+
+    def set_varied(self, x):
+        self.values[self.var_index] = x
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, name):
+        return self._params[name]
+
+    def valuesdict(self):
+        return dict(zip(self.names, self.values.tolist()))
+
+
+class LeastSquaresResult:
+    """
+    The fields of lmfit's MinimizerResult that the fitting scripts use:
+    params (a copy of the Parameters with the fitted values), residual,
+    chisqr, redchi, ndata, nvarys, nfree, nfev, success and message, plus
+    var_names and the least_squares result itself as scipy_result.  The
+    parameters get no uncertainties (stderr and correl stay unset).
+    """
+
+    def __init__(self, params, var_names, scipy_result):
+        self.params = params
+        self.var_names = var_names
+        self.scipy_result = scipy_result
+        self.residual = scipy_result.fun
+        self.ndata = len(self.residual)
+        self.nvarys = len(var_names)
+        self.nfree = self.ndata - self.nvarys
+        self.chisqr = float(np.dot(self.residual, self.residual))
+        self.redchi = self.chisqr / max(self.nfree, 1)
+        self.nfev = scipy_result.nfev
+        self.success = scipy_result.success
+        self.message = scipy_result.message
+
+
+def jacobian_sparsity(var_names, param_rows, ndata):
+    """
+    Sparsity pattern of the Jacobian (ndata x len(var_names)).  param_rows
+    maps a parameter name to the rows (a slice or an index array) of the
+    residuals it affects; parameters not in param_rows affect every row.
+    """
+    all_rows = np.arange(ndata)
+    row_list = []
+    column_list = []
+    for column, name in enumerate(var_names):
+        rows = all_rows[param_rows[name]] if name in param_rows else all_rows
+        row_list.append(rows)
+        column_list.append(np.full(len(rows), column))
+    rows = np.concatenate(row_list)
+    columns = np.concatenate(column_list)
+    return coo_matrix(
+        (np.ones(len(rows)), (rows, columns)), shape=(ndata, len(var_names))
+    ).tocsr()
+
+
+def least_squares_minimize(
+    objective, params, Dfun=None, x_scale="jac", param_rows=None, **kws
+):
+    """
+    Minimizes the sum of squares of objective(params), like
+    lmfit.minimize(objective, params, Dfun=Dfun).  objective may return the
+    same array, refilled, on every call.  params are lmfit Parameters; their
+    min and max become least_squares bounds, and params itself is left
+    unchanged.  objective is called with a ParameterVector of params holding
+    the current values.  Dfun, if given, takes the same argument and returns
+    the Jacobian with one column per varied parameter, in order.  Without
+    Dfun, param_rows (see jacobian_sparsity) declares which parameters only
+    affect some of the residuals.  x_scale and any other keywords are passed
+    on to scipy.optimize.least_squares.
+    """
+    names = list(params)
+    for name in names:
+        if params[name].expr:
+            raise ValueError(
+                f"Parameter '{name}' has an expression, which "
+                "least_squares_minimize does not support"
+            )
+    var_names = [name for name in names if params[name].vary]
+    vector = ParameterVector(params)
+
+    # least_squares keeps the residuals of the point it takes finite
+    # differences around (and of its current point between iterations), so
+    # the objective's buffer is copied on every call.
+    def fun(x):
+        vector.set_varied(x)
+        return np.array(objective(vector))
+
+    if Dfun is None:
+        jac = "2-point"
+    else:
+
+        def jac(x):
+            vector.set_varied(x)
+            return Dfun(vector)
+
+    x0 = np.array([params[name].value for name in var_names], dtype=float)
+    if Dfun is None and param_rows is not None:
+        ndata = len(fun(x0))
+        kws.setdefault(
+            "jac_sparsity", jacobian_sparsity(var_names, param_rows, ndata)
+        )
+    lower = np.array([params[name].min for name in var_names], dtype=float)
+    upper = np.array([params[name].max for name in var_names], dtype=float)
+    scipy_result = least_squares(
+        fun, x0, jac=jac, bounds=(lower, upper), x_scale=x_scale, **kws
+    )
+
+    fitted_params = params.copy()
+    for name, x_i in zip(var_names, scipy_result.x):
+        fitted_params[name].value = float(x_i)
+    return LeastSquaresResult(fitted_params, var_names, scipy_result)
@@ -0,0 +1,127 @@
+"""
+Melt data in one typed structure, written by the data conversion scripts and
+loaded once by the fitters.
+"""
+
+import numpy as np
+
+
+class MeltDataset:
+    """
+    melts and constructs are lists of names, in the order of the melts and
+    constructs json files.  denat and signal run over all data points, and
+    melt_id and construct_id give the index into melts and constructs of each
+    point.  Points must be grouped by melt, in the order of melts.
+    """
+
+    def __init__(
+        self, melts, constructs, denat, signal, melt_id, construct_id
+    ):
+        self.melts = list(melts)
+        self.constructs = list(constructs)
+        self.denat = np.ascontiguousarray(denat, dtype=np.float64)
+        self.signal = np.ascontiguousarray(signal, dtype=np.float64)
+        self.melt_id = np.ascontiguousarray(melt_id, dtype=np.int64)
+        self.construct_id = np.ascontiguousarray(construct_id, dtype=np.int64)
+
+        num_points = len(self.denat)
+        if not (
+            len(self.signal)
+            == len(self.melt_id)
+            == len(self.construct_id)
+            == num_points
+        ):
+            raise ValueError("All columns must have the same length")
+        counts = np.bincount(self.melt_id, minlength=len(self.melts))
+        if len(counts) > len(self.melts) or np.any(
+            self.melt_id != np.repeat(np.arange(len(self.melts)), counts)
+        ):
+            raise ValueError(
+                "Data points must be grouped by melt, in the order of melts"
+            )
+        bounds = np.concatenate(([0], np.cumsum(counts)))
+        self.slices = {
+            melt: slice(bounds[i], bounds[i + 1])
+            for i, melt in enumerate(self.melts)
+        }
+
+    def __len__(self):
+        return len(self.denat)
+
+    @classmethod
+    def from_melt_arrays(cls, melts, constructs, melt_array_dict):
+        """
+        Builds a dataset from {melt: array} with denaturant and signal in
+        the first two columns, as in the per-melt .npy files.  The construct
+        of a melt is its name without the trailing melt number.
+        """
+        construct_index = {name: i for i, name in enumerate(constructs)}
+        denat_list = []
+        signal_list = []
+        melt_id_list = []
+        construct_id_list = []
+        for i, melt in enumerate(melts):
+            melt_array = np.asarray(melt_array_dict[melt])
+            num_points = len(melt_array)
+            denat_list.append(melt_array[:, 0].astype(float))
+            signal_list.append(melt_array[:, 1].astype(float))
+            melt_id_list.append(np.full(num_points, i))
+            construct_id_list.append(
+                np.full(num_points, construct_index[melt[:-2]])
+            )
+        return cls(
+            melts,
+            constructs,
+            np.concatenate(denat_list),
+            np.concatenate(signal_list),
+            np.concatenate(melt_id_list),
+            np.concatenate(construct_id_list),
+        )
+
+    def save(self, path):
+        np.savez(
+            path,
+            melts=np.array(self.melts),
+            constructs=np.array(self.constructs),
+            denat=self.denat,
+            signal=self.signal,
+            melt_id=self.melt_id,
+            construct_id=self.construct_id,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls(
+                f["melts"].tolist(),
+                f["constructs"].tolist(),
+                f["denat"],
+                f["signal"],
+                f["melt_id"],
+                f["construct_id"],
+            )
+
+    def construct_points(self):
+        """
+        Groups the data points by construct, so that fraction folded can be
+        evaluated once per construct rather than once per melt.  Returns
+        {construct: (rows, denat, inverse)}, where rows are the indices of
+        the construct's data points, denat its distinct denaturant
+        concentrations, and denat[inverse] the denaturant at each of rows.
+        """
+        groups = {}
+        for i, construct in enumerate(self.constructs):
+            rows = np.flatnonzero(self.construct_id == i)
+            if len(rows) == 0:
+                continue
+            denat, inverse = np.unique(self.denat[rows], return_inverse=True)
+            groups[construct] = (rows, denat, inverse)
+        return groups
+
+    def melt_denat(self, melt):
+        """Denaturant concentrations of one melt (a view)."""
+        return self.denat[self.slices[melt]]
+
+    def melt_signal(self, melt):
+        """Normalized signal of one melt (a view, so it can be written to)."""
+        return self.signal[self.slices[melt]]
@@ -0,0 +1,103 @@
+"""
+Declarative description of a heteropolymer Ising model.
+
+A model spec is a JSON file that lists the repeat types, with the names of
+their intrinsic free energy and m-value parameters, and the name of the
+free energy parameter for each interface between two repeat types:
+
+    {
+        "repeats": {
+            "N": {"dG": "dGN", "m": "mR"},
+            "R": {"dG": "dGR", "m": "mR"},
+            ...
+        },
+        "couplings": {
+            "N_R": "dGRR",
+            "R_R": "dGRR",
+            ...
+        }
+    }
+
+Coupling keys are the previous and the current repeat joined with an
+underscore, as in construct names.  As in the heteropolymer scripts, K for
+a repeat is exp(-(dG + m * denat)/RT) and the weight of an interface is
+exp(-dGij/RT).  Several repeats or interfaces can share a parameter.
+"""
+
+import json
+
+from ising.transfer_matrix import RT_DEFAULT, TransferMatrixModel
+
+
+def parse_model_spec(raw):
+    """
+    Checks a spec (as loaded from JSON) and returns a dict with
+        "repeats":     {repeat: (dG name, m name)}
+        "couplings":   {(previous repeat, repeat): coupling name}
+        "param_names": all parameter names; intrinsic dG's, then couplings,
+                       then m-values, each in the order they first appear.
+    """
+    repeats = {}
+    for rpt, entry in raw["repeats"].items():
+        if "_" in rpt:
+            raise ValueError(
+                f"Repeat type '{rpt}' can not contain an underscore"
+            )
+        repeats[rpt] = (entry["dG"], entry["m"])
+
+    couplings = {}
+    for pair, name in raw["couplings"].items():
+        prev, _, rpt = pair.partition("_")
+        if prev not in repeats or rpt not in repeats:
+            raise ValueError(
+                f"Coupling '{pair}' refers to a repeat type that is not "
+                "listed under repeats"
+            )
+        couplings[(prev, rpt)] = name
+
+    param_names = []
+    for name in (
+        [dG for dG, m in repeats.values()]
+        + list(couplings.values())
+        + [m for dG, m in repeats.values()]
+    ):
+        if name not in param_names:
+            param_names.append(name)
+
+    return {
+        "repeats": repeats,
+        "couplings": couplings,
+        "param_names": tuple(param_names),
+    }
+
+
+def param_kinds(spec):
+    """
+    {name: kind} for every parameter of a parsed spec, in param_names order,
+    where kind is "dG" for an intrinsic free energy, "coupling" or "m".
+    """
+    kinds = {}
+    for dG, m in spec["repeats"].values():
+        kinds.setdefault(dG, "dG")
+    for name in spec["couplings"].values():
+        kinds.setdefault(name, "coupling")
+    for dG, m in spec["repeats"].values():
+        kinds.setdefault(m, "m")
+    return {name: kinds[name] for name in spec["param_names"]}
+
+
+def load_model_spec(path):
+    with open(path, "r") as f:
+        return parse_model_spec(json.load(f))
+
+
+def spec_model(spec, constructs, RT=RT_DEFAULT):
+    """Transfer-matrix model for the constructs from a parsed spec."""
+    return TransferMatrixModel(
+        constructs,
+        spec["repeats"],
+        spec["couplings"],
+        spec["param_names"],
+        m_sign=1.0,
+        RT=RT,
+    )
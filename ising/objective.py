@@ -0,0 +1,602 @@
+"""
+The least-squares fit shared by the fitters: residuals of an Ising model
+against every melt of a MeltDataset, their Jacobian, the fit with lmfit or
+least_squares, and the bootstrap replicate fits.
+"""
+
+import sys
+
+import lmfit
+import numpy as np
+from scipy.sparse import coo_matrix
+
+from ising.bootstrap import ReplicatePool, replicate_rng, resample_signal
+from ising.codegen import load_compiled_expressions, load_kernel_module
+from ising.fused import HAVE_NUMBA, FusedResiduals
+from ising.least_squares import ParameterVector, least_squares_minimize
+from ising.melt_data import MeltDataset
+from ising.telemetry import FitTelemetry
+from ising.transfer_matrix import PrefixTrie
+from ising.variable_projection import projected_residuals, solve_baselines
+
+BASELINE_KINDS = ("af", "bf", "au", "bu")
+
+# Engines that evaluate the TransferMatrixModel numerically.
+TRANSFER_MATRIX_ENGINES = (
+    "transfer_matrix",
+    "log_transfer_matrix",
+    "trie",
+    "numba",
+)
+
+
+class MeltObjective:
+    """
+    Residuals (signal minus fitted signal) of the Ising model at every data
+    point of dataset (a MeltDataset), for lmfit Parameters holding the
+    model's thermodynamic parameters and af, bf, au and bu for every melt.
+
+    model is a TransferMatrixModel for the dataset's constructs, which fixes
+    the thermodynamic parameter names (param_names) and RT.  ff_engine picks
+    how fraction folded is calculated:
+
+    * "kernels" calls the vectorized functions in {project}_ff_kernels.py,
+      written by the equation generator, which also give the analytic
+      Jacobian.
+    * "expressions" evals the strings in {project}_frac_folded_dict.json.
+    * "transfer_matrix" multiplies out model's weight matrices, and
+      "log_transfer_matrix" does the same in log space, which cannot
+      overflow.
+    * "trie" evaluates all the melts in one pass of a PrefixTrie, so shared
+      prefixes and denaturant points are only computed once.
+    * "numba" computes the whole residual vector in one compiled function
+      (see ising/fused.py), and falls back to "trie" without numba.
+
+    fit_engine is "lmfit" (lmfit.minimize) or "least_squares"
+    (scipy.optimize.least_squares, see ising/least_squares.py).  With
+    variable_projection the baselines are solved for by linear least squares
+    at every evaluation (see ising/variable_projection.py), so the optimizer
+    only varies the thermodynamic parameters.  Counts and timings of the
+    evaluations go to telemetry.
+    """
+
+    def __init__(
+        self,
+        dataset,
+        model,
+        project,
+        ff_engine="kernels",
+        fit_engine="lmfit",
+        variable_projection=False,
+    ):
+        if ff_engine == "numba" and not HAVE_NUMBA:
+            print("numba is not installed, using the trie engine instead.")
+            ff_engine = "trie"
+        self.dataset = dataset
+        self.model = model
+        self.project = project
+        self.ff_engine = ff_engine
+        self.fit_engine = fit_engine
+        self.variable_projection = variable_projection
+        self.param_names = model.param_names
+        self.RT = model.RT
+        self.telemetry = FitTelemetry()
+
+        # Names of the baseline parameters of each kind, in the dataset's
+        # melt order.
+        self.baseline_names = {
+            kind: ["{}_{}".format(kind, melt) for melt in dataset.melts]
+            for kind in BASELINE_KINDS
+        }
+
+        # Every parameter, in the order make_params adds them, and where
+        # each melt's baselines sit in that order, so that an evaluation
+        # reads them straight from one array of values (see _values).
+        self.param_order = list(self.param_names) + [
+            "{}_{}".format(kind, melt)
+            for melt in dataset.melts
+            for kind in BASELINE_KINDS
+        ]
+        param_index = {name: i for i, name in enumerate(self.param_order)}
+        self._baseline_index = np.array(
+            [
+                [param_index[name] for name in self.baseline_names[kind]]
+                for kind in BASELINE_KINDS
+            ]
+        )
+
+        if ff_engine == "trie":
+            # The denaturant points never change (bootstrapping only
+            # resamples the signal), so the trie is laid out once.
+            self.trie = PrefixTrie(
+                model,
+                [
+                    (melt[:-2], dataset.melt_denat(melt))
+                    for melt in dataset.melts
+                ],
+            )
+        elif ff_engine == "numba":
+            self.fused_residuals = FusedResiduals(model, dataset)
+        elif ff_engine == "kernels":
+            # Refused if the generator has rewritten the expressions since
+            # the kernels were written.
+            self.kernels = load_kernel_module(
+                project + "_ff_kernels.py", project + "_frac_folded_dict.json"
+            )
+            # The kernels take the thermodynamic parameters in their own
+            # order.
+            self._kernel_index = np.array(
+                [param_index[name] for name in self.kernels.PARAM_NAMES]
+            )
+        elif ff_engine == "expressions":
+            #  The compiled code is cached next to the json file and reused
+            #  until the expressions change.
+            self.expressions = load_compiled_expressions(
+                project + "_frac_folded_dict.json", dataset.constructs
+            )
+        elif ff_engine not in TRANSFER_MATRIX_ENGINES:
+            raise ValueError(f"Unknown ff_engine '{ff_engine}'")
+
+        # Work arrays, filled in place on every evaluation (see
+        # fitted_signal), and the distinct denaturant points of each
+        # construct (see dataset_frac_folded).
+        self._melt_baselines = np.zeros((4, len(dataset.melts)))
+        self._point_baselines = np.zeros((4, len(dataset)))
+        self._frac_folded = np.zeros(len(dataset))
+        self._fitted = np.zeros(len(dataset))
+        self._residuals = np.zeros(len(dataset))
+        self.construct_points = dataset.construct_points()
+
+        # The analytic Jacobian needs the kernel module.  The other engines
+        # leave the optimizer to take finite differences, as does variable
+        # projection, which only has the thermodynamic parameters to vary.
+        if fit_engine == "least_squares":
+            self._minimize = least_squares_minimize
+            if ff_engine == "kernels" and not variable_projection:
+                # least_squares takes the Jacobian as a sparse matrix and
+                # solves each step iteratively (lsmr) rather than densely.
+                self.fit_kws = {
+                    "Dfun": self.sparse_jacobian,
+                    "tr_solver": "lsmr",
+                }
+            else:
+                # Each melt's baselines only affect that melt's residuals,
+                # so finite differences can perturb the baselines of many
+                # melts at once.
+                self.fit_kws = {
+                    "param_rows": {
+                        name: dataset.slices[melt]
+                        for kind in BASELINE_KINDS
+                        for melt, name in zip(
+                            dataset.melts, self.baseline_names[kind]
+                        )
+                    }
+                }
+        elif fit_engine == "lmfit":
+            self._minimize = _lmfit_minimize
+            if ff_engine == "kernels" and not variable_projection:
+                self.fit_kws = {"Dfun": self.jacobian}
+            else:
+                self.fit_kws = {}
+        else:
+            raise ValueError(f"Unknown fit_engine '{fit_engine}'")
+
+    @property
+    def settings(self):
+        """The arguments, other than dataset, that rebuild this objective."""
+        return {
+            "model": self.model,
+            "project": self.project,
+            "ff_engine": self.ff_engine,
+            "fit_engine": self.fit_engine,
+            "variable_projection": self.variable_projection,
+        }
+
+    def make_params(self, thermo_guesses, baseline_guesses):
+        """
+        lmfit Parameters to start a fit from: the thermodynamic parameters
+        in param_names order, from {name: value}, then af, bf, au and bu for
+        each melt, from {kind: value}.  With variable projection the
+        baselines are not varied.
+        """
+        params = lmfit.Parameters()
+        for name in self.param_names:
+            params.add(name, value=thermo_guesses[name])
+        for melt in self.dataset.melts:
+            for kind in BASELINE_KINDS:
+                params.add(
+                    "{}_{}".format(kind, melt),
+                    value=baseline_guesses[kind],
+                    vary=not self.variable_projection,
+                )
+        return params
+
+    def _values(self, params):
+        """
+        The value of every parameter, in param_order, as a float array: the
+        least_squares ParameterVector's own array, or one valuesdict call
+        for lmfit Parameters.
+        """
+        if isinstance(params, ParameterVector):
+            return params.values
+        return np.fromiter(
+            params.valuesdict().values(),
+            dtype=float,
+            count=len(self.param_order),
+        )
+
+    def _theta(self, values):
+        """The thermodynamic parameters, in param_names order (a view)."""
+        return values[: len(self.param_names)]
+
+    def _construct_frac_folded(self, values, denat, construct):
+        if self.ff_engine in TRANSFER_MATRIX_ENGINES:
+            return self.model.frac_folded(
+                self._theta(values),
+                denat,
+                construct,
+                log_space=(self.ff_engine == "log_transfer_matrix"),
+            )
+        if self.ff_engine == "kernels":
+            theta = values[self._kernel_index]
+            return self.kernels.FRAC_FOLDED[construct](denat, *theta, self.RT)
+        names = dict(zip(self.param_names, self._theta(values)))
+        names.update(np=np, denat=denat, RT=self.RT)
+        return eval(self.expressions[construct + "_comp_ff"], names)
+
+    def frac_folded(self, params, denat, construct):
+        """Fraction folded of one construct at the denaturant points."""
+        return self._construct_frac_folded(
+            self._values(params), denat, construct
+        )
+
+    def dataset_frac_folded(self, values):
+        """
+        Fraction folded at every data point, in the dataset's order, for
+        the parameter values from _values.  Replicate melts of a construct
+        share their denaturant points, so each construct is evaluated once
+        at its distinct points and the results are scattered back to its
+        melts.  Filled in place.
+        """
+        telemetry = self.telemetry
+        if self.ff_engine == "trie":
+            theta = self._theta(values)
+            # One pass serves every construct, so the time is a total.
+            with telemetry.frac_folded_timer("total (trie)"):
+                melt_frac_folded = self.trie.frac_folded(theta)
+            for melt, frac_folded in zip(self.dataset.melts, melt_frac_folded):
+                self._frac_folded[self.dataset.slices[melt]] = frac_folded
+            return self._frac_folded
+        for construct, (rows, denat, inverse) in self.construct_points.items():
+            with telemetry.frac_folded_timer(construct):
+                frac_folded = self._construct_frac_folded(
+                    values, denat, construct
+                )
+            self._frac_folded[rows] = frac_folded[inverse]
+        return self._frac_folded
+
+    def melt_baseline_values(self, values):
+        """
+        af, bf, au and bu as arrays in the dataset's melt order, gathered
+        from the parameter values.  Filled in place, so only good until the
+        next call.
+        """
+        return np.take(values, self._baseline_index, out=self._melt_baselines)
+
+    def baseline_values(self, values):
+        """
+        af, bf, au and bu at every data point, picked out by the melt id of
+        each point.  Filled in place like melt_baseline_values.
+        """
+        np.take(
+            self.melt_baseline_values(values),
+            self.dataset.melt_id,
+            axis=1,
+            out=self._point_baselines,
+        )
+        return self._point_baselines
+
+    def fitted_signal(self, values, frac_folded):
+        """
+        Normalized signal at every data point from fraction folded there,
+        written into preallocated arrays (the point baselines are
+        overwritten).
+        """
+        af, bf, au, bu = self.baseline_values(values)
+        denat = self.dataset.denat
+        np.multiply(af, denat, out=af)
+        np.add(af, bf, out=af)
+        np.multiply(af, frac_folded, out=af)
+        np.multiply(au, denat, out=au)
+        np.add(au, bu, out=au)
+        np.subtract(1, frac_folded, out=bf)
+        np.multiply(au, bf, out=au)
+        return np.add(af, au, out=self._fitted)
+
+    def residuals(self, params):
+        """Residuals at every data point, with the baseline step timed."""
+        telemetry = self.telemetry
+        values = self._values(params)
+        if self.variable_projection:
+            frac_folded = self.dataset_frac_folded(values)
+            with telemetry.timer("baseline_mixing"):
+                return projected_residuals(self.dataset, frac_folded)
+        if self.ff_engine == "numba":
+            with telemetry.timer("fused_residuals"):
+                return self.fused_residuals(
+                    self._theta(values), *self.melt_baseline_values(values)
+                )
+        frac_folded = self.dataset_frac_folded(values)
+        with telemetry.timer("baseline_mixing"):
+            fitted = self.fitted_signal(values, frac_folded)
+            return np.subtract(
+                self.dataset.signal, fitted, out=self._residuals
+            )
+
+    def __call__(self, params):
+        """The objective handed to the optimizer, counted and timed."""
+        self.telemetry.count("objective")
+        with self.telemetry.timer("objective"):
+            return self.residuals(params)
+
+    def _jacobian_columns(self, params):
+        """
+        Lays out the Jacobian columns for the parameters that params
+        varies, once per fit: _thermo_kernel picks the varied thermodynamic
+        parameters out of the kernel module's order, _thermo_columns are
+        their columns, and _baseline_columns holds the column of af, bf, au
+        and bu at every data point (-1 where not varied).
+        """
+        vary = np.array([params[name].vary for name in self.param_order])
+        column = np.where(vary, np.cumsum(vary) - 1, -1)
+        kernel_columns = column[self._kernel_index]
+        self._thermo_kernel = np.flatnonzero(kernel_columns >= 0)
+        self._thermo_columns = kernel_columns[self._thermo_kernel]
+        self._baseline_columns = column[self._baseline_index][
+            :, self.dataset.melt_id
+        ]
+        self._num_columns = int(vary.sum())
+
+    def calc_jacobian(self, params, sparse=False):
+        """
+        Jacobian of the residuals, from the exact fraction folded
+        derivatives in the kernel module.  Columns follow the order of the
+        varied parameters, as lmfit expects.  With sparse, a scipy.sparse
+        CSR matrix that only holds the thermodynamic columns and, in each
+        melt's rows, that melt's own baseline columns, so its size grows
+        linearly with the number of melts rather than quadratically.  The
+        columns are laid out by _jacobian_columns at the start of the fit.
+        """
+        dataset = self.dataset
+        kernels = self.kernels
+        values = self._values(params)
+        theta = values[self._kernel_index]
+        thermo_kernel = self._thermo_kernel
+        frac_folded = np.zeros(len(dataset))
+        jac_thermo = np.zeros((len(dataset), len(thermo_kernel)))
+        telemetry = self.telemetry
+        for construct, (rows, denat, inverse) in self.construct_points.items():
+            with telemetry.frac_folded_timer(construct):
+                construct_frac_folded = kernels.FRAC_FOLDED[construct](
+                    denat, *theta, self.RT
+                )
+                dff_list = kernels.JACOBIAN[construct](denat, *theta, self.RT)
+            frac_folded[rows] = construct_frac_folded[inverse]
+            for j, k in enumerate(thermo_kernel):
+                # Constant derivatives come back as plain numbers.
+                jac_thermo[rows, j] = np.broadcast_to(
+                    dff_list[k], denat.shape
+                )[inverse]
+
+        # Thermodynamic parameters only enter through fraction folded.
+        af, bf, au, bu = self.baseline_values(values)
+        denat = dataset.denat
+        amplitude = ((af - au) * denat) + (bf - bu)
+        jac_thermo *= -amplitude[:, np.newaxis]
+
+        # Baseline parameters only affect their own melt.
+        rows = np.arange(len(dataset))
+        baseline_derivs = {
+            "af": -denat * frac_folded,
+            "bf": -frac_folded,
+            "au": -denat * (1 - frac_folded),
+            "bu": -(1 - frac_folded),
+        }
+        row_list = [np.repeat(rows, len(thermo_kernel))]
+        column_list = [np.tile(self._thermo_columns, len(dataset))]
+        value_list = [jac_thermo.ravel()]
+        for melt_columns, deriv in zip(
+            self._baseline_columns, baseline_derivs.values()
+        ):
+            varied = melt_columns >= 0
+            row_list.append(rows[varied])
+            column_list.append(melt_columns[varied])
+            value_list.append(deriv[varied])
+
+        if sparse:
+            return coo_matrix(
+                (
+                    np.concatenate(value_list),
+                    (np.concatenate(row_list), np.concatenate(column_list)),
+                ),
+                shape=(len(dataset), self._num_columns),
+            ).tocsr()
+        jac_all = np.zeros((len(dataset), self._num_columns))
+        for jac_rows, jac_columns, values in zip(
+            row_list, column_list, value_list
+        ):
+            jac_all[jac_rows, jac_columns] = values
+        return jac_all
+
+    def jacobian(self, params):
+        """The Jacobian handed to lmfit, counted and timed."""
+        self.telemetry.count("jacobian")
+        with self.telemetry.timer("jacobian"):
+            return self.calc_jacobian(params)
+
+    def sparse_jacobian(self, params):
+        """The same as a sparse matrix, for least_squares."""
+        self.telemetry.count("jacobian")
+        with self.telemetry.timer("jacobian"):
+            return self.calc_jacobian(params, sparse=True)
+
+    def minimize(self, params):
+        """
+        Fits from params, which must hold the parameters of make_params in
+        the same order, with fit_engine.  Returns the fit result.
+        """
+        if list(params) != self.param_order:
+            raise ValueError(
+                "params must have the parameters of make_params, in order"
+            )
+        if self.ff_engine == "kernels":
+            self._jacobian_columns(params)
+        return self._minimize(self, params, **self.fit_kws)
+
+    def add_projected_baselines(self, fit_result):
+        """
+        With variable projection, the fit result holds the initial
+        baselines.  This fills in the ones solved for at the fitted
+        thermodynamic parameters, and counts them as fitted parameters in
+        the degrees of freedom.
+        """
+        frac_folded = self.dataset_frac_folded(self._values(fit_result.params))
+        baselines = solve_baselines(self.dataset, frac_folded)
+        for kind, values in zip(BASELINE_KINDS, baselines):
+            for name, value in zip(self.baseline_names[kind], values):
+                fit_result.params[name].value = float(value)
+        fit_result.nvarys += baselines.size
+        fit_result.nfree -= baselines.size
+        fit_result.redchi = fit_result.chisqr / fit_result.nfree
+
+    def fit(self, params, label, keep=True):
+        """
+        Fits from params, recording the fit in telemetry under label (see
+        FitTelemetry.finish for keep).  Returns the fit result, with the
+        projected baselines filled in, and the telemetry record.
+        """
+        self.telemetry.start(label)
+        fit_result = self.minimize(params)
+        record = self.telemetry.finish(fit_result, keep=keep)
+        if self.variable_projection:
+            self.add_projected_baselines(fit_result)
+        return fit_result, record
+
+
+# The objective returns the same residual buffer on every call, but lmfit
+# (scipy's leastsq underneath) keeps the residuals of the point it takes
+# finite differences around, so it is handed a copy of each.
+def _lmfit_minimize(objective, params, **kws):
+    return lmfit.minimize(lambda p: objective(p).copy(), params, **kws)
+
+
+class BootstrapReplicates:
+    """
+    Bootstrap replicate fits for a MeltObjective.  Replicate i adds
+    residuals drawn with replacement (across melts) from residuals, with
+    replicate_rng(seed, i), to y_fitted, the best-fit signal at every data
+    point, writes the result to the objective's dataset signal, and refits
+    from start_params.  Calling with i returns the row for the bootstrap
+    parameter file (i, the thermodynamic parameters in param_names order,
+    the reduced chi-square and the chi-square) and the telemetry record of
+    the fit.  With iter_tot given, each replicate is announced as i out of
+    iter_tot.
+    """
+
+    def __init__(
+        self, objective, y_fitted, residuals, seed, start_params, iter_tot=None
+    ):
+        self.objective = objective
+        self.y_fitted = y_fitted
+        self.residuals = residuals
+        self.seed = seed
+        self.start_params = start_params
+        self.iter_tot = iter_tot
+
+    def __call__(self, i):
+        if self.iter_tot is not None:
+            print(
+                "Bootstrap iteration {0} out of {1}".format(i, self.iter_tot)
+            )
+            sys.stdout.flush()
+
+        objective = self.objective
+        dataset = objective.dataset
+        dataset.signal[:] = resample_signal(
+            dataset, self.y_fitted, self.residuals, replicate_rng(self.seed, i)
+        )
+        bs_result, bs_record = objective.fit(
+            self.start_params, "bootstrap {}".format(i), keep=False
+        )
+        bs_row = (
+            [i]
+            + [bs_result.params[name].value for name in objective.param_names]
+            + [bs_result.redchi, bs_result.chisqr]
+        )
+        return bs_row, bs_record
+
+    def pool(self, num_cores, start_method=None):
+        """
+        A ReplicatePool that runs the replicates in num_cores worker
+        processes, or in this one with one core.  The dataset's denaturant
+        and ids, y_fitted and residuals go to the workers in shared memory,
+        and each worker builds its own objective from them (see
+        _start_replicates).
+        """
+        if num_cores <= 1:
+            return ReplicatePool(self)
+        dataset = self.objective.dataset
+        return ReplicatePool(
+            _run_replicate,
+            num_cores,
+            shared={
+                "denat": dataset.denat,
+                "melt_id": dataset.melt_id,
+                "construct_id": dataset.construct_id,
+                "y_fitted": self.y_fitted,
+                "residuals": self.residuals,
+            },
+            setup=_start_replicates,
+            setup_args=(
+                dataset.melts,
+                dataset.constructs,
+                self.objective.settings,
+                self.seed,
+                self.start_params,
+                self.iter_tot,
+            ),
+            start_method=start_method,
+        )
+
+
+# The replicates of a bootstrap worker process.
+_worker_replicates = None
+
+
+# Runs in each bootstrap worker as it starts.  The arrays are read-only
+# views of the main process's shared memory, and the signal is the worker's
+# own scratch array.
+def _start_replicates(
+    arrays, melts, constructs, settings, seed, start_params, iter_tot
+):
+    global _worker_replicates
+    dataset = MeltDataset(
+        melts,
+        constructs,
+        arrays["denat"],
+        np.zeros(len(arrays["denat"])),
+        arrays["melt_id"],
+        arrays["construct_id"],
+    )
+    _worker_replicates = BootstrapReplicates(
+        MeltObjective(dataset, **settings),
+        arrays["y_fitted"],
+        arrays["residuals"],
+        seed,
+        start_params,
+        iter_tot,
+    )
+
+
+def _run_replicate(i):
+    return _worker_replicates(i)
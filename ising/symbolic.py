@@ -0,0 +1,265 @@
+"""
+Helpers shared by the sympy equation generator scripts.
+"""
+
+import multiprocessing as mp
+import time
+
+import numpy as np
+import sympy as sp
+
+
+def simplify_one(item):
+    """
+    Simplifies one (key, expression) pair and converts it to a string.
+    Returns (key, string, seconds).  This is a module-level function so that
+    it can be sent to pool workers.
+    """
+    key, expression = item
+    start = time.time()
+    simplified = str(sp.simplify(expression))
+    return key, simplified, time.time() - start
+
+
+def simplify_expressions(expression_dict, numCores=1, report=True):
+    """
+    Runs sp.simplify on every expression in expression_dict, spread over
+    numCores worker processes.  Returns a dict of strings in the same key
+    order as expression_dict (so the JSON written from it does not depend on
+    which worker finishes first), and a dict of seconds spent on each key.
+    """
+    items = list(expression_dict.items())
+    simplified_dict = {}
+    times_dict = {}
+
+    if numCores > 1 and len(items) > 1:
+        # Hand out the biggest expressions first so that one slow construct
+        # does not start last and hold up the whole pool.
+        items.sort(key=lambda item: sp.count_ops(item[1]), reverse=True)
+        with mp.Pool(processes=min(numCores, len(items))) as pool:
+            for key, simplified, seconds in pool.imap_unordered(
+                simplify_one, items
+            ):
+                simplified_dict[key] = simplified
+                times_dict[key] = seconds
+                if report:
+                    print(
+                        "  {0} simplified in {1:.2f} sec".format(key, seconds)
+                    )
+    else:
+        for item in items:
+            key, simplified, seconds = simplify_one(item)
+            simplified_dict[key] = simplified
+            times_dict[key] = seconds
+            if report:
+                print("  {0} simplified in {1:.2f} sec".format(key, seconds))
+
+    simplified_dict = {key: simplified_dict[key] for key in expression_dict}
+    times_dict = {key: times_dict[key] for key in expression_dict}
+    return simplified_dict, times_dict
+
+
+def print_timings(times_dict, num_shown=10):
+    """Prints the slowest simplifications, slowest first."""
+    if not times_dict:
+        return
+    slowest = sorted(
+        times_dict.items(), key=lambda item: item[1], reverse=True
+    )
+    print("\nSlowest constructs to simplify:")
+    for key, seconds in slowest[:num_shown]:
+        print("  {0:<30s} {1:8.2f} sec".format(key, seconds))
+    total = sum(times_dict.values())
+    print("  Total (summed over workers): {0:.2f} sec".format(total))
+
+
+# numpy versions of exp, sqrt, arcsinh and power as sympy functions, so that
+# str() of an expression can be eval'd with numpy (like np.exp in the
+# generator scripts).
+NP_EXP = sp.Function("np.exp")
+NP_SQRT = sp.Function("np.sqrt")
+NP_ARCSINH = sp.Function("np.arcsinh")
+NP_POWER = sp.Function("np.power")
+
+
+def closed_form_log_q(left, M, right, n):
+    """
+    log(q) for q = left * M**n * right, with left a 1x2 and right a 2x1
+    sympy matrix, M a 2x2 matrix with positive entries and n symbolic, so
+    that the size of the expression does not depend on n.
+
+    With eigenvalues l1 > l2 of M and P1 the projection onto the l1
+    eigenvector, M**n = l1**n * P1 + l2**n * (I - P1), so
+
+        log(q) = n*log(l1) + log(g*(1 - r**n)/root + r**n*q0)
+
+    where r = l2/l1, root = l1 - l2, g = left * (M - l2*I) * right and
+    q0 = left * right.  Nothing here grows like l1**n, so derivatives of it
+    stay finite for long arrays.
+
+    Near the middle of a transition a and d are nearly equal and root is
+    small, and a - l2 = (a - d + root)/2 or d - l2 = (d - a + root)/2 (which
+    one depends on the sign of a - d) subtracts nearly equal numbers.  Both
+    are positive, differ by a - d and multiply to b*c, so they are written
+    as sqrt(b*c)*exp(+-asinh((a - d)/(2*sqrt(b*c)))) instead, which numpy
+    evaluates accurately for either sign.  With them g is a sum of positive
+    terms, root is their sum, and l2 is det/l1.
+    """
+    a, b, c, d = M
+    s = sp.sqrt(b * c)
+    phi = sp.asinh((a - d) / (2 * s))
+    a_minus_l2 = s * sp.exp(phi)
+    d_minus_l2 = s * sp.exp(-phi)
+    root = a_minus_l2 + d_minus_l2  # l1 - l2
+    l1 = a + d_minus_l2
+    l2 = M.det() / l1
+    g = (left * sp.Matrix([[a_minus_l2, b], [c, d_minus_l2]]) * right)[0]
+    q0 = (left * right)[0]
+    r_n = (l2 / l1) ** n
+    return n * sp.log(l1) + sp.log(g * (1 - r_n) / root + r_n * q0)
+
+
+def _cancels_base(factors, base):
+    """
+    True if the product factors divides by every factor of base, so that
+    factors * base leaves no denominator from base.
+    """
+    powers = factors.as_powers_dict()
+    for factor, exp in base.as_powers_dict().items():
+        other = powers.get(factor, sp.S.Zero)
+        if not (exp.is_number and other.is_number):
+            return False
+        if exp * other >= 0 or abs(other) < abs(exp):
+            return False
+    return True
+
+
+def _absorb_power_derivatives(expression, n):
+    """
+    Rewrites n * x**n / x, the derivative of x**n, as n * x**(n - 1).  sympy
+    keeps x**n and 1/x apart when x is a product, and at x = 0 (l2 = 0 in
+    closed_form_log_q, which happens at dGinter = 0) the quotient is 0/0.
+    """
+
+    def rewrite(e):
+        for factor in e.args:
+            if factor.is_Pow and factor.exp.has(n):
+                others = e / factor
+                if _cancels_base(others, factor.base):
+                    # others * base has no denominator from base left.
+                    return (
+                        others * factor.base * factor.base ** (factor.exp - 1)
+                    )
+        return e
+
+    return expression.replace(lambda e: e.is_Mul, rewrite)
+
+
+def to_numpy_functions(expression, n):
+    """
+    Rewrites exp and asinh as np.exp and np.arcsinh, square roots as
+    np.sqrt, and powers with n in the exponent as np.power, so sympy does
+    not multiply them out over products once a number is substituted for n.
+    Derivatives of powers are written as n * x**(n - 1) rather than
+    n * x**n / x, which is NaN at x = 0.
+    """
+    expression = _absorb_power_derivatives(expression, n)
+    expression = expression.replace(sp.exp, NP_EXP)
+    expression = expression.replace(sp.asinh, NP_ARCSINH)
+    expression = expression.replace(
+        lambda e: e.is_Pow and e.exp.is_Rational and e.exp.q == 2,
+        lambda e: NP_SQRT(e.base) ** e.exp.p,
+    )
+    return expression.replace(
+        lambda e: e.is_Pow and e.exp.has(n),
+        lambda e: NP_POWER(e.base, e.exp),
+    )
+
+
+def check_expressions(expression_dict, model, thetas, denat, tol=1e-8):
+    """
+    Checks fraction folded expression strings ({construct + "_frac_folded":
+    string}) against model, a TransferMatrixModel (see
+    ising/transfer_matrix.py), at each parameter vector in thetas and at the
+    denaturant values denat.  Raises ValueError for an expression that is
+    not finite or is more than tol from the transfer matrix.
+    """
+    denat = np.asarray(denat, dtype=float)
+    for key, expression in expression_dict.items():
+        construct = key[: -len("_frac_folded")]
+        for theta in thetas:
+            params = dict(zip(model.param_names, theta))
+            with np.errstate(all="ignore"):
+                frac_folded = eval(
+                    expression,
+                    dict(params, np=np, denat=denat, RT=model.RT),
+                ) + np.zeros_like(denat)
+            if not np.all(np.isfinite(frac_folded)):
+                raise ValueError(
+                    "Expression for {} is not finite at {}".format(
+                        construct, params
+                    )
+                )
+            expected = model.frac_folded(theta, denat, construct)
+            error = np.max(np.abs(frac_folded - expected))
+            if error > tol:
+                raise ValueError(
+                    "Expression for {} is {:.3g} from the transfer matrix "
+                    "at {}".format(construct, error, params)
+                )
+
+
+def check_kernels(module, model, thetas, denat, tol=1e-6, step=1e-6):
+    """
+    Checks a module written by write_kernel_module (see ising/codegen.py)
+    against model, a TransferMatrixModel, at each parameter vector in
+    thetas (in model.param_names order) and at the denaturant values denat:
+    the ff_ functions against fraction folded, and the jac_ functions
+    against central differences of it with the given step.  Raises
+    ValueError for a function that is not finite or is more than tol off.
+    """
+    denat = np.asarray(denat, dtype=float)
+    index = [model.param_names.index(name) for name in module.PARAM_NAMES]
+    for construct, kernel in module.FRAC_FOLDED.items():
+        for theta in thetas:
+            params = dict(zip(model.param_names, theta))
+            theta = np.asarray(theta, dtype=float)
+            args = list(theta[index]) + [model.RT]
+            with np.errstate(all="ignore"):
+                frac_folded = kernel(denat, *args)
+                derivatives = module.JACOBIAN[construct](denat, *args)
+            checks = [
+                (
+                    "Fraction folded",
+                    frac_folded,
+                    model.frac_folded(theta, denat, construct),
+                )
+            ]
+            for name, i, derivative in zip(
+                module.PARAM_NAMES, index, derivatives
+            ):
+                shift = np.zeros_like(theta)
+                shift[i] = step
+                upper = model.frac_folded(theta + shift, denat, construct)
+                lower = model.frac_folded(theta - shift, denat, construct)
+                checks.append(
+                    (
+                        "d/d({})".format(name),
+                        derivative,
+                        (upper - lower) / (2 * step),
+                    )
+                )
+            for name, value, expected in checks:
+                value = value + np.zeros_like(denat)
+                if not np.all(np.isfinite(value)):
+                    raise ValueError(
+                        "{} kernel for {} is not finite at {}".format(
+                            name, construct, params
+                        )
+                    )
+                error = np.max(np.abs(value - expected))
+                if error > tol:
+                    raise ValueError(
+                        "{} kernel for {} is {:.3g} from the transfer "
+                        "matrix at {}".format(name, construct, error, params)
+                    )
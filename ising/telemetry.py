@@ -0,0 +1,97 @@
+"""
+Counts and timings for each fit, written to a JSON file next to the fitted
+parameters.
+"""
+
+import json
+import time
+from collections import defaultdict
+
+
+class _Timer:
+    """Adds the time spent in a with block to times[key]."""
+
+    __slots__ = ("times", "key", "start")
+
+    def __init__(self, times, key):
+        self.times = times
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.times[self.key] += time.perf_counter() - self.start
+
+
+class FitTelemetry:
+    """
+    Collects a record for each fit in fits.  Call start(label) before a fit
+    and finish(fit_result) after it; in between, count and the timers add
+    up what the objective and Jacobian do.
+    """
+
+    def __init__(self):
+        self.fits = []
+        self.label = None
+        self._reset()
+
+    def _reset(self):
+        self.calls = defaultdict(int)
+        self.times = defaultdict(float)
+        self.frac_folded_times = defaultdict(float)
+        self._start = time.perf_counter()
+
+    def count(self, key):
+        self.calls[key] += 1
+
+    def timer(self, key):
+        """Times a with block under key (objective, jacobian, ...)."""
+        return _Timer(self.times, key)
+
+    def frac_folded_timer(self, construct):
+        """
+        Times a with block as fraction folded for construct, in the
+        objective and the Jacobian alike.  Engines that evaluate every
+        construct at once record a total under their own key instead.
+        """
+        return _Timer(self.frac_folded_times, construct)
+
+    def start(self, label):
+        self.label = label
+        self._reset()
+
+    def finish(self, fit_result, keep=True):
+        """
+        Records the fit since start, with nfev and the convergence status
+        from fit_result (an lmfit MinimizerResult or a LeastSquaresResult),
+        and returns the record.  With keep=False the record is only
+        returned, for callers that collect records themselves (from worker
+        processes, say).
+        """
+        wall_time = time.perf_counter() - self._start
+        objective_time = self.times["objective"]
+        jacobian_time = self.times["jacobian"]
+        record = {
+            "label": self.label,
+            "objective_calls": self.calls["objective"],
+            "jacobian_calls": self.calls["jacobian"],
+            "nfev": int(fit_result.nfev),
+            "success": bool(fit_result.success),
+            "message": str(getattr(fit_result, "message", "")),
+            "chisqr": float(fit_result.chisqr),
+            "wall_time": wall_time,
+            "objective_time": objective_time,
+            "jacobian_time": jacobian_time,
+            "frac_folded_time": dict(self.frac_folded_times),
+            "baseline_mixing_time": self.times["baseline_mixing"],
+            "fused_residuals_time": self.times["fused_residuals"],
+            "optimizer_overhead": wall_time - objective_time - jacobian_time,
+        }
+        if keep:
+            self.fits.append(record)
+        return record
+
+    def write(self, path):
+        with open(path, "w") as f:
+            json.dump({"fits": self.fits}, f, indent=2)
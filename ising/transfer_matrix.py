@@ -0,0 +1,393 @@
+"""
+Numeric transfer-matrix evaluation of partition functions and fraction folded.
+
+Instead of building a closed-form sympy expression for each construct, the
+partition function q = begin * W_1 * W_2 * ... * W_n * end is multiplied out
+numerically, one 2x2 weight matrix per repeat, batched over all constructs
+and all denaturant points at once.  K*dq/dK (summed over every repeat) is
+carried along in the same pass, since
+
+    d(v * W_i)/dK_i * K_i = v * D_i,  with D_i = [[K_i * T_i, 0], [K_i, 0]]
+
+where v is the product of the weight matrices to the left of repeat i.
+Fraction folded is then K*dq/dK / (q * number of repeats), exactly as in the
+equation generator scripts.
+
+With strong coupling (dGinter around -12 kcal/mol, so T is about e^20) q
+grows so fast with the number of repeats that it overflows float64 for long
+constructs or extreme parameter values, and fraction folded comes out NaN.
+log_partition_function avoids this by carrying the logs of the row vector
+through the product with log-sum-exp, and the derivative as its ratio to
+the row vector.
+"""
+
+import numpy as np
+
+RT_DEFAULT = 0.001987 * 298.15  #  R in kcal/mol/K, T in Kelvin.
+
+# Homopolymer (NRC) model.  Every repeat has its own intrinsic dG, all share
+# one m-value, and every interface has the same coupling free energy.
+# K = exp(-(dG - mi * denat)/RT), W = exp(-dGinter/RT).
+HOMOPOLYMER_PARAMS = ("dGN", "dGR", "dGC", "dGinter", "mi")
+HOMOPOLYMER_REPEATS = {
+    "N": ("dGN", "mi"),
+    "R": ("dGR", "mi"),
+    "C": ("dGC", "mi"),
+}
+
+
+def _log_sum(log_a, log_b, x, y):
+    """
+    log(a + b), and the average of x and y weighted by a and b (zero where
+    a and b are both zero), from log(a) and log(b).
+    """
+    log_sum = np.logaddexp(log_a, log_b)
+    empty = np.isneginf(log_sum)
+    log_sum_safe = np.where(empty, 0.0, log_sum)
+    average = (
+        np.exp(log_a - log_sum_safe) * x + np.exp(log_b - log_sum_safe) * y
+    )
+    return log_sum, np.where(empty, 0.0, average)
+
+
+class TransferMatrixModel:
+    """
+    Numeric partition functions for a list of constructs.
+
+    constructs are underscore-separated repeat strings (e.g. "N_R_R_C").
+    repeats maps each repeat letter to the names of its (dG, m) parameters,
+    couplings maps (previous, current) repeat letters to the name of the
+    interface free energy, and param_names fixes the order of the parameter
+    vector theta passed to the evaluation methods.  K for a repeat is
+    exp(-(dG + m_sign * m * denat)/RT).
+    """
+
+    def __init__(
+        self,
+        constructs,
+        repeats,
+        couplings,
+        param_names,
+        m_sign=1.0,
+        RT=RT_DEFAULT,
+    ):
+        self.constructs = list(constructs)
+        self.param_names = tuple(param_names)
+        self.m_sign = m_sign
+        self.RT = RT
+
+        param_index = {name: i for i, name in enumerate(self.param_names)}
+        self.repeat_types = list(repeats)
+        self.coupling_index = {
+            pair: param_index[name] for pair, name in couplings.items()
+        }
+        type_index = {rpt: i for i, rpt in enumerate(self.repeat_types)}
+        self._dG_index = np.array(
+            [param_index[repeats[rpt][0]] for rpt in self.repeat_types]
+        )
+        self._m_index = np.array(
+            [param_index[repeats[rpt][1]] for rpt in self.repeat_types]
+        )
+
+        # Per-construct repeat types and coupling parameters, left-padded to
+        # a common length.  Padding has K = 0, which leaves the begin vector
+        # [0, 1] unchanged, so short and long constructs can share one loop.
+        # The first repeat has no coupling (index -1); its value never
+        # matters because begin picks out the bottom row of the matrix.
+        self.num_repeats = np.array(
+            [len(construct.split("_")) for construct in self.constructs]
+        )
+        self.length = int(self.num_repeats.max()) if self.constructs else 0
+        self._types = np.full((len(self.constructs), self.length), -1)
+        self._couplings = np.full((len(self.constructs), self.length), -1)
+        for row, construct in enumerate(self.constructs):
+            repeat_list = construct.split("_")
+            offset = self.length - len(repeat_list)
+            for i, rpt in enumerate(repeat_list):
+                if rpt not in type_index:
+                    raise ValueError(
+                        f"Unknown repeat type '{rpt}' in construct {construct}"
+                    )
+                self._types[row, offset + i] = type_index[rpt]
+                if i > 0:
+                    pair = (repeat_list[i - 1], rpt)
+                    if pair not in couplings:
+                        raise ValueError(
+                            f"No coupling defined for {pair[0]}{pair[1]} "
+                            f"interface in construct {construct}"
+                        )
+                    self._couplings[row, offset + i] = param_index[
+                        couplings[pair]
+                    ]
+        self._row = {
+            construct: row for row, construct in enumerate(self.constructs)
+        }
+
+    def _rows(self, constructs):
+        if constructs is None:
+            return np.arange(len(self.constructs))
+        if isinstance(constructs, str):
+            return np.array([self._row[constructs]])
+        return np.array([self._row[construct] for construct in constructs])
+
+    def _log_weights(self, theta, denat, rows):
+        """
+        log K and log T for every position, trimmed to the longest of the
+        selected constructs.  Returns arrays of shape (constructs, length,
+        denat points) and (constructs, length, 1); padding has log K = -inf.
+        """
+        theta = np.asarray(theta, dtype=float)
+        denat = np.asarray(denat, dtype=float)
+        if denat.ndim == 1:
+            denat = denat[np.newaxis, :]  # Same denaturant axis for all
+        length = int(self.num_repeats[rows].max())
+        types = self._types[rows, -length:]
+        couplings = self._couplings[rows, -length:]
+
+        dG = theta[self._dG_index][types]
+        m = theta[self._m_index][types]
+        log_K = (
+            -(
+                dG[:, :, np.newaxis]
+                + self.m_sign * m[:, :, np.newaxis] * denat[:, np.newaxis, :]
+            )
+            / self.RT
+        )
+        log_K[types < 0] = -np.inf
+        log_T = np.where(couplings < 0, 0.0, -theta[couplings] / self.RT)
+        return log_K, log_T[:, :, np.newaxis]
+
+    def partition_function(self, theta, denat, constructs=None):
+        """
+        Returns q and K*dq/dK for the selected constructs (all by default).
+
+        denat is either one denaturant axis shared by every construct, or a
+        2D array with one row per selected construct.  Results have shape
+        (constructs, denat points), or (denat points,) when a single
+        construct name is given.
+        """
+        rows = self._rows(constructs)
+        log_K, log_T = self._log_weights(theta, denat, rows)
+        K = np.exp(log_K)
+        KT = K * np.exp(log_T)
+
+        # Row vectors, batched over constructs and denaturant points.
+        shape = (len(rows), K.shape[2])
+        v = np.zeros(shape + (1, 2))
+        v[..., 0, 1] = 1.0  # begin = [0, 1]
+        dv = np.zeros(shape + (1, 2))
+        W = np.ones(shape + (2, 2))
+        D = np.zeros(shape + (2, 2))
+        for i in range(K.shape[1]):
+            W[..., 0, 0] = KT[:, i]
+            W[..., 1, 0] = K[:, i]
+            D[..., 0, 0] = KT[:, i]
+            D[..., 1, 0] = K[:, i]
+            dv = np.matmul(dv, W) + np.matmul(v, D)
+            v = np.matmul(v, W)
+
+        q = v.sum(axis=(-2, -1))  # end = [1, 1]
+        K_dqdK = dv.sum(axis=(-2, -1))
+        if isinstance(constructs, str):
+            return q[0], K_dqdK[0]
+        return q, K_dqdK
+
+    def log_partition_function(self, theta, denat, constructs=None):
+        """
+        Returns log(q) and K*dq/dK / q, with the same arguments and shapes
+        as partition_function, computed entirely in log space so that
+        neither overflows or underflows.
+        """
+        rows = self._rows(constructs)
+        log_K, log_T = self._log_weights(theta, denat, rows)
+        log_KT = log_K + log_T
+
+        # The row vector v = [v0, v1] is kept as logs, and its derivative
+        # dv as the ratios u = dv/v, which stay of order one.
+        shape = (len(rows), log_K.shape[2])
+        log_v0 = np.full(shape, -np.inf)  # begin = [0, 1]
+        log_v1 = np.zeros(shape)
+        u0 = np.zeros(shape)
+        u1 = np.zeros(shape)
+        for i in range(log_K.shape[1]):
+            # v0' = v0*KT + v1*K and dv0' = (dv0 + v0)*KT + (dv1 + v1)*K,
+            # v1' = v0 + v1 and dv1' = dv0 + dv1.
+            new_log_v0, new_u0 = _log_sum(
+                log_v0 + log_KT[:, i], log_v1 + log_K[:, i], u0 + 1, u1 + 1
+            )
+            log_v1, u1 = _log_sum(log_v0, log_v1, u0, u1)
+            log_v0, u0 = new_log_v0, new_u0
+
+        log_q, K_dqdK_over_q = _log_sum(log_v0, log_v1, u0, u1)  # end
+        if isinstance(constructs, str):
+            return log_q[0], K_dqdK_over_q[0]
+        return log_q, K_dqdK_over_q
+
+    def frac_folded(self, theta, denat, constructs=None, log_space=False):
+        """
+        Fraction folded, with the same arguments and shapes as above.  Set
+        log_space to use log_partition_function, which does not overflow.
+        """
+        num_repeats = self.num_repeats[self._rows(constructs)]
+        if isinstance(constructs, str):
+            num_repeats = num_repeats[0]
+        else:
+            num_repeats = num_repeats[:, np.newaxis]
+        if log_space:
+            log_q, K_dqdK_over_q = self.log_partition_function(
+                theta, denat, constructs
+            )
+            return K_dqdK_over_q / num_repeats
+        q, K_dqdK = self.partition_function(theta, denat, constructs)
+        return K_dqdK / (q * num_repeats)
+
+
+class PrefixTrie:
+    """
+    Fraction folded for many (construct, denaturant points) targets at once,
+    sharing the work on common prefixes.
+
+    Constructs in a series share long prefixes (N_R_C, N_R_R_C and N_R_R_R_C
+    all start with N_R), and melts share denaturant points.  The prefixes
+    are arranged in a trie, and each node carries the row vector v and its
+    derivative dv (see the module docstring) at the union of the denaturant
+    points of all targets below it.  Each partial product is then computed
+    once per parameter vector and denaturant point, and reused by every
+    construct that starts with it.
+
+    model is a TransferMatrixModel that supplies the repeat types, couplings
+    and parameter order, and targets is a list of (construct, denat) pairs.
+    The layout is fixed here, so only theta changes between calls to
+    frac_folded.  Set log_space to carry the products in log space, as in
+    TransferMatrixModel.log_partition_function.
+    """
+
+    def __init__(self, model, targets, log_space=False):
+        self.model = model
+        self.log_space = log_space
+
+        # Denaturant points needed at each prefix, parents before children.
+        points_dict = {(): []}
+        for construct, denat in targets:
+            repeat_list = tuple(construct.split("_"))
+            for i in range(len(repeat_list) + 1):
+                points_dict.setdefault(repeat_list[:i], []).append(
+                    np.asarray(denat, dtype=float)
+                )
+        prefixes = sorted(points_dict, key=len)
+        node_index = {prefix: i for i, prefix in enumerate(prefixes)}
+        self.points = [
+            np.unique(np.concatenate(points_dict[prefix]))
+            for prefix in prefixes
+        ]
+
+        # For each node below the root: its parent, where its points sit
+        # among the parent's points, and the parameters of its last repeat.
+        type_index = {rpt: i for i, rpt in enumerate(model.repeat_types)}
+        self.nodes = []
+        for prefix in prefixes[1:]:
+            parent = node_index[prefix[:-1]]
+            rpt = prefix[-1]
+            if rpt not in type_index:
+                raise ValueError(
+                    f"Unknown repeat type '{rpt}' in construct "
+                    + "_".join(prefix)
+                )
+            if len(prefix) == 1:
+                coupling = -1
+            elif (prefix[-2], rpt) in model.coupling_index:
+                coupling = model.coupling_index[(prefix[-2], rpt)]
+            else:
+                raise ValueError(
+                    f"No coupling defined for {prefix[-2]}{rpt} interface "
+                    "in construct " + "_".join(prefix)
+                )
+            take = np.searchsorted(
+                self.points[parent], self.points[node_index[prefix]]
+            )
+            self.nodes.append(
+                (node_index[prefix], parent, take, type_index[rpt], coupling)
+            )
+
+        # For each target: its node, where its points sit among the node's
+        # points, and its number of repeats.
+        self.targets = []
+        for construct, denat in targets:
+            prefix = tuple(construct.split("_"))
+            node = node_index[prefix]
+            take = np.searchsorted(self.points[node], denat)
+            self.targets.append((node, take, len(prefix)))
+
+    def frac_folded(self, theta):
+        """Returns a list with fraction folded for each target, in order."""
+        theta = np.asarray(theta, dtype=float)
+        model = self.model
+        dG = theta[model._dG_index]
+        m = theta[model._m_index]
+
+        # Row vector v = [v0, v1] and its derivative dv at every node, or
+        # log(v) and dv/v in log space.  begin = [0, 1] at the root.
+        num_points = len(self.points[0])
+        if self.log_space:
+            v0 = [np.full(num_points, -np.inf)]
+            v1 = [np.zeros(num_points)]
+        else:
+            v0 = [np.zeros(num_points)]
+            v1 = [np.ones(num_points)]
+        dv0 = [np.zeros(num_points)]
+        dv1 = [np.zeros(num_points)]
+
+        for node, parent, take, rpt, coupling in self.nodes:
+            log_K = (
+                -(dG[rpt] + model.m_sign * m[rpt] * self.points[node])
+                / model.RT
+            )
+            log_T = 0.0 if coupling < 0 else -theta[coupling] / model.RT
+            p0 = v0[parent][take]
+            p1 = v1[parent][take]
+            dp0 = dv0[parent][take]
+            dp1 = dv1[parent][take]
+            if self.log_space:
+                new0, new_d0 = _log_sum(
+                    p0 + log_K + log_T, p1 + log_K, dp0 + 1, dp1 + 1
+                )
+                new1, new_d1 = _log_sum(p0, p1, dp0, dp1)
+            else:
+                K = np.exp(log_K)
+                KT = K * np.exp(log_T)
+                new0 = p0 * KT + p1 * K
+                new_d0 = (dp0 + p0) * KT + (dp1 + p1) * K
+                new1 = p0 + p1
+                new_d1 = dp0 + dp1
+            v0.append(new0)
+            v1.append(new1)
+            dv0.append(new_d0)
+            dv1.append(new_d1)
+
+        frac_folded_list = []
+        for node, take, num_repeats in self.targets:
+            if self.log_space:
+                log_q, K_dqdK_over_q = _log_sum(
+                    v0[node], v1[node], dv0[node], dv1[node]
+                )
+            else:
+                K_dqdK_over_q = (dv0[node] + dv1[node]) / (v0[node] + v1[node])
+            frac_folded_list.append(K_dqdK_over_q[take] / num_repeats)
+        return frac_folded_list
+
+
+def homopolymer_model(constructs, RT=RT_DEFAULT):
+    """Transfer-matrix model for NRC capped homopolymers."""
+    couplings = {
+        (prev, rpt): "dGinter"
+        for prev in HOMOPOLYMER_REPEATS
+        for rpt in HOMOPOLYMER_REPEATS
+    }
+    return TransferMatrixModel(
+        constructs,
+        HOMOPOLYMER_REPEATS,
+        couplings,
+        HOMOPOLYMER_PARAMS,
+        m_sign=-1.0,
+        RT=RT,
+    )
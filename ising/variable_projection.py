@@ -0,0 +1,52 @@
+"""
+Variable projection for the baseline parameters: for fixed fraction folded,
+the af, bf, au and bu of every melt are solved for by linear least squares,
+so the optimizer only varies the thermodynamic parameters.
+"""
+
+import numpy as np
+
+
+def _design(dataset, frac_folded):
+    """Columns multiplying af, bf, au and bu at every data point."""
+    denat = dataset.denat
+    return np.stack(
+        (
+            denat * frac_folded,
+            frac_folded,
+            denat * (1 - frac_folded),
+            1 - frac_folded,
+        ),
+        axis=1,
+    )
+
+
+def solve_baselines(dataset, frac_folded):
+    """
+    Least-squares af, bf, au and bu for every melt of dataset (a
+    MeltDataset), given fraction folded at every data point.  Returns an
+    array of shape (4, number of melts), in the dataset's melt order.  The
+    normal equations are solved with a pseudo-inverse, so a melt whose
+    baselines are not all determined (one that never unfolds) still gets an
+    answer.
+    """
+    design = _design(dataset, frac_folded)
+    starts = [dataset.slices[melt].start for melt in dataset.melts]
+    normal = np.add.reduceat(
+        design[:, :, np.newaxis] * design[:, np.newaxis, :], starts, axis=0
+    )
+    rhs = np.add.reduceat(
+        design * dataset.signal[:, np.newaxis], starts, axis=0
+    )
+    return np.einsum("mij,mj->im", np.linalg.pinv(normal), rhs)
+
+
+def projected_residuals(dataset, frac_folded):
+    """
+    Residuals at every data point with each melt's baselines at their
+    least-squares values for this fraction folded.
+    """
+    baselines = solve_baselines(dataset, frac_folded)
+    design = _design(dataset, frac_folded)
+    fitted = np.einsum("ni,in->n", design, baselines[:, dataset.melt_id])
+    return dataset.signal - fitted
@@ -0,0 +1,212 @@
+"""
+Checks the bootstrap helpers: the random stream of each replicate, the
+resampled signal, the pool of worker processes, the bootstrap parameter
+file that a stopped run resumes from, and the Monte Carlo error that stops a
+bootstrap early.
+"""
+
+import csv
+import multiprocessing
+import os
+
+import numpy as np
+import pytest
+
+from ising.bootstrap import ReplicateLog, ReplicatePool, attach_shared
+from ising.bootstrap import _statistics, monte_carlo_errors
+from ising.bootstrap import read_replicate_rows, replicate_rng
+from ising.bootstrap import resample_signal, write_rows
+from ising.melt_data import MeltDataset
+
+SEED = 12345
+
+
+def draw(replicate):
+    """The first draws of a replicate's stream, for worker processes."""
+    return replicate_rng(SEED, replicate).integers(1000, size=5).tolist()
+
+
+# What setup_worker was given, in each worker process.
+_worker = {}
+
+
+def setup_worker(arrays, scale):
+    _worker.update(arrays, scale=scale)
+
+
+def weighted_sum(i):
+    """A replicate that reads the shared arrays."""
+    return (
+        i,
+        float(_worker["values"].sum() * _worker["scale"] * i),
+        os.getpid(),
+    )
+
+
+def make_dataset():
+    denat = np.linspace(0, 8, 9)
+    arrays = {
+        melt: np.column_stack([denat, np.linspace(1, 0, 9) ** (i + 1)])
+        for i, melt in enumerate(["N_R_C_1", "N_R_C_2", "N_R_R_C_1"])
+    }
+    return MeltDataset.from_melt_arrays(
+        list(arrays), ["N_R_C", "N_R_R_C"], arrays
+    )
+
+
+def test_replicate_rng_is_spawned_child():
+    for num_replicates in [3, 10]:
+        children = np.random.SeedSequence(SEED).spawn(num_replicates)
+        for i in [0, 2]:
+            expected = np.random.default_rng(children[i]).random(5)
+            np.testing.assert_array_equal(
+                replicate_rng(SEED, i).random(5), expected
+            )
+    assert draw(1) != draw(2)
+
+
+@pytest.mark.parametrize(
+    "start_method", multiprocessing.get_all_start_methods()
+)
+def test_replicate_rng_in_workers(start_method):
+    context = multiprocessing.get_context(start_method)
+    replicates = list(range(1, 9))
+    with context.Pool(2) as pool:
+        assert pool.map(draw, replicates, chunksize=3) == [
+            draw(i) for i in replicates
+        ]
+
+
+def test_resample_signal():
+    dataset = make_dataset()
+    y_fitted = dataset.signal.copy()
+    residuals = np.linspace(-0.05, 0.05, len(dataset))
+    signal = resample_signal(dataset, y_fitted, residuals, replicate_rng(0, 1))
+    np.testing.assert_array_equal(
+        signal,
+        resample_signal(dataset, y_fitted, residuals, replicate_rng(0, 1)),
+    )
+    assert not np.array_equal(
+        signal,
+        resample_signal(dataset, y_fitted, residuals, replicate_rng(0, 2)),
+    )
+
+    # Each melt is normalized to run from 0 to 1 again.
+    for melt in dataset.melts:
+        rows = dataset.slices[melt]
+        assert signal[rows].min() == 0
+        assert signal[rows].max() == 1
+
+
+@pytest.mark.parametrize("start_method", ["fork", "spawn"])
+def test_replicate_pool(start_method):
+    if start_method not in multiprocessing.get_all_start_methods():
+        pytest.skip("{} is not available".format(start_method))
+    values = np.arange(10.0)
+    pool = ReplicatePool(
+        weighted_sum,
+        2,
+        shared={"values": values},
+        setup=setup_worker,
+        setup_args=(0.5,),
+        start_method=start_method,
+    )
+    with pool:
+        pids = set()
+        # The workers are set up once and kept for every batch.
+        for batch in [range(1, 6), range(6, 9)]:
+            results = sorted(pool.imap(batch))
+            assert [i for i, _, _ in results] == list(batch)
+            for i, total, pid in results:
+                assert total == 22.5 * i
+                pids.add(pid)
+        assert os.getpid() not in pids
+        assert len(pids) <= 2
+        spec = pool._shared.spec
+
+    # Closing frees the shared memory.
+    with pytest.raises(FileNotFoundError):
+        attach_shared(spec)
+
+
+def test_replicate_pool_one_core():
+    pool = ReplicatePool(draw, 1, setup=setup_worker, setup_args=(0.5,))
+    with pool:
+        assert list(pool.imap([3, 1])) == [draw(3), draw(1)]
+    assert _worker == {}
+
+
+HEADER = ["Bootstrap Iter", "dGN", "mi", "redchi**2", "bestchi**2"]
+
+
+def replicate_row(i):
+    return [i] + (np.random.default_rng(i).random(4) * 10).tolist()
+
+
+def test_replicate_log_round_trip(tmp_path):
+    path = str(tmp_path / "bootstrap_params.csv")
+    # Rows kept from an earlier run, including one beyond the iterations
+    # asked for this time, go first.
+    kept = [replicate_row(i) for i in [1, 2, 9]]
+    with ReplicateLog(path, HEADER, kept) as log:
+        assert read_replicate_rows(path, len(HEADER)) == {
+            i: replicate_row(i) for i in [1, 2, 9]
+        }
+        for i in [4, 3]:
+            log.write(replicate_row(i))
+            # Each row is on disk as soon as it is written.
+            assert i in read_replicate_rows(path, len(HEADER))
+    rows = read_replicate_rows(path, len(HEADER))
+    assert rows == {i: replicate_row(i) for i in [1, 2, 3, 4, 9]}
+    with open(path) as f:
+        assert f.readline() == ",".join(HEADER) + "\n"
+
+    # A new log replaces the file rather than adding to it.
+    with ReplicateLog(path, HEADER):
+        pass
+    assert read_replicate_rows(path, len(HEADER)) == {}
+
+
+def test_write_rows_keeps_old_file_on_error(tmp_path):
+    path = str(tmp_path / "bootstrap_params.csv")
+    write_rows(path, [HEADER, replicate_row(1)])
+    assert os.listdir(str(tmp_path)) == ["bootstrap_params.csv"]
+    with pytest.raises(csv.Error):
+        write_rows(path, [HEADER, replicate_row(2), None])
+    assert read_replicate_rows(path, len(HEADER)) == {1: replicate_row(1)}
+
+
+def test_monte_carlo_errors():
+    rng = np.random.default_rng(3)
+    values = rng.normal([1.0, -5.0, 2.0], [0.1, 2.0, 0.0], size=(400, 3))
+    errors = monte_carlo_errors(values)
+    np.testing.assert_array_equal(errors, monte_carlo_errors(values))
+    # Relative to each parameter's stdev, and 0 without any spread.
+    assert errors[2] == 0
+    assert errors[0] == pytest.approx(errors[1], rel=0.5)
+    # The outer percentiles of a normal distribution have a standard error
+    # of about 2.7 stdev / sqrt(n).
+    assert 0.08 < errors[0] < 0.2
+    # Four times the replicates halve it.
+    more = rng.normal(1.0, 0.1, size=(1600, 1))
+    assert monte_carlo_errors(more)[0] == pytest.approx(
+        errors[0] / 2, rel=0.35
+    )
+
+
+def test_adaptive_stop():
+    # Batches of replicates until the statistics would hardly change, as in
+    # the fitters with bootstrap_tolerance set.
+    rng = np.random.default_rng(4)
+    values = rng.normal([1.0, -5.0], [0.1, 2.0], size=(4000, 2))
+    tolerance = 0.15
+    for end in range(100, len(values) + 1, 100):
+        if monte_carlo_errors(values[:end]).max() <= tolerance:
+            break
+    assert end < len(values)
+
+    # The statistics at the stop are within a few Monte Carlo errors of
+    # those from all the replicates.
+    stdev = values.std(axis=0)
+    difference = np.abs(_statistics(values[:end]) - _statistics(values))
+    assert np.all(difference / stdev < 3 * tolerance)
@@ -0,0 +1,105 @@
+"""
+Checks the on-disk expression cache: what its entries are keyed by, and that
+eviction drops the least recently used entries and stale temporary files.
+"""
+
+import os
+
+import sympy as sp
+
+from ising import eqn_cache
+from ising.eqn_cache import ExpressionCache, model_variant
+
+K, W = sp.symbols("K W")
+MATRICES = {"R": sp.Matrix([[K * W, 1], [K, 1]])}
+SUBSTITUTIONS = {K: sp.Symbol("KR")}
+
+
+def entry_paths(cache):
+    return sorted(
+        name for name in os.listdir(cache.cache_dir) if name.endswith(".json")
+    )
+
+
+def test_get_returns_what_put_stored(tmp_path):
+    cache = ExpressionCache(str(tmp_path))
+    variant = model_variant("homopolymer", MATRICES, SUBSTITUTIONS)
+    assert cache.get("N_R_C", variant) is None
+    cache.put("N_R_C", variant, "K/(K + 1)")
+    assert cache.get("N_R_C", variant) == "K/(K + 1)"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # Another cache on the same directory (another project, say) shares it.
+    assert ExpressionCache(str(tmp_path)).get("N_R_C", variant) == (
+        "K/(K + 1)"
+    )
+
+
+def test_key_depends_on_construct_model_and_version(tmp_path, monkeypatch):
+    cache = ExpressionCache(str(tmp_path))
+    variant = model_variant("homopolymer", MATRICES, SUBSTITUTIONS)
+    cache.put("N_R_C", variant, "K/(K + 1)")
+
+    assert cache.get("N_R_R_C", variant) is None
+    assert cache.get("N_R_C", model_variant("other", MATRICES, {})) is None
+    other_matrices = {"R": sp.Matrix([[K * W, 1], [K, 2]])}
+    assert (
+        cache.get("N_R_C", model_variant("homopolymer", other_matrices, {}))
+        is None
+    )
+    monkeypatch.setattr(
+        eqn_cache, "GENERATOR_VERSION", eqn_cache.GENERATOR_VERSION + 1
+    )
+    assert cache.get("N_R_C", variant) is None
+
+
+def test_model_variant_ignores_dict_order():
+    substitutions = {K: sp.Symbol("KR"), W: sp.Symbol("T")}
+    reordered = {W: sp.Symbol("T"), K: sp.Symbol("KR")}
+    assert model_variant("m", MATRICES, substitutions) == model_variant(
+        "m", MATRICES, reordered
+    )
+
+
+def test_entry_from_another_key_is_a_miss(tmp_path):
+    cache = ExpressionCache(str(tmp_path))
+    cache.put("N_R_C", "variant", "K/(K + 1)")
+    os.replace(
+        cache._path("N_R_C", "variant"), cache._path("N_R_R_C", "variant")
+    )
+    assert cache.get("N_R_R_C", "variant") is None
+
+
+def test_evicts_least_recently_used(tmp_path):
+    expression = "x" * 1000
+    cache = ExpressionCache(str(tmp_path), max_bytes=None)
+    for i, construct in enumerate(["A", "B", "C"]):
+        cache.put(construct, "variant", expression)
+        os.utime(cache._path(construct, "variant"), (1000 + i, 1000 + i))
+    entry_size = os.path.getsize(cache._path("A", "variant"))
+
+    # Reading A makes B the least recently used entry.
+    assert cache.get("A", "variant") == expression
+    cache.max_bytes = 3.5 * entry_size
+    cache.put("D", "variant", expression)
+    assert cache.get("B", "variant") is None
+    for construct in ["A", "C", "D"]:
+        assert cache.get(construct, "variant") == expression
+
+    # Eviction goes down to nine tenths of max_bytes.
+    cache.max_bytes = 2.5 * entry_size
+    cache.evict()
+    assert len(entry_paths(cache)) == 2
+
+
+def test_evict_removes_stale_temporary_files(tmp_path):
+    cache = ExpressionCache(str(tmp_path))
+    stale = tmp_path / "stale.tmp"
+    fresh = tmp_path / "fresh.tmp"
+    stale.write_text("{")
+    fresh.write_text("{")
+    old = os.stat(str(stale)).st_mtime - eqn_cache.STALE_TMP_SECONDS - 1
+    os.utime(str(stale), (old, old))
+    cache.evict()
+    assert not stale.exists()
+    assert fresh.exists()
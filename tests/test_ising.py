@@ -0,0 +1,384 @@
+"""
+Checks the fraction folded engines in the ising package against each other,
+the analytic Jacobian against finite differences, fits with either fit
+engine and with variable projection, the telemetry recorded for each fit,
+and bootstrap replicates in worker processes and in resumed runs.
+"""
+
+import json
+
+import numpy as np
+import pytest
+import sympy as sp
+
+from ising.bootstrap import ReplicateLog, read_replicate_rows
+from ising.codegen import load_compiled_expressions
+from ising.codegen import load_kernel_module, write_kernel_module
+from ising.fused import HAVE_NUMBA
+from ising.melt_data import MeltDataset
+from ising.objective import BootstrapReplicates, MeltObjective
+from ising.transfer_matrix import HOMOPOLYMER_PARAMS, PrefixTrie
+from ising.transfer_matrix import homopolymer_model
+
+PROJECT = "test"
+CONSTRUCTS = ["N_R_C", "N_R_R_C", "R_R_R_C", "N_R_R_R_R_C"]
+THETA = [6.0, 5.0, 6.0, -12.0, -1.0]
+DENAT = np.linspace(0, 8, 17)
+
+
+def frac_folded_dict(constructs):
+    """
+    Fraction folded expression strings, multiplied out from the homopolymer
+    matrices as in homopolymer_fit/generate_fitting_eqns.py.
+    """
+    dGN, dGR, dGC, dGinter, mi = sp.symbols(HOMOPOLYMER_PARAMS)
+    RT, denat, W = sp.symbols("RT denat W")
+    K = {rpt: sp.Symbol("K" + rpt) for rpt in "NRC"}
+    exp = sp.Function("np.exp")
+    matrices = {
+        rpt: sp.Matrix([[K[rpt] * W, 1], [K[rpt], 1]]) for rpt in "NRC"
+    }
+    subs_dict = {
+        K["N"]: exp(-(dGN - mi * denat) / RT),
+        K["R"]: exp(-(dGR - mi * denat) / RT),
+        K["C"]: exp(-(dGC - mi * denat) / RT),
+        W: exp(-dGinter / RT),
+    }
+    expressions = {}
+    for construct in constructs:
+        repeat_list = construct.split("_")
+        q_matrix = sp.Matrix([[0, 1]])
+        for rpt in repeat_list:
+            q_matrix = q_matrix * matrices[rpt]
+        q = (q_matrix * sp.Matrix([[1], [1]]))[0]
+        frac_folded = sum(K[rpt] * sp.diff(q, K[rpt]) for rpt in "NRC") / (
+            len(repeat_list) * q
+        )
+        expressions[construct + "_frac_folded"] = str(
+            frac_folded.subs(subs_dict)
+        )
+    return expressions
+
+
+@pytest.fixture
+def project(tmp_path):
+    """A project with the expressions and kernels written to tmp_path."""
+    project = str(tmp_path / PROJECT)
+    expressions = frac_folded_dict(CONSTRUCTS)
+    with open(project + "_frac_folded_dict.json", "w") as f:
+        json.dump(expressions, f)
+    write_kernel_module(
+        project + "_ff_kernels.py",
+        expressions,
+        HOMOPOLYMER_PARAMS,
+        "test_ising.py",
+    )
+    return project
+
+
+@pytest.fixture
+def dataset():
+    """Two melts of each construct, with the signal from THETA."""
+    model = homopolymer_model(CONSTRUCTS)
+    rng = np.random.default_rng(0)
+    melts = [
+        construct + "_" + str(i) for construct in CONSTRUCTS for i in (1, 2)
+    ]
+    arrays = {}
+    for melt in melts:
+        frac_folded = model.frac_folded(THETA, DENAT, melt[:-2])
+        folded = 0.01 * DENAT + 1.0
+        unfolded = 0.02 * DENAT + 0.05
+        signal = folded * frac_folded + unfolded * (1 - frac_folded)
+        signal += 0.02 * rng.standard_normal(len(DENAT))
+        arrays[melt] = np.column_stack([DENAT, signal])
+    return MeltDataset.from_melt_arrays(melts, CONSTRUCTS, arrays)
+
+
+def test_engines_agree(project):
+    model = homopolymer_model(CONSTRUCTS)
+    trie = PrefixTrie(model, [(construct, DENAT) for construct in CONSTRUCTS])
+    log_trie = PrefixTrie(
+        model, [(construct, DENAT) for construct in CONSTRUCTS], log_space=True
+    )
+    kernels = load_kernel_module(
+        project + "_ff_kernels.py", project + "_frac_folded_dict.json"
+    )
+    expressions = load_compiled_expressions(
+        project + "_frac_folded_dict.json", CONSTRUCTS
+    )
+    names = dict(zip(HOMOPOLYMER_PARAMS, THETA), np=np, RT=model.RT)
+    names["denat"] = DENAT
+
+    for i, construct in enumerate(CONSTRUCTS):
+        expected = model.frac_folded(THETA, DENAT, construct)
+        assert np.all((expected > 0) & (expected < 1))
+        for frac_folded in [
+            model.frac_folded(THETA, DENAT, construct, log_space=True),
+            trie.frac_folded(THETA)[i],
+            log_trie.frac_folded(THETA)[i],
+            kernels.FRAC_FOLDED[construct](DENAT, *THETA, model.RT),
+            eval(expressions[construct + "_comp_ff"], names),
+        ]:
+            np.testing.assert_allclose(frac_folded, expected, rtol=1e-10)
+
+
+@pytest.mark.parametrize(
+    "ff_engine",
+    [
+        "transfer_matrix",
+        "log_transfer_matrix",
+        "trie",
+        "kernels",
+        "expressions",
+        pytest.param(
+            "numba",
+            marks=pytest.mark.skipif(
+                not HAVE_NUMBA, reason="numba is not installed"
+            ),
+        ),
+    ],
+)
+def test_objective_engines_agree(project, dataset, ff_engine):
+    model = homopolymer_model(CONSTRUCTS)
+    reference = MeltObjective(dataset, model, project, ff_engine="kernels")
+    objective = MeltObjective(dataset, model, project, ff_engine=ff_engine)
+    guesses = dict(zip(HOMOPOLYMER_PARAMS, THETA))
+    baselines = {"af": 0.01, "bf": 1.0, "au": 0.02, "bu": 0.05}
+    np.testing.assert_allclose(
+        objective.residuals(objective.make_params(guesses, baselines)),
+        reference.residuals(reference.make_params(guesses, baselines)),
+        rtol=1e-10,
+        atol=1e-12,
+    )
+
+
+def test_jacobian_matches_finite_differences(project, dataset):
+    model = homopolymer_model(CONSTRUCTS)
+    objective = MeltObjective(dataset, model, project, ff_engine="kernels")
+    params = objective.make_params(
+        dict(zip(HOMOPOLYMER_PARAMS, THETA)),
+        {"af": 0.01, "bf": 1.0, "au": 0.02, "bu": 0.05},
+    )
+    objective._jacobian_columns(params)
+    jacobian = objective.calc_jacobian(params)
+    sparse_jacobian = objective.calc_jacobian(params, sparse=True)
+    np.testing.assert_allclose(sparse_jacobian.toarray(), jacobian)
+
+    step = 1e-6
+    for column, name in enumerate(objective.param_order):
+        value = params[name].value
+        params[name].value = value + step
+        upper = objective.residuals(params).copy()
+        params[name].value = value - step
+        lower = objective.residuals(params).copy()
+        params[name].value = value
+        np.testing.assert_allclose(
+            jacobian[:, column], (upper - lower) / (2 * step), atol=1e-6
+        )
+
+
+def test_kernels_refused_after_expressions_change(project):
+    with open(project + "_frac_folded_dict.json", "w") as f:
+        json.dump(frac_folded_dict(CONSTRUCTS[:2]), f)
+    with pytest.raises(ValueError):
+        load_kernel_module(
+            project + "_ff_kernels.py", project + "_frac_folded_dict.json"
+        )
+
+
+def test_read_replicate_rows_drops_partial_last_line(tmp_path):
+    path = str(tmp_path / "bootstrap_params.csv")
+    with open(path, "w", newline="") as f:
+        f.write("Bootstrap Iter,dGN,mi\n")
+        f.write("1,6.0,-1.0\n")
+        f.write("2,6.1,-1.1\n")
+        f.write("3,6.2,-1.2")
+    assert read_replicate_rows(path, 3) == {
+        1: [1, 6.0, -1.0],
+        2: [2, 6.1, -1.1],
+    }
+    assert read_replicate_rows(str(tmp_path / "missing.csv"), 3) == {}
+
+
+def start_params(objective):
+    """
+    Parameters near THETA to fit from.  The caps' dG's are held, since
+    the test constructs alone only pin down the sum of the cap and
+    interface free energies.
+    """
+    params = objective.make_params(
+        dict(zip(HOMOPOLYMER_PARAMS, [6.0, 5.2, 6.0, -12.1, -0.95])),
+        {"af": 0.01, "bf": 1.0, "au": 0.02, "bu": 0.05},
+    )
+    params["dGN"].vary = False
+    params["dGC"].vary = False
+    return params
+
+
+def test_fit_engines_agree(project, dataset):
+    model = homopolymer_model(CONSTRUCTS)
+    results = []
+    for fit_engine in ["lmfit", "least_squares"]:
+        objective = MeltObjective(
+            dataset, model, project, fit_engine=fit_engine
+        )
+        result, _ = objective.fit(start_params(objective), fit_engine)
+        assert result.success
+        assert result.nvarys == len(objective.param_order) - 2
+        assert result.nfree == len(dataset) - result.nvarys
+        assert result.params["dGN"].value == 6.0
+        np.testing.assert_allclose(
+            result.residual, objective.residuals(result.params)
+        )
+        results.append(result)
+    lmfit_result, least_squares_result = results
+    assert least_squares_result.chisqr == pytest.approx(
+        lmfit_result.chisqr, rel=1e-6
+    )
+    for name in HOMOPOLYMER_PARAMS:
+        assert least_squares_result.params[name].value == pytest.approx(
+            lmfit_result.params[name].value, abs=1e-3
+        )
+
+
+def test_sparse_least_squares_fits_agree(project, dataset):
+    # The analytic Jacobian as a sparse matrix, and finite differences
+    # told which residuals each melt's baselines affect.
+    model = homopolymer_model(CONSTRUCTS)
+    chisqr = []
+    for ff_engine in ["kernels", "trie"]:
+        objective = MeltObjective(
+            dataset,
+            model,
+            project,
+            ff_engine=ff_engine,
+            fit_engine="least_squares",
+        )
+        result, _ = objective.fit(start_params(objective), ff_engine)
+        assert result.success
+        chisqr.append(result.chisqr)
+    assert chisqr[1] == pytest.approx(chisqr[0], rel=1e-6)
+
+
+@pytest.mark.parametrize("fit_engine", ["lmfit", "least_squares"])
+def test_variable_projection_matches_full_fit(project, dataset, fit_engine):
+    model = homopolymer_model(CONSTRUCTS)
+    full = MeltObjective(dataset, model, project)
+    full_result, _ = full.fit(start_params(full), "full")
+    objective = MeltObjective(
+        dataset,
+        model,
+        project,
+        ff_engine="trie",
+        fit_engine=fit_engine,
+        variable_projection=True,
+    )
+    result, _ = objective.fit(start_params(objective), "projected")
+    assert result.success
+    assert (result.nvarys, result.nfree) == (
+        full_result.nvarys,
+        full_result.nfree,
+    )
+    assert result.chisqr == pytest.approx(full_result.chisqr, rel=1e-6)
+    assert result.redchi == pytest.approx(full_result.redchi, rel=1e-6)
+    for name in objective.param_order:
+        assert result.params[name].value == pytest.approx(
+            full_result.params[name].value, abs=1e-3
+        )
+
+
+@pytest.mark.parametrize("ff_engine", ["kernels", "trie"])
+def test_fit_telemetry(project, dataset, ff_engine):
+    model = homopolymer_model(CONSTRUCTS)
+    objective = MeltObjective(dataset, model, project, ff_engine=ff_engine)
+    calls = []
+    residuals = objective.residuals
+    objective.residuals = lambda params: calls.append(1) or residuals(params)
+    result, record = objective.fit(start_params(objective), "best fit")
+
+    assert objective.telemetry.fits == [record]
+    assert record["label"] == "best fit"
+    assert record["objective_calls"] == len(calls)
+    assert record["nfev"] == result.nfev
+    assert record["chisqr"] == result.chisqr
+    if ff_engine == "kernels":
+        # The analytic Jacobian's kernel calls count towards each construct.
+        assert record["jacobian_calls"] > 0
+        assert set(record["frac_folded_time"]) == set(CONSTRUCTS)
+    else:
+        assert record["jacobian_calls"] == 0
+        assert list(record["frac_folded_time"]) == ["total (trie)"]
+    assert sum(record["frac_folded_time"].values()) < (
+        record["objective_time"] + record["jacobian_time"]
+    )
+
+    # Bootstrap replicates hand their records back instead.
+    _, bs_record = objective.fit(result.params, "bootstrap 1", keep=False)
+    assert bs_record["label"] == "bootstrap 1"
+    assert len(objective.telemetry.fits) == 1
+
+
+@pytest.mark.parametrize("start_method", ["fork", "spawn"])
+def test_bootstrap_workers_match_serial(project, dataset, start_method):
+    model = homopolymer_model(CONSTRUCTS)
+    objective = MeltObjective(dataset, model, project)
+    result, _ = objective.fit(start_params(objective), "best fit")
+    y_fitted = dataset.signal - result.residual
+    replicates = BootstrapReplicates(
+        objective, y_fitted, result.residual, 7, result.params
+    )
+    with replicates.pool(1) as pool:
+        serial = list(pool.imap([1, 2, 3, 4]))
+    assert [record["label"] for _, record in serial] == [
+        "bootstrap {}".format(i) for i in [1, 2, 3, 4]
+    ]
+    assert len({row[2] for row, _ in serial}) == 4
+
+    # Each replicate gets the same data however they are split.
+    with replicates.pool(2, start_method) as pool:
+        parallel = sorted(
+            (row for row, _ in pool.imap([4, 2, 3, 1])),
+            key=lambda row: row[0],
+        )
+    for row, (serial_row, _) in zip(parallel, serial):
+        np.testing.assert_allclose(row, serial_row, rtol=1e-10)
+
+
+def test_resumed_bootstrap_matches_uninterrupted(project, dataset, tmp_path):
+    model = homopolymer_model(CONSTRUCTS)
+    objective = MeltObjective(dataset, model, project)
+    result, _ = objective.fit(start_params(objective), "best fit")
+    y_fitted = dataset.signal - result.residual
+    header = ["Bootstrap Iter"] + list(model.param_names) + ["r", "c"]
+
+    def run(path, iterations):
+        replicates = BootstrapReplicates(
+            MeltObjective(dataset, model, project),
+            y_fitted,
+            result.residual,
+            7,
+            result.params,
+        )
+        rows = read_replicate_rows(path, len(header))
+        with replicates.pool(1) as pool, ReplicateLog(
+            path, header, [rows[i] for i in sorted(rows)]
+        ) as log:
+            todo = [i for i in range(1, iterations + 1) if i not in rows]
+            for row, _ in pool.imap(todo):
+                log.write(row)
+        return read_replicate_rows(path, len(header))
+
+    expected = run(str(tmp_path / "uninterrupted.csv"), 4)
+
+    # A run stopped while writing its third row.
+    path = str(tmp_path / "resumed.csv")
+    with open(path, "w") as f:
+        f.write(",".join(header) + "\n")
+        for i in [1, 2]:
+            f.write(",".join(repr(value) for value in expected[i]) + "\n")
+        f.write("3,6.0")
+    resumed = run(path, 4)
+    assert sorted(resumed) == [1, 2, 3, 4]
+    for i in resumed:
+        np.testing.assert_allclose(resumed[i], expected[i], rtol=1e-10)
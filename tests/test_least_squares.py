@@ -0,0 +1,161 @@
+"""
+Checks least_squares_minimize against lmfit.minimize: the fitted values and
+result fields, parameter bounds, fixed parameters, and the Jacobian sparsity
+pattern for parameters that only affect some residuals.
+"""
+
+import lmfit
+import numpy as np
+import pytest
+
+from ising.least_squares import jacobian_sparsity, least_squares_minimize
+
+X = np.linspace(0, 4, 40)
+
+
+def make_data():
+    rng = np.random.default_rng(0)
+    return 2.0 * np.exp(-1.3 * X) + 0.5 + 0.01 * rng.standard_normal(len(X))
+
+
+def make_params():
+    params = lmfit.Parameters()
+    params.add("a", value=1.0)
+    params.add("b", value=1.0, min=0)
+    params.add("c", value=0.0)
+    return params
+
+
+class Objective:
+    """Residuals of a decaying exponential, returned in one buffer."""
+
+    def __init__(self, y):
+        self.y = y
+        self.residuals = np.zeros(len(y))
+
+    def __call__(self, params):
+        a, b, c = (params[name].value for name in "abc")
+        return np.subtract(self.y, a * np.exp(-b * X) + c, out=self.residuals)
+
+
+def test_matches_lmfit():
+    y = make_data()
+    params = make_params()
+    objective = Objective(y)
+    result = least_squares_minimize(objective, params)
+    expected = lmfit.minimize(lambda p: objective(p).copy(), params)
+
+    assert result.success
+    assert result.var_names == ["a", "b", "c"]
+    assert (result.ndata, result.nvarys, result.nfree) == (40, 3, 37)
+    assert result.nfev == result.scipy_result.nfev
+    for name in "abc":
+        assert result.params[name].value == pytest.approx(
+            expected.params[name].value, rel=1e-6
+        )
+    assert result.chisqr == pytest.approx(expected.chisqr, rel=1e-8)
+    assert result.redchi == pytest.approx(expected.redchi, rel=1e-8)
+    np.testing.assert_allclose(result.residual, objective(result.params))
+    np.testing.assert_allclose(result.residual, expected.residual, atol=1e-6)
+
+    # The starting parameters are left as they were.
+    assert [params[name].value for name in "abc"] == [1.0, 1.0, 0.0]
+
+
+def test_bounds_and_fixed_parameters():
+    y = make_data()
+    params = make_params()
+    params["b"].max = 1.0
+    params["c"].set(value=0.5, vary=False)
+    result = least_squares_minimize(Objective(y), params)
+
+    assert result.var_names == ["a", "b"]
+    assert result.nvarys == 2
+    assert result.params["b"].value == pytest.approx(1.0)
+    assert result.params["c"].value == 0.5
+
+    # An unbounded fit goes past the bound.
+    params["b"].max = np.inf
+    assert least_squares_minimize(Objective(y), params).params[
+        "b"
+    ].value == pytest.approx(1.3, rel=0.05)
+
+
+def test_analytic_jacobian():
+    y = make_data()
+
+    def jacobian(params):
+        a, b = params["a"].value, params["b"].value
+        return np.column_stack(
+            [-np.exp(-b * X), a * X * np.exp(-b * X), -np.ones(len(X))]
+        )
+
+    result = least_squares_minimize(Objective(y), make_params(), jacobian)
+    expected = least_squares_minimize(Objective(y), make_params())
+    assert result.scipy_result.njev > 0
+    for name in "abc":
+        assert result.params[name].value == pytest.approx(
+            expected.params[name].value, rel=1e-6
+        )
+
+
+def test_expressions_refused():
+    params = make_params()
+    params["c"].expr = "a / 4"
+    with pytest.raises(ValueError, match="'c'"):
+        least_squares_minimize(Objective(make_data()), params)
+
+
+def test_jacobian_sparsity():
+    param_rows = {"b": slice(2, 4), "c": np.array([0, 5])}
+    pattern = jacobian_sparsity(["a", "b", "c"], param_rows, 6)
+    assert pattern.shape == (6, 3)
+    np.testing.assert_array_equal(
+        pattern.toarray(),
+        [[1, 0, 1], [1, 0, 0], [1, 1, 0], [1, 1, 0], [1, 0, 0], [1, 0, 1]],
+    )
+
+
+def test_sparse_finite_differences():
+    # Curves with a shared decay rate and their own amplitude and offset.
+    groups = 10
+    rows = {}
+    params = lmfit.Parameters()
+    params.add("b", value=1.0)
+    for g in range(groups):
+        params.add("a{}".format(g), value=1.0)
+        params.add("c{}".format(g), value=0.0)
+        rows["a{}".format(g)] = rows["c{}".format(g)] = slice(
+            g * len(X), (g + 1) * len(X)
+        )
+    rng = np.random.default_rng(1)
+    y = np.concatenate(
+        [
+            (1 + g) * np.exp(-1.3 * X)
+            + 0.1 * g
+            + 0.01 * rng.standard_normal(len(X))
+            for g in range(groups)
+        ]
+    )
+    calls = []
+
+    def objective(params):
+        calls.append(1)
+        fitted = [
+            params["a{}".format(g)].value * np.exp(-params["b"].value * X)
+            + params["c{}".format(g)].value
+            for g in range(groups)
+        ]
+        return y - np.concatenate(fitted)
+
+    dense = least_squares_minimize(objective, params)
+    dense_calls = len(calls)
+    del calls[:]
+    sparse = least_squares_minimize(objective, params, param_rows=rows)
+    assert sparse.chisqr == pytest.approx(dense.chisqr, rel=1e-8)
+    for name in params:
+        assert sparse.params[name].value == pytest.approx(
+            dense.params[name].value, rel=1e-5, abs=1e-8
+        )
+    # Each finite difference step perturbs every curve's a (or c) at once.
+    assert len(calls) < dense_calls / 3
@@ -0,0 +1,100 @@
+"""
+Checks reading heteropolymer model specs: the parameter names and kinds, the
+errors for specs that do not describe a model, and the model built from one.
+"""
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+from ising.model_spec import load_model_spec, param_kinds, parse_model_spec
+from ising.model_spec import spec_model
+from ising.transfer_matrix import homopolymer_model
+
+SPEC_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "heteropolymer_fit",
+    "heteropolymer_model.json",
+)
+
+# The homopolymer model as a spec.  Its m-value enters with the opposite
+# sign to the homopolymer scripts' mi.
+HOMOPOLYMER_SPEC = {
+    "repeats": {
+        "N": {"dG": "dGN", "m": "m"},
+        "R": {"dG": "dGR", "m": "m"},
+        "C": {"dG": "dGC", "m": "m"},
+    },
+    "couplings": {
+        "N_R": "dGinter",
+        "R_R": "dGinter",
+        "R_C": "dGinter",
+    },
+}
+
+
+def test_load_model_spec():
+    spec = load_model_spec(SPEC_PATH)
+    assert spec["repeats"]["N"] == ("dGN", "mR")
+    assert spec["repeats"]["X"] == ("dGX", "mX")
+    assert spec["couplings"][("R", "X")] == "dGRX"
+    assert spec["couplings"][("X", "R")] == "dGXR"
+    # Intrinsic dG's, then couplings, then m-values, each listed once.
+    assert spec["param_names"] == (
+        "dGN",
+        "dGR",
+        "dGX",
+        "dGC",
+        "dGRR",
+        "dGXX",
+        "dGRX",
+        "dGXR",
+        "mR",
+        "mX",
+    )
+    kinds = param_kinds(spec)
+    assert list(kinds) == list(spec["param_names"])
+    assert kinds["dGC"] == "dG"
+    assert kinds["dGXX"] == "coupling"
+    assert kinds["mX"] == "m"
+
+
+def test_repeat_type_with_underscore():
+    raw = {"repeats": {"R_1": {"dG": "dGR", "m": "mR"}}, "couplings": {}}
+    with pytest.raises(ValueError, match="underscore"):
+        parse_model_spec(raw)
+
+
+def test_coupling_to_unknown_repeat_type(tmp_path):
+    raw = dict(HOMOPOLYMER_SPEC, couplings={"R_X": "dGRX"})
+    path = str(tmp_path / "model.json")
+    with open(path, "w") as f:
+        json.dump(raw, f)
+    with pytest.raises(ValueError, match="'R_X'"):
+        load_model_spec(path)
+
+
+def test_missing_section():
+    with pytest.raises(KeyError):
+        parse_model_spec({"repeats": HOMOPOLYMER_SPEC["repeats"]})
+
+
+def test_spec_model_matches_homopolymer_model():
+    constructs = ["N_R_C", "R_R_R_C", "N_R_R_R_R_C"]
+    spec = parse_model_spec(HOMOPOLYMER_SPEC)
+    assert spec["param_names"] == ("dGN", "dGR", "dGC", "dGinter", "m")
+    denat = np.linspace(0, 8, 17)
+    theta = np.array([6.0, 5.0, 6.0, -12.0, -1.0])
+    np.testing.assert_allclose(
+        spec_model(spec, constructs).frac_folded(
+            theta * [1, 1, 1, 1, -1], denat
+        ),
+        homopolymer_model(constructs).frac_folded(theta, denat),
+        rtol=1e-12,
+    )
+
+    # Constructs may only have interfaces that the spec lists.
+    with pytest.raises(ValueError, match="CN interface"):
+        spec_model(spec, ["C_N"])
@@ -0,0 +1,126 @@
+"""
+Checks the closed-form fraction folded expressions for long homopolymers,
+and the kernels written from them, against the transfer matrix.
+"""
+
+import numpy as np
+import pytest
+import sympy as sp
+
+from ising.codegen import load_kernel_module, write_kernel_module
+from ising.symbolic import check_expressions, check_kernels
+from ising.symbolic import closed_form_log_q, to_numpy_functions
+from ising.transfer_matrix import HOMOPOLYMER_PARAMS, homopolymer_model
+
+CONSTRUCTS = [
+    "N_R_R_R_R_R_R_C",
+    "R_R_R_R_R_R_R_R",
+    "N_" + "_".join(["R"] * 20) + "_C",
+]
+# The R repeats are half folded near denat = 7 in the first parameter set
+# and near 4.7 in the second, where the two eigenvalues of R are closest.
+# dGinter = 0 makes the second eigenvalue 0.
+THETAS = [
+    (6.0, 5.0, 6.0, -12.0, -1.0),
+    (4.0, 3.0, 4.0, -10.0, -1.5),
+    (2.0, 1.5, 2.5, 0.0, 1.0),
+]
+DENAT = np.linspace(0, 10, 41)
+
+
+def closed_form_dict(constructs):
+    """
+    Closed-form fraction folded expression strings, built as in
+    homopolymer_fit/generate_fitting_eqns.py.
+    """
+    dGN, dGR, dGC, dGinter, mi = sp.symbols(HOMOPOLYMER_PARAMS)
+    RT, denat, W, n = sp.symbols("RT denat W n")
+    K = {rpt: sp.Symbol("K" + rpt) for rpt in "NRC"}
+    exp = sp.Function("np.exp")
+    matrices = {
+        rpt: sp.Matrix([[K[rpt] * W, 1], [K[rpt], 1]]) for rpt in "NRC"
+    }
+    subs_dict = {
+        K["N"]: exp(-(dGN - mi * denat) / RT),
+        K["R"]: exp(-(dGR - mi * denat) / RT),
+        K["C"]: exp(-(dGC - mi * denat) / RT),
+        W: exp(-dGinter / RT),
+    }
+    expressions = {}
+    for construct in constructs:
+        repeat_list = construct.split("_")
+        has_N = repeat_list[0] == "N"
+        has_C = repeat_list[-1] == "C"
+        left = sp.Matrix([[0, 1]])
+        if has_N:
+            left = left * matrices["N"]
+        right = sp.Matrix([[1], [1]])
+        if has_C:
+            right = matrices["C"] * right
+        log_q = closed_form_log_q(left, matrices["R"], right, n)
+        num_R = len(repeat_list) - int(has_N) - int(has_C)
+        frac_folded = sum(
+            K[rpt] * sp.diff(log_q, K[rpt]) for rpt in "NRC"
+        ) / len(repeat_list)
+        family = to_numpy_functions(frac_folded.subs(subs_dict), n)
+        expressions[construct + "_frac_folded"] = str(family.subs(n, num_R))
+    return expressions
+
+
+def test_closed_form_matches_transfer_matrix():
+    check_expressions(
+        closed_form_dict(CONSTRUCTS),
+        homopolymer_model(CONSTRUCTS),
+        THETAS,
+        DENAT,
+        tol=1e-10,
+    )
+
+
+def test_closed_form_kernel_jacobian(tmp_path):
+    path = str(tmp_path / "closed_form_kernels.py")
+    write_kernel_module(
+        path, closed_form_dict(CONSTRUCTS), HOMOPOLYMER_PARAMS, "test"
+    )
+    kernels = load_kernel_module(path)
+    model = homopolymer_model(CONSTRUCTS)
+    step = 1e-6
+    for construct in CONSTRUCTS:
+        for theta in THETAS:
+            jacobian = kernels.JACOBIAN[construct](DENAT, *theta, model.RT)
+            for i, derivative in enumerate(jacobian):
+                shift = np.zeros(len(theta))
+                shift[i] = step
+                upper = model.frac_folded(
+                    np.add(theta, shift), DENAT, construct
+                )
+                lower = model.frac_folded(
+                    np.subtract(theta, shift), DENAT, construct
+                )
+                np.testing.assert_allclose(
+                    derivative + np.zeros_like(DENAT),
+                    (upper - lower) / (2 * step),
+                    atol=1e-7,
+                )
+
+
+def test_check_kernels(tmp_path):
+    path = str(tmp_path / "closed_form_kernels.py")
+    write_kernel_module(
+        path, closed_form_dict(CONSTRUCTS), HOMOPOLYMER_PARAMS, "test"
+    )
+    kernels = load_kernel_module(path)
+    model = homopolymer_model(CONSTRUCTS)
+    check_kernels(kernels, model, THETAS, DENAT)
+
+    # A derivative that is slightly off at one denaturant point is refused.
+    jacobian = kernels.JACOBIAN[CONSTRUCTS[0]]
+
+    def wrong_jacobian(denat, *args):
+        derivatives = jacobian(denat, *args)
+        derivatives[1] = derivatives[1] + 1e-4 * (denat == 7.0)
+        return derivatives
+
+    kernels.JACOBIAN[CONSTRUCTS[0]] = wrong_jacobian
+    with pytest.raises(ValueError, match=r"d/d\(dGR\)"):
+        check_kernels(kernels, model, THETAS, DENAT)
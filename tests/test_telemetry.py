@@ -0,0 +1,70 @@
+"""
+Checks the records FitTelemetry keeps for each fit.
+"""
+
+import json
+import time
+from types import SimpleNamespace
+
+from ising.telemetry import FitTelemetry
+
+
+def fit_result(nfev=7):
+    return SimpleNamespace(
+        nfev=nfev, success=True, message="converged", chisqr=1.5
+    )
+
+
+def test_record():
+    telemetry = FitTelemetry()
+    telemetry.start("best fit")
+    for _ in range(3):
+        telemetry.count("objective")
+        with telemetry.timer("objective"):
+            with telemetry.frac_folded_timer("N_R_C"):
+                time.sleep(0.001)
+            with telemetry.timer("baseline_mixing"):
+                pass
+    telemetry.count("jacobian")
+    with telemetry.timer("jacobian"):
+        with telemetry.frac_folded_timer("N_R_C"):
+            pass
+        with telemetry.frac_folded_timer("N_R_R_C"):
+            pass
+    record = telemetry.finish(fit_result())
+
+    assert telemetry.fits == [record]
+    assert record["label"] == "best fit"
+    assert (record["objective_calls"], record["jacobian_calls"]) == (3, 1)
+    assert (record["nfev"], record["success"]) == (7, True)
+    assert (record["message"], record["chisqr"]) == ("converged", 1.5)
+    assert set(record["frac_folded_time"]) == {"N_R_C", "N_R_R_C"}
+    assert record["frac_folded_time"]["N_R_C"] >= 0.003
+    assert record["objective_time"] >= record["frac_folded_time"]["N_R_C"]
+    assert record["fused_residuals_time"] == 0
+    assert record["wall_time"] >= record["objective_time"]
+    assert record["optimizer_overhead"] == (
+        record["wall_time"]
+        - record["objective_time"]
+        - record["jacobian_time"]
+    )
+
+
+def test_start_resets_and_keep(tmp_path):
+    telemetry = FitTelemetry()
+    telemetry.start("best fit")
+    telemetry.count("objective")
+    telemetry.finish(fit_result())
+
+    telemetry.start("bootstrap 1")
+    record = telemetry.finish(fit_result(nfev=2), keep=False)
+    assert record["label"] == "bootstrap 1"
+    assert record["objective_calls"] == 0
+    assert record["frac_folded_time"] == {}
+    assert [fit["label"] for fit in telemetry.fits] == ["best fit"]
+
+    telemetry.fits.append(record)
+    path = str(tmp_path / "telemetry.json")
+    telemetry.write(path)
+    with open(path) as f:
+        assert json.load(f) == {"fits": telemetry.fits}
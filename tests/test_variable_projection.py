@@ -0,0 +1,80 @@
+"""
+Checks that variable projection solves for the baselines the full model
+would fit.
+"""
+
+import numpy as np
+
+from ising.melt_data import MeltDataset
+from ising.variable_projection import projected_residuals, solve_baselines
+
+DENAT = np.linspace(0, 8, 17)
+# af, bf, au and bu for each melt.
+BASELINES = np.array([[0.01, -0.02], [1.0, 0.9], [0.02, 0.01], [0.05, 0.1]])
+
+
+def make_dataset(frac_folded, noise=0.0):
+    melts = ["N_R_C_1", "N_R_R_C_1"]
+    rng = np.random.default_rng(0)
+    arrays = {}
+    for i, melt in enumerate(melts):
+        af, bf, au, bu = BASELINES[:, i]
+        signal = (af * DENAT + bf) * frac_folded[i] + (au * DENAT + bu) * (
+            1 - frac_folded[i]
+        )
+        signal += noise * rng.standard_normal(len(DENAT))
+        arrays[melt] = np.column_stack([DENAT, signal])
+    return MeltDataset.from_melt_arrays(melts, ["N_R_C", "N_R_R_C"], arrays)
+
+
+def sigmoid(midpoint):
+    return 1 / (1 + np.exp(2 * (DENAT - midpoint)))
+
+
+def test_recovers_baselines():
+    frac_folded = [sigmoid(3.0), sigmoid(4.5)]
+    dataset = make_dataset(frac_folded)
+    point_frac_folded = np.concatenate(frac_folded)
+    np.testing.assert_allclose(
+        solve_baselines(dataset, point_frac_folded), BASELINES, atol=1e-10
+    )
+    np.testing.assert_allclose(
+        projected_residuals(dataset, point_frac_folded), 0, atol=1e-12
+    )
+
+
+def test_matches_linear_fit():
+    frac_folded = [sigmoid(3.0), sigmoid(4.5)]
+    dataset = make_dataset(frac_folded, noise=0.02)
+    point_frac_folded = np.concatenate(frac_folded)
+    baselines = solve_baselines(dataset, point_frac_folded)
+    residuals = projected_residuals(dataset, point_frac_folded)
+    for i, melt in enumerate(dataset.melts):
+        rows = dataset.slices[melt]
+        design = np.column_stack(
+            [
+                DENAT * frac_folded[i],
+                frac_folded[i],
+                DENAT * (1 - frac_folded[i]),
+                1 - frac_folded[i],
+            ]
+        )
+        expected, *_ = np.linalg.lstsq(
+            design, dataset.signal[rows], rcond=None
+        )
+        np.testing.assert_allclose(baselines[:, i], expected, rtol=1e-8)
+        np.testing.assert_allclose(
+            residuals[rows],
+            dataset.signal[rows] - design @ expected,
+            atol=1e-12,
+        )
+
+
+def test_melt_that_never_unfolds():
+    # Only the folded baseline is determined, but there is still an answer.
+    frac_folded = [np.ones(len(DENAT)), sigmoid(4.5)]
+    dataset = make_dataset(frac_folded)
+    baselines = solve_baselines(dataset, np.concatenate(frac_folded))
+    assert np.all(np.isfinite(baselines))
+    np.testing.assert_allclose(baselines[:2, 0], BASELINES[:2, 0], atol=1e-10)
+    np.testing.assert_allclose(baselines[:, 1], BASELINES[:, 1], atol=1e-10)